@@ -196,7 +196,10 @@ async deleteCustomSound() {
     try {
         const response = await fetch('/api/delete-notification-sound', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${sessionStorage.getItem('token')}`
+            },
             body: JSON.stringify({ username: this.currentAdmin })
         });
 
@@ -316,6 +319,7 @@ updateCurrentSoundInfo(soundPath) {
 
         const response = await fetch('/api/upload-notification-sound', {
             method: 'POST',
+            headers: { 'Authorization': `Bearer ${sessionStorage.getItem('token')}` },
             body: formData
         });
 
@@ -400,10 +404,13 @@ updateCurrentSoundInfo(soundPath) {
 
     async checkForNewTickets() {
         try {
-            const response = await fetch('http://172.20.8.70:5000/api/admin/tickets');
-            const tickets = await response.json();
+            // Solo los pendientes de este admin: el servidor filtra y pagina
+            const params = new URLSearchParams({ assignee: this.currentAdmin, status: 'PE', limit: 200 });
+            const response = await fetch(`http://172.20.8.70:5000/api/admin/tickets?${params}`);
+            const page = await response.json();
 
             if (!response.ok) throw new Error('Error al obtener tickets');
+            const tickets = page.tickets;
 
             const newTickets = tickets.filter(ticket => 
                 ticket.ticket_asignado_a === this.currentAdmin && 
@@ -910,9 +917,10 @@ async function loadTickets() {
             await loadAllUsers();
         }
         
-        const response = await fetch('/api/admin/tickets');
+        // Solo la página más reciente: la lista completa crece con el historial
+        const response = await fetch('/api/admin/tickets?limit=50');
         if (response.ok) {
-            const tickets = await response.json();
+            const tickets = (await response.json()).tickets;
             renderTickets(tickets);
             updateStats(tickets);
         } else {
@@ -958,7 +966,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- CONEXIÓN WEBSOCKET ---
-    const socket = io('http://172.20.8.70:5000');
+    // Solo WebSocket: con varios workers el sondeo largo necesitaría sesiones fijas en el balanceador
+    const socket = io('http://172.20.8.70:5000', { transports: ['websocket'] });
     
     // Cuando se conecta el WebSocket
     socket.on('connect', () => {
@@ -966,8 +975,63 @@ document.addEventListener('DOMContentLoaded', () => {
         
         // Registrar al admin como "en línea"
         socket.emit('admin_online', { 
-            username: user.username 
+            username: user.username,
+            token: sessionStorage.getItem('token')
         });
+
+        // Tras una reconexión, pedir los eventos de tickets que se perdieron
+        if (ticketEventStream !== null) {
+            socket.emit('resume_ticket_events', {
+                username: user.username,
+                token: sessionStorage.getItem('token'),
+                stream: ticketEventStream,
+                seq: lastTicketEventSeq
+            });
+        }
+    });
+
+    // --- EVENTOS DE TICKETS EN TIEMPO REAL ---
+    let ticketEventStream = null;
+    let lastTicketEventSeq = 0;
+
+    function applyTicketEvent(event) {
+        if (event.stream !== ticketEventStream) {
+            ticketEventStream = event.stream;
+        } else if (event.seq <= lastTicketEventSeq) {
+            return false;
+        }
+        lastTicketEventSeq = event.seq;
+
+        if (event.type === 'created') {
+            ticketCache.set(event.ticket_id, event.changes);
+        } else if (event.type !== 'attachment_added') {
+            const ticket = ticketCache.get(event.ticket_id);
+            if (ticket) Object.assign(ticket, event.changes);
+        }
+        return true;
+    }
+
+    function rerenderFromCache() {
+        const activeFilter = document.querySelector('.filter-btn.active');
+        const tickets = cachedTickets();
+        renderTickets(tickets, activeFilter ? activeFilter.dataset.filter : 'all');
+        updateStats(tickets);
+    }
+
+    socket.on('ticket_event', (event) => {
+        if (applyTicketEvent(event)) rerenderFromCache();
+    });
+
+    socket.on('ticket_events_replay', (replay) => {
+        if (replay.reset) {
+            ticketEventStream = replay.stream;
+            lastTicketEventSeq = replay.seq;
+            ticketWatermark = null;
+            fetchTickets(document.querySelector('.filter-btn.active')?.dataset.filter || 'all');
+            return;
+        }
+        replay.events.forEach(applyTicketEvent);
+        rerenderFromCache();
     });
 
     // Escuchar notificaciones de nuevos tickets
@@ -992,6 +1056,31 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Notificaciones que llegaron mientras no había ninguna consola abierta (un solo lote)
+    let lastInboxId = 0;
+    socket.on('notification_inbox', (batch) => {
+        if (batch.last_id > lastInboxId) {
+            lastInboxId = batch.last_id;
+            if (window.notificationSystem) {
+                const single = batch.count === 1 ? batch.notifications[0] : null;
+                window.notificationSystem.addNotification({
+                    type: 'new_ticket',
+                    title: single ? single.title : `🎫 ${batch.count} tickets asignados`,
+                    message: single ? single.message : `Se te asignaron ${batch.count} tickets mientras estabas desconectado`,
+                    ticketId: single ? single.ticket_id : null,
+                    timestamp: new Date().toISOString(),
+                    read: false
+                });
+            }
+            fetchTickets();
+        }
+        socket.emit('ack_notifications', {
+            username: user.username,
+            token: sessionStorage.getItem('token'),
+            last_id: batch.last_id
+        });
+    });
+
     // Manejar desconexión
     socket.on('disconnect', () => {
         console.log('❌ Desconectado del servidor WebSocket');
@@ -1038,16 +1127,97 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Copia local de los tickets por páginas (cursor): al abrir se pide solo la primera y las
+    // anteriores al llegar al final de la tabla. Luego solo se piden los cambios posteriores a la
+    // marca de agua (el servidor responde 304 si no hubo ninguno) y se aplican a las páginas cargadas
+    const TICKET_PAGE_SIZE = 50;
+    const ticketCache = new Map();
+    let ticketWatermark = null;
+    let nextTicketCursor = null;
+    let oldestLoadedTicket = null;
+    let loadingOlderTickets = false;
+
+    async function fetchTicketPage(cursor) {
+        const params = new URLSearchParams({ limit: TICKET_PAGE_SIZE });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`${ADMIN_API_URL}/tickets?${params}`);
+        const page = await response.json();
+        if (!response.ok) {
+            throw new Error(page.error || 'No se pudieron cargar los tickets.');
+        }
+        page.tickets.forEach(ticket => ticketCache.set(ticket.ticket_id_ticket, ticket));
+        if (page.tickets.length > 0) oldestLoadedTicket = page.tickets[page.tickets.length - 1];
+        nextTicketCursor = page.next_cursor;
+        return page;
+    }
+
+    // Un cambio de un ticket más antiguo que lo cargado llegará con su página, no antes
+    function isInLoadedPages(ticket) {
+        if (nextTicketCursor === null || oldestLoadedTicket === null) return true;
+        const date = new Date(ticket.ticket_fec_ticket).getTime();
+        const oldest = new Date(oldestLoadedTicket.ticket_fec_ticket).getTime();
+        return date > oldest || (date === oldest && ticket.ticket_cod_ticket >= oldestLoadedTicket.ticket_cod_ticket);
+    }
+
+    async function syncTickets() {
+        if (ticketWatermark === null) {
+            ticketCache.clear();
+            oldestLoadedTicket = null;
+            const page = await fetchTicketPage(null);
+            ticketWatermark = page.watermark;
+            return;
+        }
+
+        const response = await fetch(`${ADMIN_API_URL}/tickets?since=${ticketWatermark}`);
+        if (response.status === 304) return;
+        const delta = await response.json();
+        if (!response.ok) {
+            throw new Error(delta.error || 'No se pudieron cargar los tickets.');
+        }
+        if (delta.reset) {
+            ticketWatermark = null;
+            return syncTickets();
+        }
+        delta.tickets.forEach(ticket => {
+            if (ticketCache.has(ticket.ticket_id_ticket) || isInLoadedPages(ticket)) {
+                ticketCache.set(ticket.ticket_id_ticket, ticket);
+            }
+        });
+        delta.deleted.forEach(ticketId => ticketCache.delete(ticketId));
+        ticketWatermark = delta.watermark;
+    }
+
+    async function loadOlderTickets() {
+        if (loadingOlderTickets || nextTicketCursor === null || ticketWatermark === null) return;
+        loadingOlderTickets = true;
+        try {
+            await fetchTicketPage(nextTicketCursor);
+            rerenderFromCache();
+        } catch (error) {
+            console.error('Error al cargar tickets anteriores:', error);
+        } finally {
+            loadingOlderTickets = false;
+        }
+    }
+
+    // La fila "Cargar tickets anteriores" pide la siguiente página al hacerse visible
+    const olderTicketsObserver = 'IntersectionObserver' in window
+        ? new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadOlderTickets();
+        }, { rootMargin: '200px' })
+        : null;
+
+    function cachedTickets() {
+        return [...ticketCache.values()].sort((a, b) =>
+            new Date(b.ticket_fec_ticket) - new Date(a.ticket_fec_ticket));
+    }
+
     async function fetchTickets(filter = 'all') {
         try {
-            showLoadingState();
+            if (ticketWatermark === null) showLoadingState();
             
-            const response = await fetch(`${ADMIN_API_URL}/tickets`);
-            const tickets = await response.json();
-
-            if (!response.ok) {
-                throw new Error(tickets.error || 'No se pudieron cargar los tickets.');
-            }
+            await syncTickets();
+            const tickets = cachedTickets();
             
             renderTickets(tickets, filter);
             updateStats(tickets);
@@ -1076,6 +1246,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function renderTickets(tickets, filter = 'all') {
+        if (olderTicketsObserver) olderTicketsObserver.disconnect();
         if (tickets.length === 0) {
             ticketList.innerHTML = `
                 <tr>
@@ -1093,9 +1264,18 @@ document.addEventListener('DOMContentLoaded', () => {
             filteredTickets = tickets.filter(ticket => ticket.ticket_est_ticket.trim() === filter);
         }
 
+        // Tickets abiertos por incidente: los grupos de 2 o más se pueden finalizar juntos
+        const openByIncident = {};
+        tickets.forEach(ticket => {
+            if (ticket.ticket_incidente && ticket.ticket_est_ticket.trim() !== 'FN') {
+                openByIncident[ticket.ticket_incidente] = (openByIncident[ticket.ticket_incidente] || 0) + 1;
+            }
+        });
+
         let ticketsHTML = '';
         filteredTickets.forEach(ticket => {
             const statusClass = `status-${ticket.ticket_est_ticket.trim()}`;
+            const incidentSize = openByIncident[ticket.ticket_incidente] || 0;
             const statusText = getStatusText(ticket.ticket_est_ticket);
             const ticketDate = ticket.ticket_fec_ticket ? new Date(ticket.ticket_fec_ticket).toLocaleDateString() : 'N/A';
             let assignDropdownHTML = '<span>N/A</span>';
@@ -1125,18 +1305,44 @@ document.addEventListener('DOMContentLoaded', () => {
                             </button>` : 
                             '<span>-</span>'
                         }
+                        ${ticket.ticket_est_ticket.trim() !== 'FN' && incidentSize > 1 ?
+                            `<button class="action-btn btn-close-incident" data-incident="${ticket.ticket_incidente}"
+                                     title="Incidente ${ticket.ticket_incidente}">
+                                <i class="fas fa-layer-group"></i> Finalizar incidente (${incidentSize})
+                            </button>` : ''
+                        }
                     </td>
                 </tr>
             `;
         });
         
+        if (nextTicketCursor !== null) {
+            ticketsHTML += `
+                <tr id="loadOlderTickets" class="load-more-row">
+                    <td colspan="7" style="text-align: center; padding: 16px; cursor: pointer;">
+                        <i class="fas fa-chevron-down"></i> Cargar tickets anteriores
+                    </td>
+                </tr>
+            `;
+        }
+        
         ticketList.innerHTML = ticketsHTML;
+
+        const loadOlderRow = document.getElementById('loadOlderTickets');
+        if (loadOlderRow) {
+            loadOlderRow.addEventListener('click', loadOlderTickets);
+            if (olderTicketsObserver) olderTicketsObserver.observe(loadOlderRow);
+        }
         
         // Add event listeners to action buttons
         document.querySelectorAll('.btn-close').forEach(button => {
             button.addEventListener('click', handleTicketAction);
         });
 
+        document.querySelectorAll('.btn-close-incident').forEach(button => {
+            button.addEventListener('click', handleIncidentAction);
+        });
+
         // Add event listeners for assign dropdowns
         document.querySelectorAll('.assign-dropdown').forEach(dropdown => {
             dropdown.addEventListener('change', handleAssignChange);
@@ -1206,14 +1412,56 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function updateStats(tickets) {
-        totalTickets.textContent = tickets.length;
-        
-        const pending = tickets.filter(ticket => ticket.ticket_est_ticket.trim() === 'PE').length;
-        const finished = tickets.filter(ticket => ticket.ticket_est_ticket.trim() === 'FN').length;
-        
-        pendingTickets.textContent = pending;
-        finishedTickets.textContent = finished;
+    async function handleIncidentAction(e) {
+        const incidentId = e.currentTarget.dataset.incident;
+        const button = e.currentTarget;
+        if (!confirm(`¿Finalizar todos los tickets abiertos del incidente ${incidentId}?`)) return;
+
+        const originalHTML = button.innerHTML;
+        button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Procesando...';
+        button.disabled = true;
+
+        try {
+            const response = await fetch(`http://172.20.8.70:5000/api/admin/incidents/${encodeURIComponent(incidentId)}/resolve`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ status: 'FN' })
+            });
+
+            if (!response.ok) {
+                const result = await response.json();
+                throw new Error(result.error || 'Error al finalizar el incidente.');
+            }
+
+            fetchTickets(document.querySelector('.filter-btn.active').dataset.filter);
+
+        } catch (error) {
+            alert(`Error: ${error.message}`);
+            button.innerHTML = originalHTML;
+            button.disabled = false;
+        }
+    }
+
+    // Los totales salen del resumen diario de reportes: no dependen de cuántas páginas se cargaron.
+    // Varios cambios seguidos (eventos) piden un solo resumen.
+    let statsTimer = null;
+
+    function updateStats() {
+        clearTimeout(statsTimer);
+        statsTimer = setTimeout(refreshStats, 1000);
+    }
+
+    async function refreshStats() {
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/reports/summary?granularity=month`);
+            const summary = await response.json();
+            if (!response.ok) throw new Error(summary.error || 'No se pudieron cargar los totales.');
+            totalTickets.textContent = summary.total.tickets;
+            pendingTickets.textContent = summary.by_status.PE ? summary.by_status.PE.tickets : 0;
+            finishedTickets.textContent = summary.by_status.FN ? summary.by_status.FN.tickets : 0;
+        } catch (error) {
+            console.error('Error al cargar los totales de tickets:', error);
+        }
     }
 
     // --- EVENT LISTENERS ---
@@ -1258,6 +1506,6 @@ document.addEventListener('DOMContentLoaded', () => {
     
     initialize();
 
-    // Opcional: Recargar automáticamente cada 30 segundos
-    setInterval(fetchTickets, 30000);
+    // Los cambios llegan por 'ticket_event'; el sondeo queda como respaldo poco frecuente
+    setInterval(fetchTickets, 120000);
 });
\ No newline at end of file
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+
+
+class AdminRoster:
+    """
+    Caché en memoria de la lista de administradores (Informix cambia muy poco).
+
+    - get() devuelve la lista cacheada; si venció la devuelve igual y la refresca en segundo plano.
+    - Solo la primera carga (caché vacía) espera a Informix.
+    - Si una recarga falla se conserva la última lista buena.
+    - invalidate() fuerza una recarga inmediata en segundo plano.
+    """
+
+    def __init__(self, loader, ttl=600.0, refresh_interval=None):
+        self._loader = loader
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval or ttl / 2
+        self._admins = None
+        self._loaded_at = 0.0
+        self._expires_at = 0.0
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._refreshing = False
+        self._thread = None
+        self._hits = 0
+        self._misses = 0
+        self._errors = 0
+
+    def get(self):
+        """Lista de administradores: [{"user_code": ..., "username": ...}]"""
+        with self._state_lock:
+            admins = self._admins
+            expired = time.monotonic() >= self._expires_at
+            if admins is not None:
+                self._hits += 1
+        if admins is None:
+            with self._state_lock:
+                self._misses += 1
+            return list(self.refresh())
+        if expired:
+            self._refresh_async()
+        return list(admins)
+
+    def usernames(self):
+        return [admin['username'] for admin in self.get()]
+
+    def refresh(self, force=False):
+        """Recargar desde el origen. Devuelve la lista vigente (nueva o la anterior si falla)."""
+        with self._load_lock:
+            # Si otro hilo acaba de cargar mientras esperábamos, no repetir la consulta
+            with self._state_lock:
+                if not force and self._admins is not None and time.monotonic() < self._expires_at:
+                    return self._admins
+            try:
+                admins = self._loader()
+            except Exception as e:
+                with self._state_lock:
+                    self._errors += 1
+                    current = self._admins
+                logging.error(f"No se pudo refrescar la lista de administradores: {e}")
+                if current is None:
+                    raise
+                return current
+            with self._state_lock:
+                self._admins = admins
+                self._loaded_at = time.monotonic()
+                self._expires_at = self._loaded_at + self.ttl
+            return admins
+
+    def invalidate(self):
+        """Marcar la caché como vencida y recargarla en segundo plano."""
+        with self._state_lock:
+            self._expires_at = 0.0
+        self._refresh_async()
+
+    def start(self):
+        """Arrancar el hilo que mantiene la caché caliente antes de que venza."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='admin-roster', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        with self._state_lock:
+            return {
+                "admins": len(self._admins) if self._admins is not None else None,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._admins is not None else None,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "errors": self._errors,
+            }
+
+    def _refresh_async(self):
+        with self._state_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
+        finally:
+            with self._state_lock:
+                self._refreshing = False
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh(force=True)
+            except Exception:
+                pass
+            time.sleep(self.refresh_interval)
@@ -1,17 +1,50 @@
-from flask import Flask, jsonify, request, send_from_directory, redirect, url_for, send_file
+import os
+
+# En modo eventlet las librerías estándar deben parcharse antes de cualquier otro import
+# (gunicorn -k eventlet ya lo hace; esto cubre el arranque con "python app.py")
+if os.getenv("SOCKETIO_ASYNC_MODE", "threading") == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Request, jsonify, request, send_from_directory, Response
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 import psycopg2
 import psycopg2.extras
 import pyodbc
-import os
 import datetime
 import logging
 from crypto_utils import decrypt_password
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import threading
 import time
+import atexit
 from werkzeug.utils import secure_filename
 import uuid
+import zlib
+import csv
+import io
+import json
+import re
+from db_pool import ConnectionPool, CircuitBreaker, CircuitOpenError
+from batch_writer import BatchWriter
+from auth import CredentialCache, SessionTokens
+from presence import create_presence, admin_room
+from attachment_store import HashingTempFile, AttachmentStore, file_sha256, sweep_temp_files
+from thumbnails import ThumbnailGenerator
+from sound_registry import SoundRegistry
+from kb_search import KnowledgeBaseIndex, documents_from_knowledge_base, documents_from_policies
+from ticket_deflection import DeflectionIndex
+from incident_clusters import IncidentIndex
+from file_serving import FileMetadataCache, create_invalidation_channel, describe_file, serve_file, guess_mimetype, INLINE_MIME_TYPES
+from admin_roster import AdminRoster
+from workload import WorkloadIndex
+from schema import apply_schema
+import ticket_queries
+import reports
+import ticket_events
+import notification_inbox
+from ticket_events import create_ticket_stream
 
 
 # --- Configuración ---
@@ -20,7 +53,19 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 logging.basicConfig(level=logging.INFO)
 
 
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# threading: un solo proceso (desarrollo). eventlet: producción con varios workers de gunicorn;
+# en ese caso SOCKETIO_MESSAGE_QUEUE (redis://...) reparte los emits entre workers y
+# PRESENCE_URL comparte el registro de administradores conectados y TICKET_EVENTS_URL la
+# secuencia de eventos de tickets (para que un cliente pueda reanudar en cualquier worker).
+SOCKETIO_ASYNC_MODE = os.getenv("SOCKETIO_ASYNC_MODE", "threading")
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE") or None
+PRESENCE_URL = os.getenv("PRESENCE_URL", SOCKETIO_MESSAGE_QUEUE or "")
+TICKET_EVENTS_URL = os.getenv("TICKET_EVENTS_URL", SOCKETIO_MESSAGE_QUEUE or "")
+
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE,
+                    message_queue=SOCKETIO_MESSAGE_QUEUE)
+# Eventos de cambios en tickets para las consolas abiertas (sustituye al sondeo)
+ticket_stream = create_ticket_stream(socketio, TICKET_EVENTS_URL)
 NOTIFICATION_SOUNDS_FOLDER = 'static/notification_sounds'
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'm4a'}
 
@@ -33,10 +78,156 @@ INFORMIX_URI = (
     f"PROTOCOL=onsoctcp;SERVICE=;UID=;PWD=;"
 )
 
+# --- Pool de conexiones PostgreSQL ---
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "2"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "20"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "5"))          # segundos esperando una conexión libre
+PG_CONNECT_TIMEOUT = int(os.getenv("PG_CONNECT_TIMEOUT", "5"))      # segundos para abrir una conexión nueva
+PG_POOL_VALIDATE_AFTER = float(os.getenv("PG_POOL_VALIDATE_AFTER", "30"))
+
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    from eventlet import tpool
+    from eventlet.hubs import trampoline
+
+    def _eventlet_wait_callback(conn):
+        """Esperar a psycopg2 cediendo el control al hub de eventlet en lugar de bloquear el worker"""
+        while True:
+            state = conn.poll()
+            if state == psycopg2.extensions.POLL_OK:
+                break
+            elif state == psycopg2.extensions.POLL_READ:
+                trampoline(conn.fileno(), read=True)
+            elif state == psycopg2.extensions.POLL_WRITE:
+                trampoline(conn.fileno(), write=True)
+            else:
+                raise psycopg2.OperationalError(f"Estado de poll inesperado: {state}")
+
+    psycopg2.extensions.set_wait_callback(_eventlet_wait_callback)
+
+    def run_blocking(func, *args, **kwargs):
+        """pyodbc no coopera con eventlet: sus llamadas se ejecutan en el pool de hilos nativos"""
+        return tpool.execute(func, *args, **kwargs)
+else:
+    def run_blocking(func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+def _validate_postgres_connection(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    conn.rollback()
+
+pg_pool = ConnectionPool(
+    'postgres',
+    connect=lambda: psycopg2.connect(POSTGRES_URL, connect_timeout=PG_CONNECT_TIMEOUT),
+    minconn=PG_POOL_MIN,
+    maxconn=PG_POOL_MAX,
+    timeout=PG_POOL_TIMEOUT,
+    validate=_validate_postgres_connection,
+    validate_after=PG_POOL_VALIDATE_AFTER,
+    reset=lambda conn: conn.rollback(),
+)
+
+# --- Pool de conexiones Informix ---
+INFORMIX_POOL_MIN = int(os.getenv("INFORMIX_POOL_MIN", "1"))
+INFORMIX_POOL_MAX = int(os.getenv("INFORMIX_POOL_MAX", "5"))
+INFORMIX_POOL_TIMEOUT = float(os.getenv("INFORMIX_POOL_TIMEOUT", "3"))
+INFORMIX_CONNECT_TIMEOUT = int(os.getenv("INFORMIX_CONNECT_TIMEOUT", "5"))   # segundos de login ODBC
+INFORMIX_QUERY_TIMEOUT = int(os.getenv("INFORMIX_QUERY_TIMEOUT", "10"))      # segundos por consulta
+INFORMIX_BREAKER_FAILURES = int(os.getenv("INFORMIX_BREAKER_FAILURES", "3"))
+INFORMIX_BREAKER_RESET = float(os.getenv("INFORMIX_BREAKER_RESET", "30"))
+
+def _open_informix_connection():
+    conn = run_blocking(pyodbc.connect, INFORMIX_URI, timeout=INFORMIX_CONNECT_TIMEOUT, autocommit=True)
+    conn.timeout = INFORMIX_QUERY_TIMEOUT
+    return conn
+
+def _fetch_informix(conn, sql, params=()):
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        return [tuple(row) for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+def _validate_informix_connection(conn):
+    run_blocking(_fetch_informix, conn, "SELECT 1 FROM systables WHERE tabid = 1")
+
+informix_breaker = CircuitBreaker('informix', failure_threshold=INFORMIX_BREAKER_FAILURES,
+                                  reset_timeout=INFORMIX_BREAKER_RESET)
+informix_pool = ConnectionPool(
+    'informix',
+    connect=_open_informix_connection,
+    minconn=INFORMIX_POOL_MIN,
+    maxconn=INFORMIX_POOL_MAX,
+    timeout=INFORMIX_POOL_TIMEOUT,
+    validate=_validate_informix_connection,
+    validate_after=10.0,
+    breaker=informix_breaker,
+)
+
+# Últimos resultados buenos de Informix, usados cuando el servidor no responde
+informix_last_good = {}
+informix_last_good_lock = threading.Lock()
+
+# Los índices que se cargan desde la BD esperan a que el esquema (columnas nuevas) esté aplicado
+schema_ready = threading.Event()
+
+def _prepare_postgres():
+    try:
+        apply_schema(lambda: psycopg2.connect(POSTGRES_URL, connect_timeout=PG_CONNECT_TIMEOUT))
+    finally:
+        schema_ready.set()
+    pg_pool.warm()
+
+# Preparar esquema y precalentar en segundo plano para no bloquear el arranque si la BD no responde
+threading.Thread(target=_prepare_postgres, daemon=True).start()
+threading.Thread(target=informix_pool.warm, daemon=True).start()
+
 # --- Configuración de Archivos ---
 UPLOAD_FOLDER = 'uploads'
+UPLOAD_TMP_FOLDER = os.path.join(UPLOAD_FOLDER, '.tmp')
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'zip', 'rar'}
-MAX_FILE_SIZE = 64 * 1024 * 1024  # 16MB
+MAX_FILE_SIZE = 64 * 1024 * 1024  # 64MB
+# Límite por petición: el archivo más el margen de los encabezados multipart y campos del formulario.
+# Werkzeug rechaza con 413 antes de leer el cuerpo si Content-Length lo supera.
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 1024 * 1024
+
+class UploadRequest(Request):
+    """Los adjuntos de tickets se escriben a disco (con su hash) mientras llegan, sin copia intermedia"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'upload_file':
+            stream = HashingTempFile(UPLOAD_TMP_FOLDER, max_size=MAX_FILE_SIZE)
+            # Si el parser aborta (413, cliente que corta) el temporal no llega a request.files
+            self.upload_streams = getattr(self, 'upload_streams', []) + [stream]
+            return stream
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app.request_class = UploadRequest
+
+@app.teardown_request
+def discard_upload_streams(exc):
+    """Borrar los temporales de subida que no se movieron al almacén (close() no toca los ya guardados)"""
+    for stream in getattr(request, 'upload_streams', ()):
+        stream.close()
+
+# Temporales de subidas cortadas por una caída del proceso; una hora deja en paz las subidas en curso
+UPLOAD_TMP_MAX_AGE = int(os.getenv("UPLOAD_TMP_MAX_AGE", "3600"))
+_swept = sweep_temp_files(UPLOAD_TMP_FOLDER, UPLOAD_TMP_MAX_AGE)
+if _swept:
+    logging.info(f"Se borraron {_swept} temporales de subidas incompletas en {UPLOAD_TMP_FOLDER}")
+
+# Los adjuntos se guardan una sola vez por contenido (ver attachment_store.AttachmentStore)
+attachment_store = AttachmentStore(UPLOAD_FOLDER)
+# Miniaturas de imágenes y PDFs para las vistas previas de las listas
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Espera máxima de una petición por una miniatura que falta; después responde 503 con Retry-After
+THUMBNAIL_WAIT = float(os.getenv("THUMBNAIL_WAIT", "1"))
+thumbnails = ThumbnailGenerator(max_workers=THUMBNAIL_WORKERS, run=run_blocking)
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(e):
+    return jsonify({"error": f"Archivo demasiado grande. Máximo: {MAX_FILE_SIZE//1024//1024}MB"}), 413
 
 
 
@@ -46,24 +237,60 @@ os.makedirs(NOTIFICATION_SOUNDS_FOLDER, exist_ok=True)
 def allowed_audio_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_AUDIO_EXTENSIONS
+# Sonido personalizado de cada administrador (índice en memoria, persistido en la carpeta)
+sound_registry = SoundRegistry(NOTIFICATION_SOUNDS_FOLDER)
+
 @app.route('/static/notification_sounds/<path:filename>')
 def serve_notification_sound(filename):
-    return send_from_directory(NOTIFICATION_SOUNDS_FOLDER, filename)
-connected_admins = {}
+    # Los nombres dependen del contenido: un sonido nuevo tiene otra URL
+    response = send_from_directory(NOTIFICATION_SOUNDS_FOLDER, filename, max_age=365 * 24 * 3600)
+    response.cache_control.immutable = True
+    return response
+# Administradores conectados (compartido entre workers si PRESENCE_URL apunta a Redis)
+connected_admins = create_presence(PRESENCE_URL)
+atexit.register(connected_admins.close)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def get_postgres_connection():
-    try: return psycopg2.connect(POSTGRES_URL)
+    """Prestar una conexión del pool; conn.close() la devuelve al pool"""
+    return pg_pool.connection()
+
+def informix_query(sql, params=(), cache_key=None):
+    """
+    Ejecutar una consulta de lectura en Informix con el pool y el disyuntor.
+    Si se indica cache_key y el servidor falla (o el circuito está abierto),
+    devuelve el último resultado bueno guardado bajo esa llave en lugar de fallar.
+    """
+    try:
+        conn = informix_pool.acquire()
     except Exception as e:
-        logging.error(f"Error de conexión a PostgreSQL: {e}")
-        return None
+        return _informix_fallback(cache_key, e)
 
-def get_informix_connection():
-    try: return pyodbc.connect(INFORMIX_URI)
+    try:
+        rows = run_blocking(_fetch_informix, conn, sql, params)
     except Exception as e:
-        logging.error(f"Error de conexión a Informix: {e}")
-        return None
+        informix_breaker.record_failure()
+        conn.discard()
+        return _informix_fallback(cache_key, e)
+
+    informix_breaker.record_success()
+    conn.close()
+    if cache_key:
+        with informix_last_good_lock:
+            informix_last_good[cache_key] = rows
+    return rows
+
+def _informix_fallback(cache_key, error):
+    if cache_key:
+        with informix_last_good_lock:
+            rows = informix_last_good.get(cache_key)
+        if rows is not None:
+            logging.warning(f"Informix no disponible ({error}); usando último resultado bueno de '{cache_key}'")
+            return rows
+    if not isinstance(error, CircuitOpenError):
+        logging.error(f"Error de consulta en Informix: {error}")
+    raise error
 
 def format_file_size(size_bytes):
     """Convertir bytes a formato legible"""
@@ -88,42 +315,129 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     logging.info(f'Cliente desconectado: {request.sid}')
-    # Remover de connected_admins si está presente
-    for admin, sid in list(connected_admins.items()):
-        if sid == request.sid:
-            del connected_admins[admin]
-            logging.info(f'Administrador {admin} desconectado')
-            break
+    admin, remaining = connected_admins.remove_sid(request.sid)
+    if admin:
+        logging.info(f'Administrador {admin} desconectado ({remaining} conexiones abiertas)')
 
 @socketio.on('admin_online')
 def handle_admin_online(data):
     admin_username = data.get('username')
-    if admin_username:
-        connected_admins[admin_username] = request.sid
-        logging.info(f'Administrador {admin_username} en línea (SID: {request.sid})')
+    if admin_username and socket_user(data, admin_username, admin=True):
+        join_room(admin_room(admin_username))
+        join_room(ticket_events.ADMINS_ROOM)
+        sessions = connected_admins.add(admin_username, request.sid)
+        logging.info(f'Administrador {admin_username} en línea (SID: {request.sid}, {sessions} conexiones)')
         emit('admin_status', {'status': 'online', 'message': 'Estado actualizado'})
+        replay_notification_inbox(admin_username, to=request.sid)
 
 @socketio.on('join_admin_room')
 def handle_join_admin_room(data):
     admin_username = data.get('username')
-    if admin_username:
-        connected_admins[admin_username] = request.sid
+    if admin_username and socket_user(data, admin_username, admin=True):
+        join_room(admin_room(admin_username))
+        join_room(ticket_events.ADMINS_ROOM)
+        connected_admins.add(admin_username, request.sid)
         logging.info(f'Administrador {admin_username} unido a la sala')
+        replay_notification_inbox(admin_username, to=request.sid)
+
+@socketio.on('join_user_room')
+def handle_join_user_room(data):
+    """Un usuario se suscribe a los eventos de sus propios tickets"""
+    username = data.get('username')
+    if username and socket_user(data, username):
+        join_room(ticket_events.user_room(username))
+
+@socketio.on('resume_ticket_events')
+def handle_resume_ticket_events(data):
+    """Reenviar los eventos perdidos desde 'seq' (o pedir recarga completa con reset=True)"""
+    since = data.get('seq') or 0
+    user = session_user(data.get('token') or '')
+    if not user or user['username'] != data.get('username'):
+        return
+    # Los administradores reciben todo el flujo; el resto, solo los eventos de sus tickets
+    requester = None if user['rol'] == 'admin' else user['username']
+    emit('ticket_events_replay', ticket_stream.replay(data.get('stream'), int(since), requester))
 
 def send_notification_to_admin(admin_username, notification_data):
-    """Función para enviar notificación a un administrador específico"""
-    if admin_username in connected_admins:
+    """
+    Enviar una notificación a todas las consolas abiertas de un administrador.
+    Si no tiene ninguna, se guarda en su bandeja y se entrega cuando se conecte.
+    """
+    sessions = connected_admins.sessions(admin_username)
+    if sessions:
         try:
-            sid = connected_admins[admin_username]
-            socketio.emit('new_ticket_notification', notification_data, room=sid)
-            logging.info(f'Notificación enviada al administrador: {admin_username}')
+            # Con cola de mensajes el emit llega al worker que tenga cada conexión
+            socketio.emit('new_ticket_notification', notification_data, to=admin_room(admin_username))
+            logging.info(f'Notificación enviada al administrador: {admin_username} ({sessions} conexiones)')
             return True
         except Exception as e:
             logging.error(f"Error enviando notificación a {admin_username}: {e}")
-            return False
     else:
-        logging.info(f'Administrador {admin_username} no está conectado. Notificación no enviada.')
-        return False
+        logging.info(f'Administrador {admin_username} no está conectado. Notificación guardada en su bandeja.')
+    store_pending_notification(admin_username, notification_data)
+    # Pudo conectarse mientras se guardaba: entregarle la bandeja ahora
+    if connected_admins.sessions(admin_username):
+        replay_notification_inbox(admin_username)
+    return False
+
+def store_pending_notification(admin_username, notification_data):
+    conn = get_postgres_connection()
+    if not conn:
+        logging.error(f"Notificación para {admin_username} perdida: sin conexión a la base de datos")
+        return
+    try:
+        with conn.cursor() as cur:
+            notification_inbox.store(cur, admin_username, notification_data)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error guardando notificación pendiente para {admin_username}: {e}")
+    finally:
+        conn.close()
+
+def replay_notification_inbox(admin_username, to=None, after_id=0):
+    """
+    Entregar las notificaciones pendientes en un solo evento 'notification_inbox'.
+    Se borran cuando el cliente confirma con 'ack_notifications'.
+    """
+    conn = get_postgres_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            batch = notification_inbox.pending(cur, admin_username, after_id)
+        conn.rollback()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error leyendo notificaciones pendientes de {admin_username}: {e}")
+        return
+    finally:
+        conn.close()
+    if batch:
+        socketio.emit('notification_inbox', batch, to=to or admin_room(admin_username))
+
+@socketio.on('ack_notifications')
+def handle_ack_notifications(data):
+    """El cliente confirma las notificaciones recibidas hasta last_id; si quedan más, se envía el siguiente lote"""
+    admin_username = data.get('username')
+    last_id = data.get('last_id')
+    if not admin_username or not isinstance(last_id, int) or not socket_user(data, admin_username, admin=True):
+        return
+    conn = get_postgres_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            notification_inbox.ack(cur, admin_username, last_id)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error confirmando notificaciones de {admin_username}: {e}")
+        return
+    finally:
+        conn.close()
+    replay_notification_inbox(admin_username, to=request.sid, after_id=last_id)
+
 @app.route('/api/upload-notification-sound', methods=['POST'])
 def upload_notification_sound():
     try:
@@ -141,29 +455,20 @@ def upload_notification_sound():
         
         if not username:
             return jsonify({"error": "Nombre de usuario requerido"}), 400
+        denied = claimed_user_error(username)
+        if denied:
+            return denied
         
         if file.filename == '':
             return jsonify({"error": "Nombre de archivo vacío"}), 400
         
         if file and allowed_audio_file(file.filename):
-            # Eliminar sonido anterior del usuario si existe
-            user_sound_pattern = f"{username}_*"
-            for existing_file in os.listdir(NOTIFICATION_SOUNDS_FOLDER):
-                if existing_file.startswith(f"{username}_"):
-                    old_path = os.path.join(NOTIFICATION_SOUNDS_FOLDER, existing_file)
-                    os.remove(old_path)
-                    print(f"🗑️ Sonido anterior eliminado: {existing_file}")
-            
-            # Generar nombre único para el archivo
+            # Guardar con nombre según el contenido; reemplaza el sonido anterior del usuario
             file_extension = file.filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{username}_{uuid.uuid4().hex}.{file_extension}"
-            file_path = os.path.join(NOTIFICATION_SOUNDS_FOLDER, unique_filename)
-            
-            # Guardar archivo
-            file.save(file_path)
+            unique_filename = sound_registry.set(secure_filename(username), file.stream, file_extension)
             
             # Devolver la ruta relativa para el frontend
-            relative_path = f"/{file_path}"
+            relative_path = f"/{NOTIFICATION_SOUNDS_FOLDER}/{unique_filename}"
             
             print(f"✅ Sonido guardado: {unique_filename}")
             
@@ -190,14 +495,13 @@ def delete_notification_sound():
         
         if not username:
             return jsonify({"error": "Nombre de usuario requerido"}), 400
+        denied = claimed_user_error(username)
+        if denied:
+            return denied
         
-        # Buscar y eliminar sonidos del usuario
-        deleted_files = []
-        for filename in os.listdir(NOTIFICATION_SOUNDS_FOLDER):
-            if filename.startswith(f"{username}_"):
-                file_path = os.path.join(NOTIFICATION_SOUNDS_FOLDER, filename)
-                os.remove(file_path)
-                deleted_files.append(filename)
+        # Eliminar el sonido del usuario
+        deleted = sound_registry.delete(secure_filename(username))
+        deleted_files = [deleted] if deleted else []
         
         print(f"🗑️ Sonidos eliminados para {username}: {deleted_files}")
         
@@ -221,11 +525,8 @@ def get_notification_sound():
             return jsonify({"error": "Nombre de usuario requerido"}), 400
         
         # Buscar sonido del usuario
-        user_sound = None
-        for filename in os.listdir(NOTIFICATION_SOUNDS_FOLDER):
-            if filename.startswith(f"{username}_"):
-                user_sound = f"/{NOTIFICATION_SOUNDS_FOLDER}/{filename}"
-                break
+        filename = sound_registry.get(secure_filename(username))
+        user_sound = f"/{NOTIFICATION_SOUNDS_FOLDER}/{filename}" if filename else None
         
         return jsonify({
             "success": True,
@@ -247,6 +548,115 @@ def serve_chat_page(): return send_from_directory('.', 'chat.html')
 
 # --- API Endpoints ---
 
+# --- Búsqueda en la base de conocimiento ---
+KB_SEARCH_CHECK_INTERVAL = float(os.getenv("KB_SEARCH_CHECK_INTERVAL", "2"))
+KB_SEARCH_MAX_RESULTS = 10
+
+kb_index = KnowledgeBaseIndex(
+    [('knowledge_base.json', documents_from_knowledge_base),
+     ('politicas_ti.json', documents_from_policies)],
+    check_interval=KB_SEARCH_CHECK_INTERVAL,
+)
+
+@app.route('/api/kb/search', methods=['GET'])
+def search_knowledge_base():
+    """Casos y políticas que mejor responden al texto libre del usuario"""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({"error": "Falta el texto a buscar (q)"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 5)), 1), KB_SEARCH_MAX_RESULTS)
+    except ValueError:
+        limit = 5
+    started = time.perf_counter()
+    results = kb_index.search(query[:500], limit=limit)
+    return jsonify({
+        "query": query,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+
+@app.route('/api/admin/pool-stats', methods=['GET'])
+def get_pool_stats():
+    """Estadísticas de los pools de conexiones, las cachés y el registro de interacciones"""
+    return jsonify({
+        "postgres": pg_pool.stats(),
+        "informix": informix_pool.stats(),
+        "admin_roster": admin_roster.stats(),
+        "interaction_log": interaction_log.stats(),
+        "credential_cache": credential_cache.stats(),
+        "file_metadata": file_metadata.stats(),
+        "kb_search": kb_index.stats(),
+        "deflection": deflection.stats(),
+        "incidents": incidents.stats(),
+    })
+
+# --- Autenticación ---
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", str(12 * 3600)))
+
+credential_cache = CredentialCache(ttl=AUTH_CACHE_TTL)
+AUTH_SECRET_KEY = os.getenv("AUTH_SECRET_KEY")
+# Con varios workers una clave temporal por proceso invalidaría los tokens de los demás
+if not AUTH_SECRET_KEY and int(os.getenv("WEB_WORKERS", "1")) > 1:
+    raise RuntimeError("AUTH_SECRET_KEY es obligatoria con WEB_WORKERS > 1")
+session_tokens = SessionTokens(AUTH_SECRET_KEY, max_age=SESSION_TOKEN_TTL)
+
+SQL_LOGIN_RECORD = """
+    SELECT s.usua_cod_usua, r.respu_pas_usua, r.respu_rol_usua
+    FROM saeusua s
+    JOIN gerespu r ON r.respu_cod_usua = s.usua_cod_usua
+    WHERE s.usua_nom_usua = ?
+"""
+
+def load_login_record(username):
+    """Código, rol y contraseña descifrada del usuario en una sola consulta a Informix"""
+    rows = informix_query(SQL_LOGIN_RECORD, (username,))
+    if not rows:
+        return None
+    user_code, encrypted_password_from_db, role_from_db = rows[0]
+    role_from_db = role_from_db.strip() if role_from_db else ""
+    final_user_role = 'admin' if role_from_db == 'A' else 'user'
+    password_blob = encrypted_password_from_db.encode('latin-1') if isinstance(encrypted_password_from_db, str) else encrypted_password_from_db
+    return user_code, final_user_role, decrypt_password(password_blob)
+
+def session_user(token=None):
+    """
+    Usuario del token de sesión (cabecera Authorization: Bearer, o el token indicado cuando el
+    cliente no puede enviar cabeceras, como sendBeacon o Socket.IO), validado sin consultar Informix
+    """
+    if token is None:
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return None
+        token = header[len('Bearer '):]
+    if not isinstance(token, str) or not token.strip():
+        return None
+    return session_tokens.verify(token.strip())
+
+def claimed_user_error(username, token=None):
+    """Respuesta 401/403 si el token no es válido o es de otro usuario que el que indica la petición; si no, None"""
+    user = session_user(token)
+    if not user:
+        return jsonify({"error": "Sesión inválida o vencida"}), 401
+    if user['username'] != username:
+        return jsonify({"error": "El usuario no corresponde a la sesión"}), 403
+    return None
+
+def socket_user(data, username, admin=False):
+    """Si el token enviado en el evento de Socket.IO corresponde a username (y es administrador si se pide)"""
+    user = session_user(data.get('token') or '')
+    return bool(user) and user['username'] == username and (not admin or user['rol'] == 'admin')
+
+@app.route('/api/admin/presence', methods=['GET'])
+def get_admin_presence():
+    """Administradores conectados y cuántas consolas tiene abiertas cada uno"""
+    snapshot = connected_admins.snapshot()
+    return jsonify({
+        "admins": [{"username": username, "sessions": count} for username, count in sorted(snapshot.items())],
+        "total_sessions": sum(snapshot.values()),
+    })
+
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.json
@@ -254,142 +664,347 @@ def login():
     password_from_form = data.get('password')
     if not username_from_form or not password_from_form:
         return jsonify({"error": "Usuario y contraseña son requeridos"}), 400
-    conn = get_informix_connection()
-    if not conn:
-        return jsonify({"error": "Error de conexión con el servidor de autenticación"}), 500
     try:
-        with conn.cursor() as cur:
-            sql_get_user_code = "SELECT usua_cod_usua FROM saeusua WHERE usua_nom_usua = ?"
-            cur.execute(sql_get_user_code, (username_from_form,))
-            user_code_row = cur.fetchone()
-            if not user_code_row: return jsonify({"error": "Usuario o contraseña incorrectos"}), 401
-            user_code = user_code_row[0]
-            sql_get_pass_and_role = "SELECT respu_pas_usua, respu_rol_usua FROM gerespu WHERE respu_cod_usua = ?"
-            cur.execute(sql_get_pass_and_role, (user_code,))
-            user_info_row = cur.fetchone()
-            if not user_info_row: return jsonify({"error": "Usuario o contraseña incorrectos"}), 401
-            encrypted_password_from_db = user_info_row[0]
-            role_from_db = user_info_row[1].strip() if user_info_row[1] else ""
-            final_user_role = 'admin' if role_from_db == 'A' else 'user'
-            password_blob = encrypted_password_from_db.encode('latin-1') if isinstance(encrypted_password_from_db, str) else encrypted_password_from_db
-            decrypted_password = decrypt_password(password_blob)
-            if decrypted_password == password_from_form:
-                user_data = {"username": username_from_form, "rol": final_user_role, "user_code": user_code}
-                return jsonify({"success": True, "user": user_data})
-            else:
-                return jsonify({"error": "Usuario o contraseña incorrectos"}), 401
+        user_data = credential_cache.verify(username_from_form, password_from_form, load_login_record)
+        if not user_data:
+            return jsonify({"error": "Usuario o contraseña incorrectos"}), 401
+        return jsonify({"success": True, "user": user_data, "token": session_tokens.issue(user_data)})
+    except CircuitOpenError:
+        return jsonify({"error": "Error de conexión con el servidor de autenticación"}), 503
     except Exception as e:
         logging.error(f"Excepción durante la autenticación para {username_from_form}: {e}")
         return jsonify({"error": "Ocurrió un error crítico en el servidor"}), 500
+
+@app.route('/api/session', methods=['GET'])
+def get_session():
+    """Validar el token de sesión y devolver el usuario que contiene"""
+    user = session_user()
+    if not user:
+        return jsonify({"error": "Sesión inválida o vencida"}), 401
+    return jsonify({"success": True, "user": user})
+
+SQL_ADMINS = """
+    SELECT r.respu_cod_usua, s.usua_nom_usua 
+    FROM gerespu r
+    JOIN saeusua s ON r.respu_cod_usua = s.usua_cod_usua
+    WHERE r.respu_rol_usua = 'A'
+"""
+
+ADMIN_ROSTER_TTL = float(os.getenv("ADMIN_ROSTER_TTL", "600"))
+
+def load_admins_from_informix():
+    rows = informix_query(SQL_ADMINS, cache_key='admins')
+    return [{"user_code": row[0], "username": row[1].strip()} for row in rows]
+
+# La lista de administradores cambia pocas veces al año: se sirve desde memoria
+admin_roster = AdminRoster(load_admins_from_informix, ttl=ADMIN_ROSTER_TTL)
+admin_roster.start()
+
+# --- Carga de trabajo por administrador (asignación automática) ---
+WORKLOAD_RECONCILE_INTERVAL = float(os.getenv("WORKLOAD_RECONCILE_INTERVAL", "300"))
+workload = WorkloadIndex()
+workload_seed_lock = threading.Lock()
+
+def reconcile_workload():
+    """Recalcular desde la BD los tickets abiertos por administrador"""
+    conn = get_postgres_connection()
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT ticket_asignado_a, COUNT(*)
+                FROM soporte_ti.stticket
+                WHERE ticket_est_ticket != 'FN' AND ticket_asignado_a IS NOT NULL
+                GROUP BY ticket_asignado_a;
+            """)
+            workload.load({row[0]: row[1] for row in cur.fetchall()})
+        return True
+    except Exception as e:
+        logging.error(f"Error al reconciliar la carga de trabajo: {e}")
+        return False
     finally:
-        if conn: conn.close()
+        conn.close()
+
+def ensure_workload_seeded():
+    if not workload.seeded:
+        with workload_seed_lock:
+            if not workload.seeded:
+                reconcile_workload()
+
+def workload_reconciler():
+    while True:
+        reconcile_workload()
+        time.sleep(WORKLOAD_RECONCILE_INTERVAL)
+
+threading.Thread(target=workload_reconciler, name='workload-reconciler', daemon=True).start()
+
+@app.route('/api/admin/workload', methods=['GET'])
+def get_workload():
+    """Tickets abiertos por administrador según el índice en memoria"""
+    return jsonify(workload.snapshot())
 
 @app.route('/api/admins', methods=['GET'])
 def get_admins():
-    conn_informix = get_informix_connection()
-    if not conn_informix:
-        return jsonify({"error": "No se pudo conectar al servidor de usuarios"}), 500
-    
-    admins = []
-    try:
-        with conn_informix.cursor() as cur:
-            sql = """
-                SELECT r.respu_cod_usua, s.usua_nom_usua 
-                FROM gerespu r
-                JOIN saeusua s ON r.respu_cod_usua = s.usua_cod_usua
-                WHERE r.respu_rol_usua = 'A'
-            """
-            cur.execute(sql)
-            for row in cur.fetchall():
-                admins.append({"user_code": row[0], "username": row[1].strip()})
-        return jsonify(admins)
+    try:
+        admins = admin_roster.get()
+    except CircuitOpenError:
+        return jsonify({"error": "No se pudo conectar al servidor de usuarios"}), 503
     except Exception as e:
         logging.error(f"Error al obtener la lista de administradores: {e}")
         return jsonify({"error": "Error interno al consultar administradores"}), 500
+    response = jsonify(admins)
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+@app.route('/api/admins/refresh', methods=['POST'])
+def refresh_admins():
+    """Invalidar la caché de administradores (tras dar o quitar el rol 'A' en Informix)"""
+    admin_roster.invalidate()
+    return jsonify({"success": True, "message": "Lista de administradores en actualización"})
+
+# --- Sugerencias antes de crear un ticket ---
+# La descripción del problema se compara con la base de conocimiento y con los tickets
+# resueltos más recientes; si algo se parece, el chat lo ofrece antes de crear el ticket.
+DEFLECTION_CAPACITY = int(os.getenv("DEFLECTION_CAPACITY", "5000"))
+DEFLECTION_MIN_SCORE = float(os.getenv("DEFLECTION_MIN_SCORE", "0.15"))
+DEFLECTION_MAX_RESULTS = 10
+LEGACY_TICKETS_CSV = 'tickets_soporte.csv'
+LEGACY_SOLVED_STATES = {'resuelto', 'cerrado', 'finalizado', 'fn'}
+LEGACY_TICKET_RE = re.compile(r'(?=TKT-\d{8}-\d{6},)')
+OPTIONS_TRIED_MARKER = "\n\n--- Opciones Finales"
+
+deflection = DeflectionIndex(kb_index, capacity=DEFLECTION_CAPACITY)
+
+def deflection_entry(ticket_id, subject, description):
+    """(id, texto, resultado) de un ticket resuelto para el índice de sugerencias"""
+    description = (description or '').split(OPTIONS_TRIED_MARKER)[0].strip()
+    subject = (subject or '').strip()
+    return ticket_id, f"{subject.replace('_', ' ')} {description}", {
+        "type": "ticket",
+        "title": subject,
+        "description": description[:200],
+    }
+
+def load_legacy_solved_tickets():
+    """Tickets resueltos del CSV antiguo (algunas filas vienen pegadas, se separan por el id)"""
+    try:
+        with open(LEGACY_TICKETS_CSV, encoding='utf-8') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for record in LEGACY_TICKET_RE.split(content):
+        row = next(csv.reader([record.strip()]), None)
+        # id, fecha, usuario, user_id, categoria, subcategoria, problema, estado[, prioridad]
+        if not row or len(row) < 8 or not row[0].startswith('TKT-'):
+            continue
+        if row[7].strip().lower() in LEGACY_SOLVED_STATES:
+            entries.append(deflection_entry(row[0], row[5], row[6]))
+    return entries
+
+DEFLECTION_SYNC_INTERVAL = float(os.getenv("DEFLECTION_SYNC_INTERVAL", "30"))
+
+def load_deflection_index():
+    """Cargar al arrancar los tickets resueltos más recientes (CSV antiguo + stticket); devuelve la marca de agua"""
+    entries = load_legacy_solved_tickets()
+    watermark = None
+    conn = get_postgres_connection()
+    if conn:
+        try:
+            with conn.cursor() as cur:
+                watermark = ticket_queries.snapshot_xmin(cur)
+                # Los TKT-SOL solo dicen "Resuelto por el usuario...": su caso ya está en la base de conocimiento
+                cur.execute("""
+                    SELECT ticket_id_ticket, ticket_asu_ticket, ticket_des_ticket
+                    FROM soporte_ti.stticket
+                    WHERE TRIM(ticket_est_ticket) = 'FN' AND ticket_id_ticket NOT LIKE 'TKT-SOL%%'
+                    ORDER BY ticket_fec_ticket DESC
+                    LIMIT %s;
+                """, (DEFLECTION_CAPACITY,))
+                entries.extend(deflection_entry(*row) for row in reversed(cur.fetchall()))
+        except Exception as e:
+            watermark = None
+            logging.error(f"Error al cargar los tickets resueltos para las sugerencias: {e}")
+        finally:
+            conn.close()
+    deflection.add_many(entries)
+    logging.info(f"Índice de sugerencias cargado con {deflection.stats()['tickets']} tickets resueltos")
+    return watermark
+
+def sync_deflection_index(watermark):
+    """
+    Aplicar los tickets escritos por transacciones con id >= watermark (en cualquier worker):
+    los que quedaron en FN entran al índice y los reabiertos o borrados salen.
+    Devuelve la nueva marca de agua, o la misma si falló.
+    """
+    conn = get_postgres_connection()
+    if not conn:
+        return watermark
+    try:
+        with conn.cursor() as cur:
+            next_watermark = ticket_queries.snapshot_xmin(cur)
+            cur.execute("""
+                SELECT ticket_id_ticket, ticket_asu_ticket, ticket_des_ticket, ticket_est_ticket
+                FROM soporte_ti.stticket
+                WHERE ticket_xid_ticket >= %s::text::xid8 AND ticket_id_ticket NOT LIKE 'TKT-SOL%%'
+                ORDER BY ticket_fec_ticket, ticket_cod_ticket;
+            """, (watermark,))
+            solved = []
+            for ticket_id, subject, description, status in cur.fetchall():
+                if (status or '').strip() == 'FN':
+                    solved.append(deflection_entry(ticket_id, subject, description))
+                else:
+                    deflection.remove(ticket_id)
+            cur.execute("""
+                SELECT DISTINCT borrado_id_ticket FROM soporte_ti.stticket_borrados
+                WHERE borrado_xid_ticket >= %s::text::xid8
+            """, (watermark,))
+            for (ticket_id,) in cur.fetchall():
+                deflection.remove(ticket_id)
+        deflection.add_many(solved)
+        return next_watermark
+    except Exception as e:
+        logging.error(f"Error al actualizar los tickets resueltos para las sugerencias: {e}")
+        return watermark
     finally:
-        if conn_informix: conn_informix.close()
+        conn.close()
+
+def deflection_reloader():
+    """Carga inicial (después del esquema) y luego, cada DEFLECTION_SYNC_INTERVAL, lo resuelto en otros workers"""
+    schema_ready.wait()
+    watermark = load_deflection_index()
+    while True:
+        time.sleep(DEFLECTION_SYNC_INTERVAL)
+        if watermark is None:
+            watermark = load_deflection_index()
+        else:
+            watermark = sync_deflection_index(watermark)
+
+threading.Thread(target=deflection_reloader, name='ticket-deflection', daemon=True).start()
+
+@app.route('/api/tickets/suggestions', methods=['POST'])
+def suggest_before_ticket():
+    """Casos y tickets resueltos parecidos a la descripción, antes de crear el ticket"""
+    data = request.get_json(silent=True) or {}
+    description = (data.get('problemDescription') or '').strip()
+    if not description:
+        return jsonify({"error": "Falta la descripción del problema"}), 400
+    try:
+        limit = min(max(int(data.get('limit', 3)), 1), DEFLECTION_MAX_RESULTS)
+    except (TypeError, ValueError):
+        limit = 3
+    started = time.perf_counter()
+    suggestions = deflection.search(description[:2000], limit=limit, min_score=DEFLECTION_MIN_SCORE)
+    return jsonify({
+        "suggestions": suggestions,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+
+# --- Incidentes: tickets abiertos casi idénticos ---
+# Al crear un ticket se busca un ticket abierto muy parecido (MinHash + LSH) y se le asigna
+# su mismo incidente (ticket_incidente); los administradores pueden cerrar el grupo completo.
+INCIDENT_THRESHOLD = float(os.getenv("INCIDENT_THRESHOLD", "0.5"))
+
+incidents = IncidentIndex(threshold=INCIDENT_THRESHOLD)
+
+def incident_text(subject, description):
+    """Asunto + descripción sin la lista de opciones intentadas (se repite en muchos tickets)"""
+    description = (description or '').split(OPTIONS_TRIED_MARKER)[0]
+    return f"{(subject or '').replace('_', ' ')} {description}"
+
+INCIDENT_SYNC_INTERVAL = float(os.getenv("INCIDENT_SYNC_INTERVAL", "15"))
+INCIDENT_FULL_SYNC_INTERVAL = float(os.getenv("INCIDENT_FULL_SYNC_INTERVAL", "300"))
+incident_sync_lock = threading.Lock()
+incident_watermark = None
+
+def sync_incidents(full=False):
+    """
+    Poner al día el índice de este worker con ticket_incidente (la fuente de verdad).
+
+    La primera vez (o con full=True) se leen todos los tickets abiertos; después solo lo
+    escrito por transacciones con id >= la marca de agua (como la sincronización delta de
+    /api/tickets), así llegan los tickets creados, cerrados o reagrupados en otros workers.
+    Los tickets sin incidente (anteriores a la columna, o nuevos sin coincidencia al crearlos) se agrupan y se guardan.
+    """
+    global incident_watermark
+    if not schema_ready.is_set():
+        return False
+    with incident_sync_lock:
+        conn = get_postgres_connection()
+        if not conn:
+            return False
+        full = full or incident_watermark is None
+        try:
+            with conn.cursor() as cur:
+                watermark = ticket_queries.snapshot_xmin(cur)
+                if full:
+                    cur.execute("""
+                        SELECT ticket_id_ticket, ticket_asu_ticket, ticket_des_ticket, ticket_incidente, ticket_est_ticket
+                        FROM soporte_ti.stticket
+                        WHERE TRIM(ticket_est_ticket) != 'FN'
+                        ORDER BY ticket_fec_ticket, ticket_cod_ticket;
+                    """)
+                    rows = cur.fetchall()
+                else:
+                    cur.execute("""
+                        SELECT ticket_id_ticket, ticket_asu_ticket, ticket_des_ticket, ticket_incidente, ticket_est_ticket
+                        FROM soporte_ti.stticket
+                        WHERE ticket_xid_ticket >= %s::text::xid8
+                        ORDER BY ticket_fec_ticket, ticket_cod_ticket;
+                    """, (incident_watermark,))
+                    rows = cur.fetchall()
+                    cur.execute("""
+                        SELECT DISTINCT borrado_id_ticket FROM soporte_ti.stticket_borrados
+                        WHERE borrado_xid_ticket >= %s::text::xid8
+                    """, (incident_watermark,))
+                    for (ticket_id,) in cur.fetchall():
+                        incidents.remove(ticket_id)
+                untagged = incidents.reconcile(
+                    ((ticket_id, incident_text(subject, description), incident_id, (status or '').strip() != 'FN')
+                     for ticket_id, subject, description, incident_id, status in rows),
+                    full=full)
+                if untagged:
+                    psycopg2.extras.execute_batch(cur, """
+                        UPDATE soporte_ti.stticket SET ticket_incidente = %s
+                        WHERE ticket_id_ticket = %s AND ticket_incidente IS NULL
+                    """, untagged)
+            conn.commit()
+            incident_watermark = watermark
+            if full:
+                logging.info(f"Índice de incidentes cargado: {incidents.stats()}")
+            return True
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error al sincronizar el índice de incidentes: {e}")
+            return False
+        finally:
+            conn.close()
+
+def incident_reconciler():
+    schema_ready.wait()
+    last_full = 0.0
+    while True:
+        full = time.monotonic() - last_full >= INCIDENT_FULL_SYNC_INTERVAL
+        if sync_incidents(full=full) and full:
+            last_full = time.monotonic()
+        time.sleep(INCIDENT_SYNC_INTERVAL)
+
+threading.Thread(target=incident_reconciler, name='incident-reconciler', daemon=True).start()
 
 @app.route('/api/tickets', methods=['POST'])
 def create_ticket():
     data = request.json
     user_data = data.get('context', {})
-    user_info = data.get('user', {})
+    # El usuario sale del token de sesión, no del cuerpo
+    user_info = session_user()
+    if not user_info:
+        return jsonify({"error": "Sesión inválida o vencida"}), 401
     user_code = user_info.get('user_code')
     
   
     preferred_admin = data.get('preferred_admin')  # Cambiado de user_data a data
     
-    assigned_to = None
-
-    # --- LÓGICA DE ASIGNACIÓN AUTOMÁTICA MEJORADA ---
-    if preferred_admin and preferred_admin != 'none':
-        assigned_to = preferred_admin
-        logging.info(f"Ticket asignado por preferencia del usuario a: {assigned_to}")
-    else:
-        conn_postgres = get_postgres_connection()
-        conn_informix = get_informix_connection()
-        
-        if conn_postgres and conn_informix:
-            try:
-                with conn_informix.cursor() as cur_i:
-                    sql_admins = """
-                        SELECT s.usua_nom_usua 
-                        FROM gerespu r 
-                        JOIN saeusua s ON r.respu_cod_usua = s.usua_cod_usua 
-                        WHERE r.respu_rol_usua = 'A'
-                    """
-                    cur_i.execute(sql_admins)
-                    all_admins = [row[0].strip() for row in cur_i.fetchall()]
-
-                if all_admins:
-                    with conn_postgres.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur_p:
-                        sql_counts = """
-                            SELECT ticket_asignado_a, COUNT(*) as ticket_count
-                            FROM soporte_ti.stticket
-                            WHERE ticket_est_ticket != 'FN' AND ticket_asignado_a IS NOT NULL
-                            GROUP BY ticket_asignado_a;
-                        """
-                        cur_p.execute(sql_counts)
-                        ticket_counts = {row['ticket_asignado_a']: row['ticket_count'] for row in cur_p.fetchall()}
-
-                   
-                    available_admins = [admin for admin in all_admins if admin in ticket_counts or admin not in ticket_counts]
-                    
-                    if available_admins:
-                        min_tickets = float('inf')
-                        least_busy_admin = available_admins[0]
-                        
-                        for admin in available_admins:
-                            count = ticket_counts.get(admin, 0)  # Si no tiene tickets, count = 0
-                            if count < min_tickets:
-                                min_tickets = count
-                                least_busy_admin = admin
-                        
-                        assigned_to = least_busy_admin
-                        logging.info(f"Asignación automática a: {assigned_to} (con {min_tickets} tickets)")
-                    else:
-                        # Si no hay admins disponibles, asignar al primero de la lista
-                        assigned_to = all_admins[0] if all_admins else None
-                        logging.info(f"Asignación por defecto a: {assigned_to}")
-                        
-                else:
-                    logging.warning("No se encontraron administradores para la asignación automática.")
-                    
-            except Exception as e:
-                logging.error(f"Error en la asignación automática: {e}")
-                # En caso de error, asignar por defecto si hay admins
-                if all_admins:
-                    assigned_to = all_admins[0]
-            finally:
-                if conn_postgres: conn_postgres.close()
-                if conn_informix: conn_informix.close()
-        else:
-            logging.error("No se pudieron establecer conexiones a las bases de datos")
-    
-    conn = get_postgres_connection()
-    if not conn:
-        return jsonify({"error": "Error de base de datos"}), 500
-
     problem_description = user_data.get('problemDescription', 'N/A')
     final_options_tried = user_data.get('finalOptionsTried', [])
     
@@ -401,67 +1016,130 @@ def create_ticket():
 
     final_description = f"{problem_description}{options_text}"
 
-    ticket_id_str = f"TKT-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
     categoria_key = user_data.get('categoryKey', '')
     tipo_ticket = 'Software' if 'software' in categoria_key.lower() else 'Hardware'
     
-   
+    # ¿Es otro reporte de un incidente que ya tiene tickets abiertos? Se consulta solo el índice en
+    # memoria; si no hay coincidencia el ticket queda sin incidente y lo agrupa el reconciliador
+    # (que ya conoce los tickets de los otros workers), sin hacer esperar a la creación
+    incident_signature = incidents.signature(incident_text(user_data.get('subcategoryKey'), problem_description))
+    incident_id = incidents.match(incident_signature)[0]
+
+    assigned_to = None
+
+    # --- LÓGICA DE ASIGNACIÓN AUTOMÁTICA MEJORADA ---
+    # auto_assigned indica que el índice de carga ya reservó el ticket para el admin elegido
+    auto_assigned = False
+    if preferred_admin and preferred_admin != 'none':
+        assigned_to = preferred_admin
+        logging.info(f"Ticket asignado por preferencia del usuario a: {assigned_to}")
+    else:
+        try:
+            all_admins = admin_roster.usernames()
+            if all_admins:
+                ensure_workload_seeded()
+                assigned_to = workload.pick(all_admins)
+                auto_assigned = True
+                logging.info(f"Asignación automática a: {assigned_to} (con {workload.count(assigned_to) - 1} tickets)")
+            else:
+                logging.warning("No se encontraron administradores para la asignación automática.")
+        except Exception as e:
+            logging.error(f"Error en la asignación automática: {e}")
+    
+    conn = get_postgres_connection()
+    if not conn:
+        if auto_assigned:
+            workload.decrement(assigned_to)
+        return jsonify({"error": "Error de base de datos"}), 500
+
+    # El identificador lo genera la base de datos (secuencia) y vuelve con RETURNING
     sql = """
+        WITH nuevo AS (SELECT soporte_ti.stticket_nuevo_id('TKT') AS id)
         INSERT INTO soporte_ti.stticket 
         (ticket_des_ticket, ticket_id_ticket, ticket_tip_ticket, ticket_est_ticket, 
-         ticket_asu_ticket, ticket_tusua_ticket, ticket_cie_ticket, ticket_asignado_a, ticket_preferencia_usuario)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+         ticket_asu_ticket, ticket_tusua_ticket, ticket_cie_ticket, ticket_asignado_a, ticket_preferencia_usuario,
+         ticket_incidente)
+        SELECT %s, nuevo.id, %s, %s, %s, %s, %s, %s, %s, %s FROM nuevo
+        RETURNING ticket_id_ticket, ticket_fec_ticket, ticket_incidente;
     """
     
     try:
         with conn.cursor() as cur:
             cur.execute(sql, (
                 final_description,
-                ticket_id_str, 
                 tipo_ticket, 
                 'PE',
                 user_data.get('subcategoryKey', 'Sin asunto'),
                 user_info.get('username', 'No especificado'),
                 user_code,
                 assigned_to,  
-                preferred_admin  
+                preferred_admin,
+                incident_id
             ))
-            conn.commit()
-          # --- ENVÍO DE NOTIFICACIÓN EN TIEMPO REAL ---
-        if assigned_to:
-            notification_data = {
-                'type': 'new_ticket',
-                'title': '🎫 Nuevo Ticket Asignado',
-                'message': f'Se te ha asignado el ticket: {ticket_id_str}',
-                'ticket_id': ticket_id_str,
-                'assigned_to': assigned_to,
-                'user': user_info.get('username', 'Usuario'),
-                'subject': user_data.get('subcategoryKey', 'Sin asunto'),
-                'timestamp': datetime.datetime.now().isoformat(),
-                'category': tipo_ticket
-            }
-            
-            # Intentar enviar notificación en tiempo real
-            notification_sent = send_notification_to_admin(assigned_to, notification_data)
-            
-            if not notification_sent:
-                logging.info(f"El administrador {assigned_to} no está conectado. La notificación se mostrará cuando se conecte.")
-        
-        return jsonify({
-            "success": True, 
-            "ticket_id": ticket_id_str, 
-            "assigned_to": assigned_to,
-            "preferred_admin": preferred_admin,
-            "notification_sent": assigned_to in connected_admins if assigned_to else False
-        }), 201
-        
+            ticket_id_str, ticket_fec, incident_id = cur.fetchone()
+        conn.commit()
     except Exception as e:
+        # Solo aquí el ticket no quedó guardado: se libera la reserva del índice de carga
         conn.rollback()
+        if auto_assigned:
+            workload.decrement(assigned_to)
         logging.error(f"Error al crear ticket: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+
+    # El ticket ya existe: lo que sigue es de mejor esfuerzo y un fallo no cambia la respuesta
+    try:
+        if incident_id:
+            incidents.add(ticket_id_str, incident_signature, incident_id)
+        if assigned_to and not auto_assigned:
+            workload.increment(assigned_to)
+        ticket_stream.publish(ticket_events.CREATED, ticket_id_str, {
+            'ticket_id_ticket': ticket_id_str,
+            'ticket_asu_ticket': user_data.get('subcategoryKey', 'Sin asunto'),
+            'ticket_est_ticket': 'PE',
+            'ticket_tip_ticket': tipo_ticket,
+            'ticket_fec_ticket': ticket_fec.isoformat() if ticket_fec else None,
+            'ticket_tusua_ticket': user_info.get('username', 'No especificado'),
+            'ticket_asignado_a': assigned_to,
+            'ticket_incidente': incident_id,
+        }, requester=user_info.get('username'))
+    except Exception as e:
+        logging.error(f"Ticket {ticket_id_str} creado, pero falló la actualización de índices o eventos: {e}")
+
+    # --- ENVÍO DE NOTIFICACIÓN EN TIEMPO REAL ---
+    notification_sent = False
+    if assigned_to:
+        notification_data = {
+            'type': 'new_ticket',
+            'title': '🎫 Nuevo Ticket Asignado',
+            'message': f'Se te ha asignado el ticket: {ticket_id_str}',
+            'ticket_id': ticket_id_str,
+            'assigned_to': assigned_to,
+            'user': user_info.get('username', 'Usuario'),
+            'subject': user_data.get('subcategoryKey', 'Sin asunto'),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'category': tipo_ticket
+        }
+        
+        # Intentar enviar notificación en tiempo real
+        try:
+            notification_sent = send_notification_to_admin(assigned_to, notification_data)
+        except Exception as e:
+            logging.error(f"No se pudo notificar al administrador {assigned_to} del ticket {ticket_id_str}: {e}")
+        
+        if not notification_sent:
+            logging.info(f"El administrador {assigned_to} no está conectado. La notificación se mostrará cuando se conecte.")
+    
+    return jsonify({
+        "success": True, 
+        "ticket_id": ticket_id_str, 
+        "assigned_to": assigned_to,
+        "preferred_admin": preferred_admin,
+        "notification_sent": notification_sent,
+        "incident_id": incident_id
+    }), 201
+
 # --- SISTEMA DE ARCHIVOS ADJUNTOS ---
 
 @app.route('/api/tickets/<string:ticket_id>/upload', methods=['POST'])
@@ -475,66 +1153,59 @@ def upload_file(ticket_id):
         return jsonify({"error": "Nombre de archivo vacío"}), 400
     
     if file and allowed_file(file.filename):
-        # Verificar tamaño del archivo
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({"error": f"Archivo demasiado grande. Máximo: {MAX_FILE_SIZE//1024//1024}MB"}), 400
-        
-        # Crear estructura de carpetas organizada por ticket
-        ticket_folder = os.path.join(UPLOAD_FOLDER, ticket_id)
-        os.makedirs(ticket_folder, exist_ok=True)
-        
-        # Generar nombre único pero manteniendo la extensión original
+        # UploadRequest ya escribió el archivo en un temporal, limitó su tamaño y calculó el hash
+        upload = file.stream
+        file_size = upload.size
         file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(ticket_folder, unique_filename)
-        
-        # Guardar archivo en sistema de archivos
-        file.save(file_path)
+        # El fsync (lento con archivos grandes) va antes de la transacción: dentro de ella,
+        # con el ticket ya bloqueado por el trigger de versión, solo queda el rename
+        upload.sync()
         
         # Registrar metadatos en base de datos
         conn = get_postgres_connection()
         if not conn:
-            # Limpiar archivo si falla la BD
-            if os.path.exists(file_path):
-                os.remove(file_path)
             return jsonify({"error": "Error de base de datos"}), 500
         
         try:
-           with conn.cursor() as cur:
-                # PRIMERO: Obtener el ticket_cod_ticket (INTEGER) de la tabla stticket
+            with conn.cursor() as cur:
+                # Resolver el ticket e insertar el adjunto en una sola sentencia.
+                # El trigger de starchivos suma la referencia al blob y deja su fila bloqueada
+                # hasta el commit, así un borrado simultáneo del mismo contenido no se cruza.
                 cur.execute("""
-                    SELECT ticket_cod_ticket 
-                    FROM soporte_ti.stticket 
-                    WHERE ticket_id_ticket = %s
-                """, (ticket_id,))
+                    WITH t AS (
+                        SELECT ticket_cod_ticket, ticket_tusua_ticket
+                        FROM soporte_ti.stticket
+                        WHERE ticket_id_ticket = %s
+                        LIMIT 1
+                    ), nuevo AS (
+                        INSERT INTO soporte_ti.starchivos 
+                        (archivo_cod_ticket, archivo_nom_archivo, archivo_tip_archivo, 
+                         archivo_tam_archivo, archivo_rut_archivo, archivo_usua_archivo, archivo_hash_archivo) 
+                        SELECT ticket_cod_ticket, %s, %s, %s, %s, %s, %s FROM t
+                        RETURNING archivo_cod_archivo
+                    )
+                    SELECT nuevo.archivo_cod_archivo, t.ticket_tusua_ticket FROM nuevo, t
+                """, (ticket_id, file.filename, file_extension, file_size, 
+                      attachment_store.relative_path(upload.sha256),
+                      request.form.get('username', 'Sistema'), upload.sha256))
                 
                 ticket_record = cur.fetchone()
                 if not ticket_record:
-                    # Limpiar archivo si el ticket no existe
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                    conn.rollback()
                     return jsonify({"error": "Ticket no encontrado"}), 404
                 
-                ticket_cod_ticket = ticket_record[0]  # Este es el INTEGER que necesitas
-                
-                # AHORA INSERTAR con el ticket_cod_ticket correcto
-                cur.execute("""
-                    INSERT INTO soporte_ti.starchivos 
-                    (archivo_cod_ticket, archivo_nom_archivo, archivo_tip_archivo, 
-                     archivo_tam_archivo, archivo_rut_archivo, archivo_usua_archivo) 
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (ticket_cod_ticket, file.filename, file_extension, file_size, 
-                      f"{ticket_id}/{unique_filename}", request.form.get('username', 'Sistema')))
-                
+                # Si el contenido ya estaba en el almacén no se escribe de nuevo
+                attachment_store.place(upload)
                 conn.commit()
+                file_id = ticket_record[0]
+                thumbnails.submit(attachment_store.path(upload.sha256), file_extension)
                 
-                # Obtener el ID del archivo recién insertado
-                cur.execute("SELECT currval('soporte_ti.starchivos_archivo_cod_archivo_seq')")
-                file_id = cur.fetchone()[0]
+                ticket_stream.publish(ticket_events.ATTACHMENT_ADDED, ticket_id, {'file': {
+                    'archivo_cod_archivo': file_id,
+                    'archivo_nom_archivo': file.filename,
+                    'archivo_tip_archivo': file_extension,
+                    'archivo_tam_formateado': format_file_size(file_size),
+                }}, requester=ticket_record[1])
             
                 return jsonify({
                     "success": True, 
@@ -546,9 +1217,8 @@ def upload_file(ticket_id):
                 
         except Exception as e:
             conn.rollback()
-            # Eliminar archivo físico si falla la inserción en BD
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # El temporal se borra al cerrar la petición; un blob recién colocado sin
+            # referencias queda disponible para la próxima subida del mismo contenido
             logging.error(f"Error al subir archivo: {e}")
             return jsonify({"error": str(e)}), 500
         finally:
@@ -556,6 +1226,48 @@ def upload_file(ticket_id):
     else:
         return jsonify({"error": "Tipo de archivo no permitido"}), 400
 
+MAX_BATCH_TICKETS = 500
+
+def serialize_file_row(row):
+    file_data = dict(row)
+    file_data['archivo_tam_formateado'] = format_file_size(file_data['archivo_tam_archivo'])
+    file_data['archivo_fec_formateada'] = file_data['archivo_fec_archivo'].strftime('%Y-%m-%d %H:%M:%S')
+    return file_data
+
+def fetch_files_by_ticket(cur, ticket_ids):
+    """Adjuntos de varios tickets en una sola consulta: {ticket_id_ticket: [archivos]}"""
+    files_by_ticket = {ticket_id: [] for ticket_id in ticket_ids}
+    if not ticket_ids:
+        return files_by_ticket
+    cur.execute("""
+        SELECT t.ticket_id_ticket, a.archivo_cod_archivo, a.archivo_nom_archivo, a.archivo_tip_archivo,
+               a.archivo_tam_archivo, a.archivo_usua_archivo, a.archivo_fec_archivo
+        FROM soporte_ti.stticket t
+        JOIN soporte_ti.starchivos a ON a.archivo_cod_ticket = t.ticket_cod_ticket
+        WHERE t.ticket_id_ticket = ANY(%s)
+        ORDER BY a.archivo_fec_archivo DESC
+    """, (list(ticket_ids),))
+    for row in cur.fetchall():
+        file_data = serialize_file_row(row)
+        files_by_ticket[file_data.pop('ticket_id_ticket')].append(file_data)
+    return files_by_ticket
+
+def count_files_by_ticket(cur, ticket_ids):
+    """Número de adjuntos de varios tickets en una sola consulta: {ticket_id_ticket: n}"""
+    counts = dict.fromkeys(ticket_ids, 0)
+    if not ticket_ids:
+        return counts
+    cur.execute("""
+        SELECT t.ticket_id_ticket, COUNT(*)
+        FROM soporte_ti.stticket t
+        JOIN soporte_ti.starchivos a ON a.archivo_cod_ticket = t.ticket_cod_ticket
+        WHERE t.ticket_id_ticket = ANY(%s)
+        GROUP BY t.ticket_id_ticket
+    """, (list(ticket_ids),))
+    for ticket_id, count in cur.fetchall():
+        counts[ticket_id] = count
+    return counts
+
 @app.route('/api/tickets/<string:ticket_id>/files', methods=['GET'])
 def get_ticket_files(ticket_id):
     """Obtener lista de archivos adjuntos de un ticket"""
@@ -563,35 +1275,21 @@ def get_ticket_files(ticket_id):
     if not conn: return jsonify({"error": "Error de base de datos"}), 500
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            # Primero obtener el ticket_cod_ticket
+            # Una sola consulta: el LEFT JOIN distingue "ticket sin archivos" de "ticket inexistente"
             cur.execute("""
-                SELECT ticket_cod_ticket 
-                FROM soporte_ti.stticket 
-                WHERE ticket_id_ticket = %s
+                SELECT a.archivo_cod_archivo, a.archivo_nom_archivo, a.archivo_tip_archivo, 
+                       a.archivo_tam_archivo, a.archivo_usua_archivo, a.archivo_fec_archivo 
+                FROM soporte_ti.stticket t
+                LEFT JOIN soporte_ti.starchivos a ON a.archivo_cod_ticket = t.ticket_cod_ticket
+                WHERE t.ticket_id_ticket = %s 
+                ORDER BY a.archivo_fec_archivo DESC
             """, (ticket_id,))
             
-            ticket_record = cur.fetchone()
-            if not ticket_record:
+            rows = cur.fetchall()
+            if not rows:
                 return jsonify({"error": "Ticket no encontrado"}), 404
             
-            ticket_cod_ticket = ticket_record[0]
-            
-            # Luego buscar los archivos usando el ID numérico
-            cur.execute("""
-                SELECT archivo_cod_archivo, archivo_nom_archivo, archivo_tip_archivo, 
-                       archivo_tam_archivo, archivo_usua_archivo, archivo_fec_archivo 
-                FROM soporte_ti.starchivos 
-                WHERE archivo_cod_ticket = %s 
-                ORDER BY archivo_fec_archivo DESC
-            """, (ticket_cod_ticket,))
-            
-            files = []
-            for row in cur.fetchall():
-                file_data = dict(row)
-                file_data['archivo_tam_formateado'] = format_file_size(file_data['archivo_tam_archivo'])
-                file_data['archivo_fec_formateada'] = file_data['archivo_fec_archivo'].strftime('%Y-%m-%d %H:%M:%S')
-                files.append(file_data)
-            
+            files = [serialize_file_row(row) for row in rows if row['archivo_cod_archivo'] is not None]
             return jsonify(files)
     except Exception as e:
         logging.error(f"Error al obtener archivos del ticket {ticket_id}: {e}")
@@ -599,121 +1297,170 @@ def get_ticket_files(ticket_id):
     finally:
         if conn: conn.close()
 
-@app.route('/api/files/<int:file_id>/download')
-def download_file(file_id):
-    """Descargar un archivo adjunto"""
+@app.route('/api/tickets/files', methods=['GET', 'POST'])
+def get_tickets_files_batch():
+    """
+    Adjuntos de varios tickets a la vez, agrupados por ticket.
+    GET ?ids=TKT-1,TKT-2 o POST {"ticket_ids": [...]}; máximo MAX_BATCH_TICKETS por llamada.
+    """
+    if request.method == 'POST':
+        ticket_ids = (request.json or {}).get('ticket_ids') or []
+    else:
+        ticket_ids = [t for t in request.args.get('ids', '').split(',') if t]
+    if not isinstance(ticket_ids, list) or not all(isinstance(t, str) for t in ticket_ids):
+        return jsonify({"error": "ticket_ids debe ser una lista de identificadores"}), 400
+    if len(ticket_ids) > MAX_BATCH_TICKETS:
+        return jsonify({"error": f"Máximo {MAX_BATCH_TICKETS} tickets por consulta"}), 400
+
     conn = get_postgres_connection()
     if not conn: return jsonify({"error": "Error de base de datos"}), 500
-    
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("""
-                SELECT archivo_nom_archivo, archivo_rut_archivo, archivo_tip_archivo 
-                FROM soporte_ti.starchivos 
-                WHERE archivo_cod_archivo = %s
-            """, (file_id,))
-            
-            file_record = cur.fetchone()
-            if not file_record:
-                return jsonify({"error": "Archivo no encontrado"}), 404
-            
-            file_path = os.path.join(UPLOAD_FOLDER, file_record['archivo_rut_archivo'])
-            
-            if not os.path.exists(file_path):
-                logging.error(f"Archivo físico no encontrado: {file_path}")
-                return jsonify({"error": "Archivo físico no encontrado"}), 404
-            
-            return send_file(
-                file_path,
-                as_attachment=True,
-                download_name=file_record['archivo_nom_archivo']
-            )
-            
+            return jsonify(fetch_files_by_ticket(cur, dict.fromkeys(ticket_ids)))
     except Exception as e:
-        logging.error(f"Error al descargar archivo {file_id}: {e}")
+        logging.error(f"Error al obtener archivos de varios tickets: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
         if conn: conn.close()
 
-@app.route('/api/files/<int:file_id>/view')
-def view_file(file_id):
-    """Visualizar un archivo directamente en el navegador (para imágenes, PDFs)"""
+# --- Servicio de adjuntos ---
+# Con ATTACHMENT_ACCEL_PREFIX (p. ej. /uploads-internos/, una location "internal" de nginx que apunta a
+# UPLOAD_FOLDER) el proxy envía los bytes; con ATTACHMENT_X_SENDFILE=1 lo hace Apache (mod_xsendfile).
+ATTACHMENT_ACCEL_PREFIX = os.getenv("ATTACHMENT_ACCEL_PREFIX") or None
+app.config['USE_X_SENDFILE'] = os.getenv("ATTACHMENT_X_SENDFILE", "0") == "1"
+FILE_METADATA_TTL = float(os.getenv("FILE_METADATA_TTL", "300"))
+# Canal para que un borrado invalide la caché de metadatos en todos los workers
+FILE_METADATA_URL = os.getenv("FILE_METADATA_URL", SOCKETIO_MESSAGE_QUEUE or "")
+
+def load_file_metadata(file_id):
+    """Metadatos de un adjunto para servirlo (None si no existe; FileNotFoundError si falta el archivo físico)"""
     conn = get_postgres_connection()
-    if not conn: return jsonify({"error": "Error de base de datos"}), 500
-    
+    if not conn:
+        raise RuntimeError("Error de base de datos")
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
             cur.execute("""
-                SELECT archivo_nom_archivo, archivo_rut_archivo, archivo_tip_archivo 
+                SELECT archivo_nom_archivo, archivo_rut_archivo, archivo_tip_archivo, archivo_hash_archivo 
                 FROM soporte_ti.starchivos 
                 WHERE archivo_cod_archivo = %s
             """, (file_id,))
-            
             file_record = cur.fetchone()
-            if not file_record:
-                return jsonify({"error": "Archivo no encontrado"}), 404
-            
-            file_path = os.path.join(UPLOAD_FOLDER, file_record['archivo_rut_archivo'])
-            
-            if not os.path.exists(file_path):
-                return jsonify({"error": "Archivo físico no encontrado"}), 404
-            
-            # Determinar el MIME type adecuado
-            mime_types = {
-                'pdf': 'application/pdf',
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png',
-                'gif': 'image/gif',
-                'txt': 'text/plain'
-            }
-            
-            mime_type = mime_types.get(file_record['archivo_tip_archivo'], 'application/octet-stream')
-            
-            return send_file(
-                file_path,
-                mimetype=mime_type
-            )
-            
+    finally:
+        conn.close()
+    if not file_record:
+        return None
+    file_path = os.path.join(UPLOAD_FOLDER, file_record['archivo_rut_archivo'])
+    return describe_file(file_path, file_record['archivo_nom_archivo'],
+                         file_record['archivo_tip_archivo'], file_record['archivo_hash_archivo'])
+
+# El contenido de un adjunto no cambia: las vistas repetidas no consultan la base de datos
+file_invalidations = create_invalidation_channel(FILE_METADATA_URL)
+file_metadata = FileMetadataCache(load_file_metadata, ttl=FILE_METADATA_TTL, channel=file_invalidations)
+if file_invalidations:
+    threading.Thread(target=file_metadata.listen, name='file-metadata-invalidation', daemon=True).start()
+
+def send_attachment(file_id, action, build_response):
+    """Buscar los metadatos (caché) y responder; traduce los errores comunes a JSON"""
+    try:
+        meta = file_metadata.get(file_id)
+        if not meta:
+            return jsonify({"error": "Archivo no encontrado"}), 404
+        return build_response(meta)
+    except FileNotFoundError as e:
+        # Archivo físico ausente (o borrado en otro worker antes de que llegara el aviso)
+        file_metadata.invalidate(file_id)
+        logging.error(f"Archivo físico no encontrado: {e}")
+        return jsonify({"error": "Archivo físico no encontrado"}), 404
     except Exception as e:
-        logging.error(f"Error al visualizar archivo {file_id}: {e}")
+        logging.error(f"Error al {action} archivo {file_id}: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        if conn: conn.close()
+
+@app.route('/api/files/<int:file_id>/download')
+def download_file(file_id):
+    """Descargar un archivo adjunto"""
+    return send_attachment(file_id, 'descargar', lambda meta: serve_file(
+        meta, guess_mimetype(meta['name']), as_attachment=True, download_name=meta['name'],
+        accel_prefix=ATTACHMENT_ACCEL_PREFIX, upload_root=UPLOAD_FOLDER))
+
+@app.route('/api/files/<int:file_id>/view')
+def view_file(file_id):
+    """Visualizar un archivo directamente en el navegador (para imágenes, PDFs)"""
+    return send_attachment(file_id, 'visualizar', lambda meta: serve_file(
+        meta, INLINE_MIME_TYPES.get(meta['extension'], 'application/octet-stream'),
+        accel_prefix=ATTACHMENT_ACCEL_PREFIX, upload_root=UPLOAD_FOLDER))
+
+@app.route('/api/files/<int:file_id>/thumbnail')
+def thumbnail_file(file_id):
+    """Miniatura JPEG de una imagen o de la primera página de un PDF (se genera si aún no existe)"""
+    def build_response(meta):
+        if not os.path.exists(meta['path']):
+            raise FileNotFoundError(meta['path'])
+        thumb_path, pending = thumbnails.ensure(meta['path'], meta['extension'], timeout=THUMBNAIL_WAIT)
+        if pending:
+            # Se sigue generando en segundo plano. Un error (y no 202 con una imagen) para que
+            # el <img> dispare onerror y el cliente reintente o muestre el original
+            response = jsonify({"error": "La vista previa se está generando"})
+            response.status_code = 503
+            response.headers['Cache-Control'] = 'no-store'
+            response.headers['Retry-After'] = '2'
+            return response
+        if not thumb_path:
+            return jsonify({"error": "Vista previa no disponible para este archivo"}), 404
+        thumb_meta = describe_file(thumb_path, meta['name'], 'jpg', f"{meta['etag']}-miniatura")
+        return serve_file(thumb_meta, 'image/jpeg', accel_prefix=ATTACHMENT_ACCEL_PREFIX, upload_root=UPLOAD_FOLDER)
+    return send_attachment(file_id, 'generar miniatura de', build_response)
 
 @app.route('/api/files/<int:file_id>', methods=['DELETE'])
 def delete_file(file_id):
-    """Eliminar un archivo adjunto"""
+    """Eliminar un archivo adjunto (el contenido se borra solo si ningún otro adjunto lo usa)"""
     conn = get_postgres_connection()
     if not conn: return jsonify({"error": "Error de base de datos"}), 500
     
+    retired = None
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            # Obtener información del archivo
+            # Eliminar registro de la base de datos (el trigger descuenta la referencia al blob)
             cur.execute("""
-                SELECT archivo_rut_archivo, archivo_cod_ticket 
-                FROM soporte_ti.starchivos 
+                DELETE FROM soporte_ti.starchivos 
                 WHERE archivo_cod_archivo = %s
+                RETURNING archivo_rut_archivo, archivo_hash_archivo, archivo_cod_ticket
             """, (file_id,))
             
             file_record = cur.fetchone()
             if not file_record:
                 return jsonify({"error": "Archivo no encontrado"}), 404
+            file_metadata.invalidate(file_id)
             
-            # Eliminar registro de la base de datos
-            cur.execute("DELETE FROM soporte_ti.starchivos WHERE archivo_cod_archivo = %s", (file_id,))
-            conn.commit()
-            
-            # Eliminar archivo físico
-            file_path = os.path.join(UPLOAD_FOLDER, file_record['archivo_rut_archivo'])
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logging.info(f"Archivo físico eliminado: {file_path}")
+            if attachment_store.owns(file_record['archivo_rut_archivo']):
+                digest = file_record['archivo_hash_archivo']
+                cur.execute("""
+                    DELETE FROM soporte_ti.stadjunto_blob 
+                    WHERE blob_hash = %s AND blob_refs <= 0
+                    RETURNING blob_hash
+                """, (digest,))
+                if cur.fetchone():
+                    # Última referencia: apartar el blob antes del commit para poder devolverlo si falla
+                    retired = attachment_store.retire(digest)
+                conn.commit()
+                if retired:
+                    attachment_store.purge(retired)
+                    thumbnails.discard(attachment_store.path(digest))
+                    logging.info(f"Contenido sin referencias eliminado: {digest}")
+            else:
+                conn.commit()
+                # Adjunto anterior al almacén por contenido: archivo propio en la carpeta del ticket
+                file_path = os.path.join(UPLOAD_FOLDER, file_record['archivo_rut_archivo'])
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    logging.info(f"Archivo físico eliminado: {file_path}")
+                thumbnails.discard(file_path)
             
             return jsonify({"success": True, "message": "Archivo eliminado correctamente"})
             
     except Exception as e:
         conn.rollback()
+        if retired:
+            attachment_store.restore(retired, file_record['archivo_hash_archivo'])
         logging.error(f"Error al eliminar archivo {file_id}: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
@@ -725,29 +1472,42 @@ def delete_file(file_id):
 def log_solved_ticket():
     data = request.json
     user_data = data.get('context', {})
-    user_info = data.get('user', {})
+    # El usuario sale del token de sesión, no del cuerpo
+    user_info = session_user()
+    if not user_info:
+        return jsonify({"error": "Sesión inválida o vencida"}), 401
    
     conn = get_postgres_connection()
     if not conn: return jsonify({"error": "Error de base de datos"}), 500
 
-    ticket_id_str = f"TKT-SOL-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
     categoria_key = user_data.get('categoryKey', '')
     tipo_ticket = 'Software' if 'software' in categoria_key.lower() else 'Hardware'
     
     sql = """
         INSERT INTO soporte_ti.stticket 
         (ticket_des_ticket, ticket_id_ticket, ticket_tip_ticket, ticket_est_ticket, ticket_asu_ticket, ticket_tusua_ticket)
-        VALUES (%s, %s, %s, %s, %s, %s);
+        VALUES (%s, soporte_ti.stticket_nuevo_id('TKT-SOL'), %s, %s, %s, %s)
+        RETURNING ticket_id_ticket, ticket_fec_ticket;
     """
     try:
         with conn.cursor() as cur:
             cur.execute(sql, (
                 "Resuelto por el usuario a través del Asistente Virtual.",
-                ticket_id_str, tipo_ticket, 'FN',
+                tipo_ticket, 'FN',
                 user_data.get('subcategoryKey', 'Sin asunto'),
                 user_info.get('username', 'No especificado')
             ))
+            ticket_id_str, ticket_fec = cur.fetchone()
             conn.commit()
+        ticket_stream.publish(ticket_events.CREATED, ticket_id_str, {
+            'ticket_id_ticket': ticket_id_str,
+            'ticket_asu_ticket': user_data.get('subcategoryKey', 'Sin asunto'),
+            'ticket_est_ticket': 'FN',
+            'ticket_tip_ticket': tipo_ticket,
+            'ticket_fec_ticket': ticket_fec.isoformat() if ticket_fec else None,
+            'ticket_tusua_ticket': user_info.get('username', 'No especificado'),
+            'ticket_asignado_a': None,
+        }, requester=user_info.get('username'))
         return jsonify({"success": True, "ticket_id": ticket_id_str}), 201
     except Exception as e:
         conn.rollback()
@@ -765,11 +1525,23 @@ def assign_ticket(ticket_id):
     conn = get_postgres_connection()
     if not conn: return jsonify({"error": "Error de base de datos"}), 500
 
-    sql = "UPDATE soporte_ti.stticket SET ticket_asignado_a = %s WHERE ticket_id_ticket = %s;"
+    # Se devuelve el responsable anterior para mantener al día el índice de carga
+    sql = """
+        UPDATE soporte_ti.stticket t SET ticket_asignado_a = %s
+        FROM (SELECT ticket_cod_ticket, ticket_asignado_a FROM soporte_ti.stticket
+              WHERE ticket_id_ticket = %s FOR UPDATE) old
+        WHERE t.ticket_cod_ticket = old.ticket_cod_ticket
+        RETURNING old.ticket_asignado_a, t.ticket_est_ticket, t.ticket_tusua_ticket;
+    """
     try:
         with conn.cursor() as cur:
             cur.execute(sql, (admin_username, ticket_id))
+            updated = cur.fetchone()
             conn.commit()
+        if updated:
+            workload.on_assigned(updated[0], admin_username, updated[1])
+            ticket_stream.publish(ticket_events.ASSIGNED, ticket_id,
+                                  {'ticket_asignado_a': admin_username}, requester=updated[2])
         return jsonify({"success": True, "message": f"Ticket {ticket_id} asignado a {admin_username}"})
     except Exception as e:
         conn.rollback()
@@ -780,29 +1552,288 @@ def assign_ticket(ticket_id):
 
 @app.route('/api/admin/tickets', methods=['GET'])
 def get_all_tickets():
+    """
+    Listado de tickets para administración.
+    Sin 'limit' ni 'cursor' devuelve la lista completa (compatibilidad con las vistas actuales).
+    Con ellos devuelve una página por cursor: {"tickets": [...], "next_cursor": ..., "total": ..., "watermark": ...}.
+    Con 'since' devuelve solo lo creado, cambiado o borrado después de esa marca de agua:
+    {"tickets": [...], "deleted": [...], "watermark": ...}; si hay demasiados cambios, {"reset": true}.
+    Filtros: status, assignee, requester, type, date_from, date_to. include_total=1 agrega el total.
+    include_attachments=count|files agrega los adjuntos de cada ticket (una sola consulta extra).
+    Responde con ETag y 304 Not Modified si nada cambió desde la última consulta igual.
+    """
+    paginated = 'limit' in request.args or 'cursor' in request.args
+    try:
+        since = ticket_queries.parse_since(request.args['since']) if 'since' in request.args else None
+        conditions, params = ticket_queries.build_ticket_filters(request.args)
+        # El total se calcula solo con los filtros, sin la posición del cursor
+        count_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        count_params = list(params)
+        page_size = ticket_queries.parse_page_size(request.args.get('limit')) if paginated else None
+        cursor = request.args.get('cursor')
+        if since is not None:
+            conditions.append("ticket_xid_ticket >= %s::text::xid8")
+            params.append(since)
+        elif paginated and cursor:
+            condition, cursor_params = ticket_queries.keyset_condition(cursor)
+            conditions.append(condition)
+            params.extend(cursor_params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     conn = get_postgres_connection()
     if not conn: return jsonify({"error": "Error de base de datos"}), 500
-    sql = """
-        SELECT ticket_id_ticket, ticket_asu_ticket, ticket_est_ticket, ticket_des_ticket, 
-               ticket_fec_ticket, ticket_tusua_ticket, ticket_asignado_a 
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""
+        SELECT {', '.join(ticket_queries.TICKET_LIST_COLUMNS)}
         FROM soporte_ti.stticket 
-        ORDER BY ticket_fec_ticket DESC;
+        {where}
+        ORDER BY ticket_fec_ticket DESC, ticket_cod_ticket DESC
     """
+    if since is not None:
+        sql += " LIMIT %s"
+        params.append(ticket_queries.MAX_DELTA_ROWS + 1)
+    elif paginated:
+        # Se pide una fila extra para saber si hay otra página
+        sql += " LIMIT %s"
+        params.append(page_size + 1)
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute(sql)
+            # El estado (versión + instantánea) identifica el contenido y con la consulta forma el ETag;
+            # la marca de agua (antes de leer) es desde dónde pedir cambios la próxima vez
+            state, watermark = ticket_queries.sync_state(cur)
+            etag = f"tk-{state}-{zlib.crc32(request.query_string):08x}"
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+                return _with_ticket_sync_headers(response, etag, watermark)
+
+            cur.execute(sql, params)
             tickets = [dict(row) for row in cur.fetchall()]
-        return jsonify(tickets)
+            # include_attachments=count agrega el número de adjuntos; =files, la lista completa
+            include_attachments = request.args.get('include_attachments')
+            if include_attachments == 'files' and tickets:
+                files_by_ticket = fetch_files_by_ticket(cur, [t['ticket_id_ticket'] for t in tickets])
+                for ticket in tickets:
+                    ticket['files'] = files_by_ticket[ticket['ticket_id_ticket']]
+                    ticket['attachment_count'] = len(ticket['files'])
+            elif include_attachments == 'count' and tickets:
+                counts = count_files_by_ticket(cur, [t['ticket_id_ticket'] for t in tickets])
+                for ticket in tickets:
+                    ticket['attachment_count'] = counts[ticket['ticket_id_ticket']]
+
+            if since is not None:
+                if len(tickets) > ticket_queries.MAX_DELTA_ROWS:
+                    body = {"reset": True, "watermark": watermark}
+                else:
+                    cur.execute("""
+                        SELECT DISTINCT borrado_id_ticket FROM soporte_ti.stticket_borrados
+                        WHERE borrado_xid_ticket >= %s::text::xid8
+                    """, (since,))
+                    deleted = [row[0] for row in cur.fetchall()]
+                    body = {"tickets": tickets, "deleted": deleted, "watermark": watermark}
+                return _with_ticket_sync_headers(jsonify(body), etag, watermark)
+
+            if not paginated:
+                return _with_ticket_sync_headers(jsonify(tickets), etag, watermark)
+
+            total = None
+            if request.args.get('include_total') in ('1', 'true'):
+                cur.execute(f"SELECT COUNT(*) FROM soporte_ti.stticket {count_where}", count_params)
+                total = cur.fetchone()[0]
+
+        next_cursor = None
+        if len(tickets) > page_size:
+            tickets = tickets[:page_size]
+            last = tickets[-1]
+            next_cursor = ticket_queries.encode_cursor(last['ticket_fec_ticket'], last['ticket_cod_ticket'])
+        body = {"tickets": tickets, "next_cursor": next_cursor, "total": total, "watermark": watermark}
+        return _with_ticket_sync_headers(jsonify(body), etag, watermark)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         if conn: conn.close()
 
+def _with_ticket_sync_headers(response, etag, watermark):
+    # no-cache: el navegador guarda la respuesta pero siempre revalida con If-None-Match
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Ticket-Watermark'] = str(watermark)
+    response.headers['Access-Control-Expose-Headers'] = 'ETag, X-Ticket-Watermark'
+    return response
+
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+
+def _export_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+@app.route('/api/admin/tickets/export', methods=['GET'])
+def export_tickets():
+    """
+    Exportar tickets en streaming como NDJSON (format=ndjson, por defecto) o CSV (format=csv).
+    Acepta los mismos filtros que /api/admin/tickets. Usa un cursor del lado del servidor,
+    así la memoria no crece con el número de filas y los primeros bytes salen de inmediato.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Formato no soportado. Use: ndjson, csv"}), 400
+    try:
+        conditions, params = ticket_queries.build_ticket_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_postgres_connection()
+    if not conn: return jsonify({"error": "Error de base de datos"}), 500
+
+    columns = [column for column, _ in ticket_queries.TICKET_EXPORT_COLUMNS]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""
+        SELECT {', '.join(columns)}
+        FROM soporte_ti.stticket
+        {where}
+        ORDER BY ticket_fec_ticket DESC, ticket_cod_ticket DESC
+    """
+
+    def generate():
+        try:
+            with conn.cursor(name=f"ticket_export_{uuid.uuid4().hex}") as cur:
+                cur.execute(sql, params)
+                if export_format == 'csv':
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    # BOM para que Excel reconozca UTF-8
+                    writer.writerow([header for _, header in ticket_queries.TICKET_EXPORT_COLUMNS])
+                    yield '\ufeff' + buffer.getvalue()
+                while True:
+                    rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                    if not rows:
+                        break
+                    if export_format == 'csv':
+                        buffer = io.StringIO()
+                        writer = csv.writer(buffer)
+                        writer.writerows([_export_value(v) for v in row] for row in rows)
+                        yield buffer.getvalue()
+                    else:
+                        yield ''.join(
+                            json.dumps({c: _export_value(v) for c, v in zip(columns, row)}, ensure_ascii=False) + '\n'
+                            for row in rows)
+        except Exception as e:
+            logging.error(f"Error exportando tickets: {e}")
+            raise
+
+    stamp = datetime.datetime.now().strftime('%Y%m%d')
+    if export_format == 'csv':
+        mimetype, filename = 'text/csv; charset=utf-8', f"reporte_tickets_{stamp}.csv"
+    else:
+        mimetype, filename = 'application/x-ndjson', f"tickets_{stamp}.ndjson"
+    response = Response(generate(), mimetype=mimetype)
+    # La conexión vuelve al pool cuando el servidor cierra la respuesta, aunque el generador
+    # nunca llegue a recorrerse (HEAD, cliente que se fue antes del primer byte)
+    response.call_on_close(conn.close)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# --- REPORTES ---
+
+@app.route('/api/reports/summary', methods=['GET'])
+def get_report_summary():
+    """
+    Agregados para reportes.html: totales por estado, tipo, técnico y período (granularity=day|week|month)
+    y calificación promedio. Filtros: date_from, date_to, type, status, assignee.
+    """
+    conn = get_postgres_connection()
+    if not conn: return jsonify({"error": "Error de base de datos"}), 500
+    try:
+        with conn.cursor() as cur:
+            return jsonify(reports.summary(cur, request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error al generar el reporte: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: conn.close()
+
+def rebuild_report_rollup():
+    conn = get_postgres_connection()
+    if not conn:
+        raise RuntimeError("Error de base de datos")
+    try:
+        return reports.rebuild(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@app.route('/api/reports/rebuild', methods=['POST'])
+def rebuild_reports():
+    """Recalcular el resumen de reportes desde cero"""
+    try:
+        cells = rebuild_report_rollup()
+        return jsonify({"success": True, "cells": cells})
+    except Exception as e:
+        logging.error(f"Error al reconstruir el resumen de reportes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.cli.command('rebuild-reports')
+def rebuild_reports_command():
+    """Recalcular el resumen de reportes desde cero: flask rebuild-reports"""
+    cells = rebuild_report_rollup()
+    print(f"Resumen de reportes reconstruido: {cells} celdas")
+
+@app.cli.command('migrate-attachments')
+def migrate_attachments_command():
+    """Mover los adjuntos antiguos (uploads/<ticket>/...) al almacén por contenido: flask migrate-attachments"""
+    conn = pg_pool.acquire()
+    moved = duplicates = missing = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT archivo_cod_archivo, archivo_rut_archivo FROM soporte_ti.starchivos
+                WHERE archivo_rut_archivo NOT LIKE 'blobs/%%'
+                ORDER BY archivo_cod_archivo
+            """)
+            legacy = cur.fetchall()
+        for file_id, relative_path in legacy:
+            source = os.path.join(UPLOAD_FOLDER, relative_path)
+            if not os.path.exists(source):
+                missing += 1
+                continue
+            digest = file_sha256(source)
+            with conn.cursor() as cur:
+                # El trigger suma la referencia y bloquea el blob hasta el commit
+                cur.execute("""
+                    UPDATE soporte_ti.starchivos SET archivo_rut_archivo = %s, archivo_hash_archivo = %s
+                    WHERE archivo_cod_archivo = %s
+                """, (attachment_store.relative_path(digest), digest, file_id))
+            leftover = attachment_store.adopt(source, digest)
+            try:
+                conn.commit()
+            except Exception:
+                if not leftover:
+                    os.replace(attachment_store.path(digest), source)
+                raise
+            if leftover:
+                os.remove(leftover)
+                duplicates += 1
+            moved += 1
+    finally:
+        conn.close()
+    print(f"Adjuntos migrados: {moved} ({duplicates} con contenido repetido), sin archivo físico: {missing}")
+
 @app.route('/api/user/tickets', methods=['GET'])
 def get_user_tickets():
     username = request.args.get('username')
     if not username:
         return jsonify({"error": "Nombre de usuario es requerido"}), 400
+    denied = claimed_user_error(username)
+    if denied:
+        return denied
 
     conn = get_postgres_connection()
     if not conn:
@@ -827,6 +1858,26 @@ def get_user_tickets():
         if conn:
             conn.close()
 
+SQL_STATUS_RETURNING = """
+    RETURNING t.ticket_id_ticket, old.ticket_est_ticket, t.ticket_asignado_a, t.ticket_tusua_ticket,
+              t.ticket_asu_ticket, t.ticket_des_ticket, t.ticket_incidente;
+"""
+
+def on_ticket_status_changed(row, new_status):
+    """Mantener al día los índices en memoria y avisar a los clientes tras cambiar el estado de un ticket"""
+    ticket_id, old_status, assigned_to, requester, subject, description, incident_id = row
+    workload.on_status_changed(assigned_to, old_status, new_status)
+    # Sugerencias: solo tickets resueltos. Incidentes: solo tickets abiertos.
+    was_solved = (old_status or '').strip() == 'FN'
+    if new_status == 'FN' and not was_solved:
+        deflection.add(*deflection_entry(ticket_id, subject, description))
+        incidents.remove(ticket_id)
+    elif was_solved and new_status != 'FN':
+        deflection.remove(ticket_id)
+        incidents.add(ticket_id, incidents.signature(incident_text(subject, description)), incident_id)
+    ticket_stream.publish(ticket_events.STATUS_CHANGED, ticket_id,
+                          {'ticket_est_ticket': new_status}, requester=requester)
+
 @app.route('/api/admin/tickets/<string:ticket_id>', methods=['PUT'])
 def update_ticket_status(ticket_id):
     data = request.json
@@ -834,11 +1885,19 @@ def update_ticket_status(ticket_id):
     if not new_status: return jsonify({"error": "Falta el nuevo estado"}), 400
     conn = get_postgres_connection()
     if not conn: return jsonify({"error": "Error de base de datos"}), 500
-    sql = "UPDATE soporte_ti.stticket SET ticket_est_ticket = %s WHERE ticket_id_ticket = %s;"
+    sql = """
+        UPDATE soporte_ti.stticket t SET ticket_est_ticket = %s
+        FROM (SELECT ticket_cod_ticket, ticket_est_ticket FROM soporte_ti.stticket
+              WHERE ticket_id_ticket = %s FOR UPDATE) old
+        WHERE t.ticket_cod_ticket = old.ticket_cod_ticket
+    """ + SQL_STATUS_RETURNING
     try:
         with conn.cursor() as cur:
             cur.execute(sql, (new_status, ticket_id))
+            updated = cur.fetchone()
             conn.commit()
+        if updated:
+            on_ticket_status_changed(updated, new_status)
         return jsonify({"success": True})
     except Exception as e:
         conn.rollback()
@@ -846,6 +1905,100 @@ def update_ticket_status(ticket_id):
     finally:
         if conn: conn.close()
 
+@app.route('/api/admin/incidents', methods=['GET'])
+def get_incidents():
+    """Grupos de tickets abiertos casi idénticos (posibles incidentes), según ticket_incidente"""
+    try:
+        min_size = max(int(request.args.get('min_size', 2)), 1)
+    except ValueError:
+        min_size = 2
+    conn = get_postgres_connection()
+    if not conn: return jsonify({"error": "Error de base de datos"}), 500
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT ticket_incidente, COUNT(*), array_agg(ticket_id_ticket ORDER BY ticket_fec_ticket, ticket_cod_ticket)
+                FROM soporte_ti.stticket
+                WHERE TRIM(ticket_est_ticket) != 'FN' AND ticket_incidente IS NOT NULL
+                GROUP BY ticket_incidente
+                HAVING COUNT(*) >= %s
+                ORDER BY COUNT(*) DESC, ticket_incidente;
+            """, (min_size,))
+            rows = cur.fetchall()
+        return jsonify({"incidents": [
+            {"incident_id": incident_id, "size": size, "tickets": tickets}
+            for incident_id, size, tickets in rows
+        ]})
+    except Exception as e:
+        logging.error(f"Error al listar incidentes: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/admin/incidents/<string:incident_id>/resolve', methods=['POST'])
+def resolve_incident(incident_id):
+    """Cambiar de una vez el estado (por defecto FN) de todos los tickets abiertos de un incidente"""
+    data = request.get_json(silent=True) or {}
+    new_status = data.get('status', 'FN')
+    conn = get_postgres_connection()
+    if not conn: return jsonify({"error": "Error de base de datos"}), 500
+    sql = """
+        UPDATE soporte_ti.stticket t SET ticket_est_ticket = %s
+        FROM (SELECT ticket_cod_ticket, ticket_est_ticket FROM soporte_ti.stticket
+              WHERE ticket_incidente = %s AND TRIM(ticket_est_ticket) != 'FN' FOR UPDATE) old
+        WHERE t.ticket_cod_ticket = old.ticket_cod_ticket
+    """ + SQL_STATUS_RETURNING
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (new_status, incident_id))
+            updated = cur.fetchall()
+            conn.commit()
+        for row in updated:
+            on_ticket_status_changed(row, new_status)
+        logging.info(f"Incidente {incident_id}: {len(updated)} tickets pasaron a {new_status}")
+        return jsonify({"success": True, "updated": [row[0] for row in updated]})
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error al resolver el incidente {incident_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: conn.close()
+
+# --- Registro de interacciones del chat ---
+# Cada mensaje del chat genera un registro; se escriben por lotes en segundo plano
+# para que la petición no espere a la base de datos.
+INTERACTION_LOG_BATCH = int(os.getenv("INTERACTION_LOG_BATCH", "200"))
+INTERACTION_LOG_FLUSH_INTERVAL = float(os.getenv("INTERACTION_LOG_FLUSH_INTERVAL", "1"))
+INTERACTION_LOG_QUEUE = int(os.getenv("INTERACTION_LOG_QUEUE", "10000"))
+
+SQL_INSERT_INTERACTIONS = """
+    INSERT INTO soporte_ti.stlogchat
+    (session_id, username, action_type, action_value, bot_response)
+    VALUES %s
+"""
+
+def write_interactions(rows):
+    """Insertar un lote de interacciones en una sola sentencia"""
+    conn = pg_pool.acquire()
+    try:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, SQL_INSERT_INTERACTIONS, rows, page_size=len(rows))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+interaction_log = BatchWriter(
+    'interaction_log',
+    flush=write_interactions,
+    batch_size=INTERACTION_LOG_BATCH,
+    flush_interval=INTERACTION_LOG_FLUSH_INTERVAL,
+    max_queue=INTERACTION_LOG_QUEUE,
+)
+atexit.register(interaction_log.close)
+
 @app.route('/api/log/interaction', methods=['POST'])
 def log_interaction():
     data = request.json
@@ -858,29 +2011,77 @@ def log_interaction():
 
     if not session_id or not username:
         return jsonify({"error": "Faltan datos de sesión"}), 400
+    denied = claimed_user_error(username)
+    if denied:
+        return denied
+
+    if not interaction_log.submit((session_id, username, action_type, action_value, bot_response)):
+        response = jsonify({"error": "Registro de interacciones saturado, intente más tarde"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return jsonify({"success": True}), 202
+
+MAX_INTERACTION_EVENTS = 500
+
+SQL_INSERT_INTERACTION_EVENTS = """
+    INSERT INTO soporte_ti.stlogchat
+    (session_id, log_seq, username, action_type, action_value, bot_response)
+    VALUES %s
+    ON CONFLICT (session_id, log_seq) WHERE log_seq IS NOT NULL DO NOTHING
+"""
+
+@app.route('/api/log/interactions', methods=['POST'])
+def log_interactions_bulk():
+    """
+    Registrar varias interacciones de una sesión en una sola petición.
+
+    Cuerpo: {"sessionId", "username", "token", "events": [{"seq", "actionType", "actionValue", "botResponse"}]}.
+    Cada evento lleva un número de secuencia único dentro de la sesión; los ya guardados se ignoran,
+    así el cliente puede reenviar un lote sin duplicar filas. Se acepta el cuerpo como text/plain
+    para poder enviarlo con navigator.sendBeacon al cerrar la página.
+    """
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Cuerpo JSON inválido"}), 400
+
+    session_id = data.get('sessionId')
+    username = data.get('username')
+    events = data.get('events')
+    if not session_id or not username:
+        return jsonify({"error": "Faltan datos de sesión"}), 400
+    # sendBeacon no permite cabeceras: el token puede venir en el cuerpo
+    denied = claimed_user_error(username, data.get('token'))
+    if denied:
+        return denied
+    if not isinstance(events, list) or not events:
+        return jsonify({"error": "Se requiere una lista 'events' no vacía"}), 400
+    if len(events) > MAX_INTERACTION_EVENTS:
+        return jsonify({"error": f"Máximo {MAX_INTERACTION_EVENTS} eventos por lote"}), 413
+
+    rows = {}
+    for event in events:
+        seq = event.get('seq') if isinstance(event, dict) else None
+        if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+            return jsonify({"error": "Cada evento requiere 'seq' entero no negativo"}), 400
+        rows[seq] = (session_id, seq, username, event.get('actionType'),
+                     event.get('actionValue'), event.get('botResponse') or '')
 
     conn = get_postgres_connection()
     if not conn:
         return jsonify({"error": "Error de base de datos"}), 500
-
-    sql = """
-        INSERT INTO soporte_ti.stlogchat 
-        (session_id, username, action_type, action_value, bot_response)
-        VALUES (%s, %s, %s, %s, %s);
-    """
-    
     try:
         with conn.cursor() as cur:
-            cur.execute(sql, (session_id, username, action_type, action_value, bot_response))
-            conn.commit()
-        return jsonify({"success": True}), 201
+            psycopg2.extras.execute_values(cur, SQL_INSERT_INTERACTION_EVENTS, list(rows.values()),
+                                           page_size=len(rows))
+            stored = cur.rowcount
+        conn.commit()
+        return jsonify({"success": True, "received": len(rows), "stored": stored}), 201
     except Exception as e:
         conn.rollback()
-        logging.error(f"Error al registrar interacción para {username}: {e}")
+        logging.error(f"Error al registrar lote de interacciones para {username}: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
-        if conn:
-            conn.close()
+        conn.close()
 
 @app.route('/api/tickets/<string:ticket_id>/rate', methods=['POST'])
 def rate_ticket(ticket_id):
@@ -894,12 +2095,19 @@ def rate_ticket(ticket_id):
     if not conn:
         return jsonify({"error": "Error de base de datos"}), 500
 
-    sql = "UPDATE soporte_ti.stticket SET ticket_calificacion = %s WHERE ticket_id_ticket = %s;"
+    sql = """
+        UPDATE soporte_ti.stticket SET ticket_calificacion = %s WHERE ticket_id_ticket = %s
+        RETURNING ticket_tusua_ticket;
+    """
     
     try:
         with conn.cursor() as cur:
             cur.execute(sql, (rating, ticket_id))
+            updated = cur.fetchone()
             conn.commit()
+        if updated:
+            ticket_stream.publish(ticket_events.RATED, ticket_id,
+                                  {'ticket_calificacion': rating}, requester=updated[0])
         return jsonify({"success": True, "message": "Calificación guardada"})
     except Exception as e:
         conn.rollback()
@@ -912,30 +2120,23 @@ def rate_ticket(ticket_id):
 @app.route('/api/users', methods=['GET'])
 def get_all_users():
     """Obtener todos los usuarios del sistema"""
-    conn_informix = get_informix_connection()
-    if not conn_informix:
-        return jsonify({"error": "No se pudo conectar al servidor de usuarios"}), 500
-    
-    users = []
-    try:
-        with conn_informix.cursor() as cur:
-            sql = """
-                SELECT s.usua_cod_usua, s.usua_nom_usua 
-                FROM saeusua s
-                ORDER BY s.usua_nom_usua
-            """
-            cur.execute(sql)
-            for row in cur.fetchall():
-                users.append({
-                    "user_code": row[0], 
-                    "username": row[1].strip() if row[1] else ""
-                })
-        return jsonify(users)
+    sql = """
+        SELECT s.usua_cod_usua, s.usua_nom_usua 
+        FROM saeusua s
+        ORDER BY s.usua_nom_usua
+    """
+    try:
+        rows = informix_query(sql, cache_key='users')
+    except CircuitOpenError:
+        return jsonify({"error": "No se pudo conectar al servidor de usuarios"}), 503
     except Exception as e:
         logging.error(f"Error al obtener la lista de usuarios: {e}")
         return jsonify({"error": "Error interno al consultar usuarios"}), 500
-    finally:
-        if conn_informix: conn_informix.close()
+    users = [{
+        "user_code": row[0], 
+        "username": row[1].strip() if row[1] else ""
+    } for row in rows]
+    return jsonify(users)
 
 @app.route('/api/admin/tickets/<string:ticket_id>/reassign', methods=['POST'])
 def reassign_ticket_user(ticket_id):
@@ -950,12 +2151,19 @@ def reassign_ticket_user(ticket_id):
     if not conn:
         return jsonify({"error": "Error de base de datos"}), 500
 
-    sql = "UPDATE soporte_ti.stticket SET ticket_tusua_ticket = %s WHERE ticket_id_ticket = %s;"
+    sql = """
+        UPDATE soporte_ti.stticket SET ticket_tusua_ticket = %s WHERE ticket_id_ticket = %s
+        RETURNING ticket_id_ticket;
+    """
     
     try:
         with conn.cursor() as cur:
             cur.execute(sql, (new_username, ticket_id))
+            updated = cur.fetchone()
             conn.commit()
+        if updated:
+            ticket_stream.publish(ticket_events.REASSIGNED, ticket_id,
+                                  {'ticket_tusua_ticket': new_username}, requester=new_username)
         
         return jsonify({
             "success": True, 
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+class HashingTempFile:
+    """
+    Destino de un archivo subido mientras el parser multipart lo recibe.
+
+    Escribe directamente a un temporal dentro de la carpeta de adjuntos (para que
+    commit() sea un rename atómico), calcula el SHA-256 sobre la marcha y corta la
+    subida en cuanto se pasa de max_size. Si no se llama a commit(), close() borra
+    el temporal.
+    """
+
+    def __init__(self, directory, max_size=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.max_size = max_size
+        self.size = 0
+        self._done = False
+        self._synced = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge(f"Archivo demasiado grande. Máximo: {self.max_size // 1024 // 1024}MB")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # seek, read, tell, flush... los usa el parser y FileStorage
+        return getattr(self._file, name)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def sync(self):
+        """Asegurar el contenido en disco (fsync) antes de abrir la transacción que lo registra"""
+        if not self._synced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = True
+
+    def commit(self, destination):
+        """Mover el archivo completo a su ruta final (rename atómico)"""
+        self.sync()
+        self._file.close()
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(self.path, destination)
+        self._done = True
+
+    def close(self):
+        if self._done:
+            return
+        self._done = True
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def sweep_temp_files(directory, max_age):
+    """
+    Borrar los .part con más de max_age segundos (subidas cortadas cuando el proceso murió).
+    Los recientes pueden ser subidas en curso de otro worker. Devuelve cuántos se borraron.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not entry.name.endswith('.part'):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+BLOB_PREFIX = 'blobs'
+
+
+class AttachmentStore:
+    """
+    Almacén de adjuntos direccionado por contenido: cada archivo se guarda una sola vez
+    en <root>/blobs/ab/cd/<sha256>, sin importar cuántos tickets lo adjunten.
+
+    Las referencias se cuentan en soporte_ti.stadjunto_blob (triggers de starchivos);
+    aquí solo se manejan los archivos. La ruta relativa que devuelve relative_path()
+    es la que se guarda en archivo_rut_archivo.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def relative_path(self, digest):
+        return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def path(self, digest):
+        return os.path.join(self.root, self.relative_path(digest))
+
+    @staticmethod
+    def owns(relative_path):
+        """Si la ruta guardada en starchivos apunta al almacén (y no a una carpeta de ticket antigua)"""
+        return relative_path.startswith(BLOB_PREFIX + '/')
+
+    def place(self, upload):
+        """Guardar el contenido de un HashingTempFile; si ya existía, se descarta el temporal"""
+        destination = self.path(upload.sha256)
+        if os.path.exists(destination):
+            upload.close()
+        else:
+            upload.commit(destination)
+
+    def adopt(self, source, digest):
+        """Mover al almacén un archivo existente; si el contenido ya estaba, se devuelve su ruta para borrarla"""
+        destination = self.path(digest)
+        if os.path.exists(destination):
+            return source
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source, destination)
+        return None
+
+    def retire(self, digest):
+        """Apartar un blob sin referencias. Devuelve la ruta apartada (para purge o restore) o None"""
+        source = self.path(digest)
+        retired = f"{source}.{uuid.uuid4().hex}.borrado"
+        try:
+            os.replace(source, retired)
+        except FileNotFoundError:
+            return None
+        return retired
+
+    def restore(self, retired, digest):
+        os.replace(retired, self.path(digest))
+
+    @staticmethod
+    def purge(retired):
+        try:
+            os.remove(retired)
+        except FileNotFoundError:
+            pass
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,129 @@
+import collections
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+
+class CredentialCache:
+    """
+    Caché de credenciales ya verificadas contra Informix.
+
+    Guarda por usuario el código, el rol y un HMAC de la contraseña (nunca la contraseña),
+    válido durante ttl segundos. Un login con la misma contraseña dentro de ese plazo no
+    consulta Informix; si la contraseña no coincide se vuelve a consultar por si cambió.
+    Los logins simultáneos del mismo usuario esperan a una sola consulta.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = os.urandom(32)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._user_locks = {}                # usuario -> [lock, cuántos lo usan o esperan]
+        self._hits = 0
+        self._misses = 0
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode('utf-8'), hashlib.sha256).digest()
+
+    def _lookup(self, username, digest):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry and entry['expires_at'] > time.monotonic() and hmac.compare_digest(entry['digest'], digest):
+                self._hits += 1
+                return entry['user']
+            return None
+
+    def verify(self, username, password, loader):
+        """
+        Devolver los datos del usuario si la contraseña es correcta, None si no.
+
+        loader(username) consulta Informix y devuelve (user_code, rol, contraseña descifrada)
+        o None si el usuario no existe.
+        """
+        digest = self._digest(password)
+        user = self._lookup(username, digest)
+        if user is not None:
+            return user
+
+        # El candado se comparte mientras alguien lo use o lo espere; lo quita el último
+        with self._lock:
+            holder = self._user_locks.setdefault(username, [threading.Lock(), 0])
+            holder[1] += 1
+        try:
+            with holder[0]:
+                # Otro login del mismo usuario pudo haber cargado el registro mientras se esperaba
+                user = self._lookup(username, digest)
+                if user is not None:
+                    return user
+                return self._load(username, digest, loader)
+        finally:
+            with self._lock:
+                holder[1] -= 1
+                if not holder[1]:
+                    del self._user_locks[username]
+
+    def _load(self, username, digest, loader):
+        with self._lock:
+            self._misses += 1
+        record = loader(username)
+        if record is None:
+            return None
+        user_code, rol, stored_password = record
+        if not hmac.compare_digest(self._digest(stored_password), digest):
+            return None
+        user = {"username": username, "rol": rol, "user_code": user_code}
+        with self._lock:
+            self._entries[username] = {
+                'user': user,
+                'digest': digest,
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, username=None):
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+class SessionTokens:
+    """Tokens de sesión firmados (itsdangerous): se validan sin consultar Informix."""
+
+    def __init__(self, secret_key, max_age=12 * 3600):
+        if not secret_key:
+            # Sin clave configurada los tokens dejan de valer al reiniciar el servidor
+            logging.warning("AUTH_SECRET_KEY no configurada; se usa una clave temporal")
+            secret_key = os.urandom(32).hex()
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='soporte-ti-sesion')
+
+    def issue(self, user):
+        return self._serializer.dumps({
+            "username": user["username"],
+            "rol": user["rol"],
+            "user_code": user["user_code"],
+        })
+
+    def verify(self, token):
+        """Datos del usuario contenidos en el token, o None si es inválido o venció."""
+        try:
+            return self._serializer.loads(token, max_age=self.max_age)
+        except BadSignature:
+            # Incluye SignatureExpired
+            return None
@@ -0,0 +1,102 @@
+import logging
+import queue
+import threading
+import time
+
+
+class BatchWriter:
+    """
+    Escritor en segundo plano: los productores encolan filas y un hilo las escribe por lotes.
+
+    - Se vacía al juntar batch_size filas o al pasar flush_interval segundos desde la primera pendiente.
+    - La cola está acotada: si está llena, submit() espera hasta put_timeout y luego descarta la fila
+      (devuelve False) para que el endpoint pueda responder 503 en lugar de acumular memoria.
+    - close() escribe lo pendiente antes de terminar (se registra con atexit).
+    """
+
+    def __init__(self, name, flush, batch_size=200, flush_interval=1.0, max_queue=10000, put_timeout=0.05):
+        self.name = name
+        self._flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"batch-writer-{name}", daemon=True)
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+        self._thread.start()
+
+    def submit(self, row):
+        """Encolar una fila. Devuelve False si la cola sigue llena tras put_timeout (fila descartada)."""
+        if self._stop.is_set():
+            return False
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def close(self, timeout=10.0):
+        """Dejar de aceptar filas y escribir todo lo pendiente."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "capacity": self._queue.maxsize,
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "batches": self._batches,
+            }
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+            elif self._stop.is_set():
+                return
+
+    def _collect(self):
+        # Esperar la primera fila y luego completar el lote hasta batch_size o flush_interval
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            self._flush(batch)
+        except Exception as e:
+            logging.error(f"Escritor '{self.name}': fallo al escribir {len(batch)} filas: {e}")
+            with self._lock:
+                self._failed += len(batch)
+            return
+        with self._lock:
+            self._written += len(batch)
+            self._batches += 1
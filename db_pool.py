@@ -0,0 +1,331 @@
+import collections
+import logging
+import threading
+import time
+
+
+class PoolTimeoutError(Exception):
+    """No se obtuvo una conexión libre dentro del tiempo de espera."""
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: el servidor se considera caído y no se intenta conectar."""
+
+
+class CircuitBreaker:
+    """
+    Disyuntor para un servidor remoto.
+
+    - closed: las llamadas pasan normalmente.
+    - open: tras failure_threshold fallos seguidos se rechaza todo durante reset_timeout segundos.
+    - half_open: pasado ese tiempo se deja pasar una sola llamada de prueba;
+      si funciona se vuelve a closed, si falla se vuelve a open.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+        self._trial_started = 0.0
+        self._rejected = 0
+
+    def allow(self):
+        """Indica si se puede intentar una llamada ahora mismo."""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = 'half_open'
+                self._trial_in_progress = False
+            # Una prueba que nunca informó su resultado no bloquea el circuito para siempre
+            trial_expired = time.monotonic() - self._trial_started >= self.reset_timeout
+            if self._state == 'half_open' and (not self._trial_in_progress or trial_expired):
+                self._trial_in_progress = True
+                self._trial_started = time.monotonic()
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != 'closed':
+                logging.info(f"Circuito '{self.name}' cerrado: el servidor responde de nuevo")
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    logging.warning(f"Circuito '{self.name}' abierto tras {self._failures} fallos")
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "rejected": self._rejected,
+            }
+
+
+class PooledConnection:
+    """
+    Envoltorio de una conexión prestada por el pool.
+    Se usa igual que la conexión original; close() la devuelve al pool en vez de cerrarla.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise RuntimeError(f"La conexión ya fue devuelta al pool '{self._pool.name}'")
+        return getattr(raw, name)
+
+    def discard(self):
+        """Cerrar la conexión de verdad (por ejemplo si quedó en un estado inválido)."""
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.release(raw, discard=True)
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.release(raw)
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones genérico y seguro entre hilos.
+
+    - connect: función sin argumentos que abre una conexión nueva.
+    - validate: función que recibe la conexión y lanza excepción si está rota.
+      Solo se ejecuta si la conexión estuvo ociosa más de validate_after segundos.
+    - reset: función que limpia la conexión antes de devolverla al pool (rollback).
+    - breaker: CircuitBreaker opcional; con el circuito abierto acquire() falla al instante.
+    """
+
+    def __init__(self, name, connect, minconn=1, maxconn=10, timeout=5.0,
+                 validate=None, validate_after=30.0, max_idle=300.0, reset=None, breaker=None):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Tamaño de pool inválido: min={minconn}, max={maxconn}")
+        self.name = name
+        self._connect = connect
+        self._validate = validate
+        self._reset = reset
+        self.breaker = breaker
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self.max_idle = max_idle
+
+        self._cond = threading.Condition()
+        self._idle = collections.deque()  # (conexión, momento en que quedó libre)
+        self._size = 0                    # conexiones abiertas (ociosas + prestadas + abriéndose)
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Estadísticas
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._connect_errors = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # --- Préstamo y devolución ---
+
+    def acquire(self, timeout=None):
+        """Obtener una conexión del pool. Lanza PoolTimeoutError si no hay una libre a tiempo."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpenError(f"Circuito '{self.breaker.name}' abierto: servidor no disponible")
+
+        while True:
+            raw, idle_since, must_open = None, None, False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError(f"El pool '{self.name}' está cerrado")
+                expired = self._trim_idle_locked()
+                if self._idle:
+                    # LIFO: la conexión usada más recientemente es la más probable de estar sana
+                    raw, idle_since = self._idle.pop()
+                elif self._size < self.maxconn:
+                    self._size += 1
+                    must_open = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Sin conexiones libres en el pool '{self.name}' tras {timeout:.1f}s")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                    continue
+
+            for old in expired:
+                self._close_raw(old)
+
+            # La apertura y la validación se hacen fuera del candado para no bloquear a otros hilos
+            if must_open:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._connect_errors += 1
+                        self._cond.notify()
+                    if self.breaker:
+                        self.breaker.record_failure()
+                    raise
+                if self.breaker:
+                    self.breaker.record_success()
+            elif not self._is_healthy(raw, idle_since):
+                self._close_raw(raw)
+                with self._cond:
+                    self._size -= 1
+                    self._discarded += 1
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._in_use += 1
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return PooledConnection(self, raw)
+
+    def release(self, raw, discard=False):
+        """Devolver una conexión al pool (la llama PooledConnection.close())."""
+        if not discard and self._reset:
+            try:
+                self._reset(raw)
+            except Exception as e:
+                logging.warning(f"Pool '{self.name}': conexión descartada al devolverla: {e}")
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((raw, time.monotonic()))
+                raw = None
+            self._cond.notify()
+
+        if raw is not None:
+            self._close_raw(raw)
+
+    def connection(self, timeout=None):
+        """Igual que acquire() pero devuelve None y registra el error en lugar de lanzar excepción."""
+        try:
+            return self.acquire(timeout)
+        except Exception as e:
+            logging.error(f"Error obteniendo conexión del pool '{self.name}': {e}")
+            return None
+
+    # --- Mantenimiento ---
+
+    def warm(self):
+        """Abrir conexiones hasta alcanzar el mínimo configurado."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                raw = self._connect()
+            except Exception as e:
+                with self._cond:
+                    self._size -= 1
+                    self._connect_errors += 1
+                if self.breaker:
+                    self.breaker.record_failure()
+                logging.error(f"Pool '{self.name}': no se pudo precalentar: {e}")
+                return
+            with self._cond:
+                self._idle.appendleft((raw, time.monotonic()))
+                self._cond.notify()
+
+    def close_all(self):
+        """Cerrar todas las conexiones ociosas y no aceptar nuevos préstamos."""
+        with self._cond:
+            self._closed = True
+            idle = [raw for raw, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for raw in idle:
+            self._close_raw(raw)
+
+    def stats(self):
+        """Estadísticas del pool para monitoreo."""
+        breaker = self.breaker.stats() if self.breaker else None
+        with self._cond:
+            return {
+                "breaker": breaker,
+                "name": self.name,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "connect_errors": self._connect_errors,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+    def _trim_idle_locked(self):
+        # Las conexiones más antiguas están a la izquierda del deque; se cierran fuera del candado
+        expired = []
+        now = time.monotonic()
+        while self._idle and self._size > self.minconn and now - self._idle[0][1] > self.max_idle:
+            raw, _ = self._idle.popleft()
+            self._size -= 1
+            self._discarded += 1
+            expired.append(raw)
+        return expired
+
+    def _is_healthy(self, raw, idle_since):
+        if getattr(raw, 'closed', False):
+            return False
+        if not self._validate or time.monotonic() - idle_since < self.validate_after:
+            return True
+        try:
+            self._validate(raw)
+            return True
+        except Exception as e:
+            logging.warning(f"Pool '{self.name}': conexión rota descartada: {e}")
+            return False
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
@@ -0,0 +1,196 @@
+import collections
+import datetime
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import time
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+
+try:
+    import redis
+except ImportError:  # solo hace falta con una URL redis://...
+    redis = None
+
+# Tipos que el navegador puede mostrar en línea (view_file)
+INLINE_MIME_TYPES = {
+    'pdf': 'application/pdf',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'txt': 'text/plain',
+}
+
+# El contenido de un adjunto no cambia nunca (un cambio es un adjunto nuevo con otro id)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class FileMetadataCache:
+    """
+    Caché en memoria id de adjunto -> metadatos para servirlo sin consultar la base de datos.
+    LRU acotada con vencimiento; delete_file invalida la entrada del adjunto borrado.
+    Con varios workers, channel (RedisInvalidationChannel) lleva la invalidación a los demás;
+    cada worker ejecuta listen() en un hilo.
+    """
+
+    def __init__(self, loader, ttl=300.0, max_entries=10000, channel=None):
+        self._loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._channel = channel
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, file_id):
+        """Metadatos del adjunto o None si no existe (loader(file_id) consulta la base de datos)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(file_id)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+        meta = self._loader(file_id)
+        if meta is not None:
+            with self._lock:
+                self._entries[file_id] = (now + self.ttl, meta)
+                self._entries.move_to_end(file_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return meta
+
+    def invalidate(self, file_id):
+        """Olvidar el adjunto aquí y avisar a los demás workers"""
+        self.forget(file_id)
+        if self._channel:
+            try:
+                self._channel.publish(file_id)
+            except Exception as e:
+                # Los demás workers lo olvidan como mucho al vencer el TTL
+                logging.error(f"No se pudo publicar la invalidación del adjunto {file_id}: {e}")
+
+    def forget(self, file_id):
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def listen(self):
+        """Aplicar las invalidaciones de los demás workers (bucle del hilo de escucha)"""
+        self._channel.listen(self.forget, self.clear)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+class RedisInvalidationChannel:
+    """Canal pub/sub de Redis por el que los workers se avisan de los adjuntos borrados."""
+
+    def __init__(self, url, channel='soporte_ti:file_metadata:invalidate', retry_delay=5.0):
+        if redis is None:
+            raise RuntimeError("La invalidación en Redis requiere el paquete 'redis'")
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.channel = channel
+        self.retry_delay = retry_delay
+
+    def publish(self, file_id):
+        self._client.publish(self.channel, str(file_id))
+
+    def listen(self, on_message, on_reset):
+        """
+        on_message(file_id) por cada aviso. Tras (re)conectar se llama on_reset(): los avisos
+        publicados mientras no había suscripción se perdieron.
+        """
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                on_reset()
+                for message in pubsub.listen():
+                    on_message(int(message['data']))
+            except Exception as e:
+                logging.error(f"Error escuchando invalidaciones de adjuntos: {e}")
+                time.sleep(self.retry_delay)
+
+
+def create_invalidation_channel(url=None):
+    """Canal según la URL: redis://... entre workers; vacío, ninguno (un solo proceso)."""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisInvalidationChannel(url)
+    return None
+
+
+def describe_file(path, name, extension, content_hash=None):
+    """Metadatos para servir un archivo: tamaño, fecha y ETag fuerte (el hash del contenido si se conoce)"""
+    stat = os.stat(path)
+    if not content_hash:
+        # Adjuntos antiguos sin hash: el archivo nunca se reescribe, ruta + tamaño + fecha lo identifican
+        content_hash = hashlib.sha256(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+    return {
+        "path": path,
+        "name": name,
+        "extension": (extension or '').lower(),
+        "size": stat.st_size,
+        "mtime": datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc),
+        "etag": content_hash,
+    }
+
+
+def serve_file(meta, mimetype, as_attachment=False, download_name=None, accel_prefix=None, upload_root=None):
+    """
+    Responder con el archivo aplicando ETag fuerte, Last-Modified, 304, rangos (206) y caché larga.
+
+    Con accel_prefix (modo nginx) solo se devuelven los encabezados y X-Accel-Redirect: el
+    proxy envía los bytes y resuelve los rangos. Con USE_X_SENDFILE (Apache) lo hace send_file.
+    """
+    if accel_prefix:
+        response = Response(mimetype=mimetype)
+        relative = os.path.relpath(meta['path'], upload_root).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + relative
+        if as_attachment:
+            response.headers['Content-Disposition'] = content_disposition(download_name or meta['name'])
+        response.set_etag(meta['etag'])
+        response.last_modified = meta['mtime']
+        response = response.make_conditional(request)
+    else:
+        response = send_file(
+            meta['path'],
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=meta['etag'],
+            last_modified=meta['mtime'],
+        )
+    response.cache_control.no_cache = None
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def guess_mimetype(name):
+    return mimetypes.guess_type(name or '')[0] or 'application/octet-stream'
+
+
+def content_disposition(filename):
+    """Content-Disposition de descarga; los nombres con acentos van también codificados en filename*"""
+    try:
+        filename.encode('ascii')
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(filename, safe='')}"
@@ -0,0 +1,170 @@
+import collections
+import threading
+import zlib
+
+import numpy as np
+
+from kb_search import analyze
+
+# Primo de Mersenne 2^31 - 1: a * x + b cabe en uint64 con x de 32 bits (crc32)
+PRIME = (1 << 31) - 1
+
+
+def shingles(text):
+    """Raíces del texto y pares de raíces consecutivas"""
+    terms = analyze(text)
+    items = set(terms)
+    items.update(f"{a} {b}" for a, b in zip(terms, terms[1:]))
+    return items
+
+
+class IncidentIndex:
+    """
+    Agrupa los tickets abiertos casi idénticos (un mismo incidente) con MinHash + LSH.
+
+    Cada ticket tiene una firma MinHash de num_perm valores; la firma se parte en `bands`
+    bandas y cada banda es una llave de un diccionario. Dos tickets con similitud de
+    Jaccard alta comparten alguna banda con mucha probabilidad, así que para ubicar un
+    ticket nuevo solo se comparan los tickets de sus bandas (como mucho max_bucket por
+    banda, los más recientes): el costo no depende de cuántos tickets abiertos haya.
+
+    El incidente se identifica con el id del primer ticket del grupo; la asignación la
+    guarda la aplicación en ticket_incidente, que es la fuente de verdad: cada worker tiene
+    su índice y lo pone al día con reconcile().
+    """
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.5, max_bucket=32, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm debe ser múltiplo de bands")
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_bucket = max_bucket
+        self._lock = threading.Lock()
+        self._buckets = {}                           # (banda, valores) -> deque de ticket_id
+        self._signatures = {}                        # ticket_id -> firma
+        self._incident_of = {}                       # ticket_id -> incidente
+        self._incidents = collections.defaultdict(set)
+
+    def signature(self, text):
+        """Firma MinHash del texto o None si no tiene palabras útiles"""
+        items = shingles(text)
+        if not items:
+            return None
+        values = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in items), dtype=np.uint64, count=len(items))
+        return ((np.outer(self._a, values) + self._b[:, None]) % PRIME).min(axis=1)
+
+    def match(self, signature):
+        """(incidente, similitud estimada) del ticket abierto más parecido, o (None, 0.0)"""
+        if signature is None:
+            return None, 0.0
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+            best, best_score = None, 0.0
+            for ticket_id in candidates:
+                score = float(np.mean(self._signatures[ticket_id] == signature))
+                if score > best_score:
+                    best, best_score = ticket_id, score
+            if best is None or best_score < self.threshold:
+                return None, 0.0
+            return self._incident_of[best], best_score
+
+    def add(self, ticket_id, signature, incident_id=None):
+        """Registrar un ticket abierto en su incidente (uno nuevo con su propio id si no se indica)"""
+        incident_id = incident_id or ticket_id
+        with self._lock:
+            if ticket_id in self._incident_of:
+                self._remove_locked(ticket_id)
+            self._incident_of[ticket_id] = incident_id
+            self._incidents[incident_id].add(ticket_id)
+            if signature is None:
+                return incident_id
+            self._signatures[ticket_id] = signature
+            for key in self._band_keys(signature):
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = collections.deque(maxlen=self.max_bucket)
+                bucket.append(ticket_id)
+            return incident_id
+
+    def remove(self, ticket_id):
+        """Quitar un ticket que se cerró"""
+        with self._lock:
+            if ticket_id in self._incident_of:
+                self._remove_locked(ticket_id)
+
+    def reconcile(self, rows, full=False):
+        """
+        Aplicar el estado leído de la base de datos: rows = [(ticket_id, texto, incidente, abierto)].
+
+        Los tickets cerrados salen del índice; los abiertos que ya estaban solo cambian de
+        incidente si otro worker lo cambió (la firma no se recalcula); los nuevos se firman y,
+        si no traen incidente, se ubican como al crearlos. Con full=True además se quitan los
+        que ya no aparecen. Devuelve [(incidente, ticket_id)] de los que no traían incidente.
+        """
+        rows = list(rows)
+        if full:
+            seen = {row[0] for row in rows if row[3]}
+            with self._lock:
+                for ticket_id in [t for t in self._incident_of if t not in seen]:
+                    self._remove_locked(ticket_id)
+        untagged = []
+        for ticket_id, text, incident_id, is_open in rows:
+            if not is_open:
+                self.remove(ticket_id)
+                continue
+            with self._lock:
+                current = self._incident_of.get(ticket_id)
+                if current is not None:
+                    if not incident_id:
+                        untagged.append((current, ticket_id))
+                    elif incident_id != current:
+                        self._incidents[current].discard(ticket_id)
+                        if not self._incidents[current]:
+                            del self._incidents[current]
+                        self._incident_of[ticket_id] = incident_id
+                        self._incidents[incident_id].add(ticket_id)
+                    continue
+            signature = self.signature(text)
+            if not incident_id:
+                incident_id = self.match(signature)[0] or ticket_id
+                untagged.append((incident_id, ticket_id))
+            self.add(ticket_id, signature, incident_id)
+        return untagged
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tickets": len(self._incident_of),
+                "incidents": len(self._incidents),
+                "buckets": len(self._buckets),
+            }
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def _remove_locked(self, ticket_id):
+        incident_id = self._incident_of.pop(ticket_id)
+        members = self._incidents[incident_id]
+        members.discard(ticket_id)
+        if not members:
+            del self._incidents[incident_id]
+        signature = self._signatures.pop(ticket_id, None)
+        if signature is None:
+            return
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            try:
+                bucket.remove(ticket_id)
+            except ValueError:
+                pass  # ya había salido del deque por antigüedad
+            if not bucket:
+                del self._buckets[key]
@@ -0,0 +1,294 @@
+import collections
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+
+# Palabras vacías ya sin acentos (se comparan después de fold())
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bien cada como con contra cual
+cuando de del desde donde dos el ella ellas ellos en entre era es esa esas ese eso esos esta estaba
+estan estar estas este esto estos estoy fue ha hay hace hacer han hasta he la las le les lo los mas
+me mi mis mucho muy nada ni no nos o otra otro para pero poco por porque puede puedo que se sea ser
+si sin sobre solo son su sus tambien tan te tengo tiene todo todos tu tus un una unas uno unos ya yo
+""".split())
+
+# Sufijos del plural, género y derivaciones frecuentes; se quita el primero que coincida
+SUFFIXES = (
+    'amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'iciones', 'acion', 'icion',
+    'idades', 'idad', 'mente', 'ando', 'iendo', 'ados', 'adas', 'idos', 'idas',
+    'ado', 'ada', 'ido', 'ida', 'ar', 'er', 'ir', 'es', 'os', 'as', 's', 'o', 'a', 'e',
+)
+MIN_STEM = 3
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+MARKUP_RE = re.compile(r'<[^>]+>|\*\*')
+
+# Peso de cada campo en la frecuencia del término (BM25F simplificado)
+FIELD_WEIGHTS = {'title': 3.0, 'context': 1.0, 'body': 1.0}
+
+# Tolerancia a errores de tipeo: distancia máxima según el largo de la palabra y penalización
+FUZZY_MIN_LENGTH = 4
+FUZZY_LONG_LENGTH = 8
+FUZZY_PENALTY = {1: 0.6, 2: 0.35}
+
+
+def fold(text):
+    """Minúsculas y sin acentos ni marcas (á -> a, ñ -> n)"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(token):
+    if token.isdigit():
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+
+def analyze(text):
+    """Texto -> lista de raíces normalizadas (sin HTML, markdown, acentos ni palabras vacías)"""
+    words = TOKEN_RE.findall(fold(MARKUP_RE.sub(' ', text or '')))
+    return [stem(w) for w in words if w not in STOPWORDS and (len(w) > 1 or w.isdigit())]
+
+
+def max_distance(term):
+    if len(term) < FUZZY_MIN_LENGTH:
+        return 0
+    return 2 if len(term) >= FUZZY_LONG_LENGTH else 1
+
+
+def _deletes(term, distance):
+    """Variantes del término con hasta `distance` letras borradas (índice estilo SymSpell)"""
+    variants = {term}
+    frontier = {term}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w)) if len(w) > 1}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a, b, limit):
+    """Damerau-Levenshtein (transposición de letras vecinas = 1); corta en cuanto supera limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if previous2 is not None and i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def documents_from_knowledge_base(data):
+    """Un documento por caso (subcategoría con sus pasos y opciones) y uno por política"""
+    docs = {}
+    for category_key, category in (data.get('casos_soporte') or {}).items():
+        subcategories = category.get('categorias')
+        if not isinstance(subcategories, dict):
+            continue
+        for subcategory_key, case in subcategories.items():
+            options = case.get('opciones_finales') or []
+            docs[f"caso:{category_key}:{subcategory_key}"] = {
+                "fields": {
+                    "title": case.get('titulo', ''),
+                    "context": category.get('titulo', ''),
+                    "body": ' '.join(case.get('pasos') or []) + ' ' + ' '.join(
+                        f"{o.get('titulo', '')} {o.get('descripcion', '')}" for o in options),
+                },
+                "result": {
+                    "type": "caso",
+                    "category": category_key,
+                    "subcategory": subcategory_key,
+                    "title": case.get('titulo', ''),
+                    "category_title": category.get('titulo', ''),
+                },
+            }
+    docs.update(documents_from_policies(data.get('politicas') or {}))
+    return docs
+
+
+def documents_from_policies(policies):
+    docs = {}
+    for key, policy in policies.items():
+        # politicas_ti.json también trae un resumen de casos_soporte que no es una política
+        if not isinstance(policy, dict) or 'contenido' not in policy:
+            continue
+        docs[f"politica:{key}"] = {
+            "fields": {"title": policy.get('titulo', ''), "context": '', "body": policy['contenido']},
+            "result": {
+                "type": "politica",
+                "policy": key,
+                "title": policy.get('titulo', ''),
+                "content": policy['contenido'],
+            },
+        }
+    return docs
+
+
+class KnowledgeBaseIndex:
+    """
+    Índice invertido en memoria para buscar en la base de conocimiento con BM25.
+
+    sources es una lista de (ruta, función que convierte el JSON en documentos); si dos
+    fuentes traen el mismo documento gana la primera. Cuando cambia la fecha de un archivo
+    se vuelve a leer solo ese archivo y en el índice se quitan/agregan únicamente los
+    documentos que cambiaron. La revisión de fechas se hace como mucho cada check_interval
+    segundos, dentro de search().
+    """
+
+    def __init__(self, sources, check_interval=2.0, k1=1.2, b=0.75):
+        self.sources = list(sources)
+        self.check_interval = check_interval
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._source_state = {}              # ruta -> (mtime_ns, documentos)
+        self._docs = {}                      # id -> {"hash", "result", "terms": {término: tf}, "length", "text"}
+        self._postings = collections.defaultdict(dict)   # término -> {id: tf}
+        self._deletes = collections.defaultdict(set)     # variante borrada -> términos del vocabulario
+        self._total_length = 0.0
+        self._checked_at = 0.0
+        self._reloads = 0
+        with self._lock:
+            self._refresh_locked(force=True)
+
+    def search(self, query, limit=5):
+        """Lista de resultados [{..., "score"}] ordenada por relevancia"""
+        terms = list(dict.fromkeys(analyze(query)))
+        if not terms:
+            return []
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._refresh_locked()
+            if not self._docs:
+                return []
+            scores = collections.defaultdict(float)
+            average_length = self._total_length / len(self._docs)
+            for term in terms:
+                for match, penalty in self._expand_locked(term):
+                    postings = self._postings[match]
+                    idf = math.log(1 + (len(self._docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for doc_id, tf in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self._docs[doc_id]['length'] / average_length)
+                        scores[doc_id] += penalty * idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [dict(self._docs[doc_id]['result'], score=round(score, 4)) for doc_id, score in ranked]
+
+    def documents(self):
+        """(versión, [(id, texto, resultado)]); la versión cambia cada vez que se recarga el índice"""
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._refresh_locked()
+            return self._reloads, [(doc_id, entry['text'], entry['result']) for doc_id, entry in self._docs.items()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "terms": len(self._postings),
+                "reloads": self._reloads,
+            }
+
+    def _expand_locked(self, term):
+        """El término exacto o, si no está en el vocabulario, los parecidos con su penalización"""
+        if term in self._postings:
+            return [(term, 1.0)]
+        limit = max_distance(term)
+        if not limit:
+            return []
+        candidates = set()
+        for variant in _deletes(term, limit):
+            candidates |= self._deletes.get(variant, set())
+        matches = []
+        for candidate in candidates:
+            distance = edit_distance(term, candidate, limit)
+            if distance <= limit:
+                matches.append((candidate, FUZZY_PENALTY[distance]))
+        return matches
+
+    def _refresh_locked(self, force=False):
+        self._checked_at = time.monotonic()
+        changed = False
+        for path, parse in self.sources:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            previous = self._source_state.get(path)
+            if not force and previous and previous[0] == mtime:
+                continue
+            try:
+                with open(path, encoding='utf-8') as f:
+                    docs = parse(json.load(f))
+            except (OSError, ValueError) as e:
+                # Un archivo a medio guardar o con errores no debe dejar el buscador vacío
+                logging.error(f"No se pudo leer {path} para el buscador ({e}); se mantiene el índice anterior")
+                continue
+            self._source_state[path] = (mtime, docs)
+            changed = True
+        if changed:
+            self._apply_locked()
+
+    def _apply_locked(self):
+        merged = {}
+        for path, _ in self.sources:
+            for doc_id, doc in self._source_state.get(path, (None, {}))[1].items():
+                merged.setdefault(doc_id, doc)
+        wanted = {}
+        for doc_id, doc in merged.items():
+            wanted[doc_id] = hashlib.sha1(json.dumps(doc, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        removed = [doc_id for doc_id, entry in self._docs.items() if wanted.get(doc_id) != entry['hash']]
+        for doc_id in removed:
+            self._remove_locked(doc_id)
+        added = [doc_id for doc_id in wanted if doc_id not in self._docs]
+        for doc_id in added:
+            self._add_locked(doc_id, merged[doc_id], wanted[doc_id])
+        self._reloads += 1
+        logging.info(f"Buscador de la base de conocimiento: {len(added)} documentos indexados, "
+                     f"{len(removed)} retirados ({len(self._docs)} en total)")
+
+    def _add_locked(self, doc_id, doc, digest):
+        terms = collections.Counter()
+        for field, text in doc['fields'].items():
+            for term in analyze(text):
+                terms[term] += FIELD_WEIGHTS[field]
+        for term, tf in terms.items():
+            if term not in self._postings:
+                for variant in _deletes(term, max_distance(term)):
+                    self._deletes[variant].add(term)
+            self._postings[term][doc_id] = tf
+        length = sum(terms.values())
+        self._docs[doc_id] = {"hash": digest, "result": doc['result'], "terms": dict(terms), "length": length,
+                              "text": ' '.join(' '.join([text] * int(FIELD_WEIGHTS[field]))
+                                               for field, text in doc['fields'].items())}
+        self._total_length += length
+
+    def _remove_locked(self, doc_id):
+        entry = self._docs.pop(doc_id)
+        self._total_length -= entry['length']
+        for term in entry['terms']:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if postings:
+                continue
+            del self._postings[term]
+            for variant in _deletes(term, max_distance(term)):
+                owners = self._deletes.get(variant)
+                if owners is not None:
+                    owners.discard(term)
+                    if not owners:
+                        del self._deletes[variant]
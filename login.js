@@ -28,6 +28,8 @@ document.addEventListener('DOMContentLoaded', () => {
             }
 
             sessionStorage.setItem('user', JSON.stringify(result.user));
+            // Token firmado para que el servidor valide la sesión sin volver a consultar Informix
+            sessionStorage.setItem('token', result.token);
 
             // Redirección con rutas relativas
             if (result.user.rol === 'admin') {
@@ -0,0 +1,48 @@
+import json
+
+# Máximo de notificaciones por entrega; el resto se envía al confirmar la anterior
+REPLAY_LIMIT = 200
+
+
+def store(cur, admin_username, notification):
+    """Guardar una notificación que no se pudo entregar en la bandeja del administrador"""
+    cur.execute("""
+        INSERT INTO soporte_ti.stnotificacion_pendiente (notif_admin, notif_payload)
+        VALUES (%s, %s)
+        RETURNING notif_id
+    """, (admin_username, json.dumps(notification)))
+    return cur.fetchone()[0]
+
+
+def pending(cur, admin_username, after_id=0, limit=REPLAY_LIMIT):
+    """
+    Notificaciones pendientes agrupadas en un solo envío:
+    {"count", "last_id", "has_more", "notifications": [...]}. None si la bandeja está vacía.
+    """
+    cur.execute("""
+        SELECT notif_id, notif_payload
+        FROM soporte_ti.stnotificacion_pendiente
+        WHERE notif_admin = %s AND notif_id > %s
+        ORDER BY notif_id
+        LIMIT %s
+    """, (admin_username, after_id, limit + 1))
+    rows = cur.fetchall()
+    if not rows:
+        return None
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "count": len(rows),
+        "last_id": rows[-1][0],
+        "has_more": has_more,
+        "notifications": [payload for _, payload in rows],
+    }
+
+
+def ack(cur, admin_username, last_id):
+    """Borrar de la bandeja lo entregado hasta last_id inclusive"""
+    cur.execute("""
+        DELETE FROM soporte_ti.stnotificacion_pendiente
+        WHERE notif_admin = %s AND notif_id <= %s
+    """, (admin_username, last_id))
+    return cur.rowcount
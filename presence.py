@@ -0,0 +1,195 @@
+import logging
+import threading
+import uuid
+
+try:
+    import redis
+except ImportError:  # solo hace falta con PRESENCE_URL=redis://...
+    redis = None
+
+
+def admin_room(username):
+    """Sala de Socket.IO con todas las consolas abiertas de un administrador"""
+    return f"admin:{username}"
+
+
+class MemoryPresence:
+    """
+    Registro de administradores conectados en memoria (un solo proceso).
+
+    Un administrador puede tener varias conexiones (una por pestaña). El índice
+    inverso SID -> usuario permite resolver una desconexión sin recorrer el registro.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sids_by_user = {}
+        self._user_by_sid = {}
+
+    def add(self, username, sid):
+        """Registrar una conexión; devuelve cuántas tiene ahora el administrador"""
+        with self._lock:
+            previous = self._user_by_sid.get(sid)
+            if previous and previous != username:
+                self._discard_locked(previous, sid)
+            self._user_by_sid[sid] = username
+            sids = self._sids_by_user.setdefault(username, set())
+            sids.add(sid)
+            return len(sids)
+
+    def remove_sid(self, sid):
+        """Quitar una conexión; devuelve (usuario, conexiones restantes) o (None, 0)"""
+        with self._lock:
+            username = self._user_by_sid.pop(sid, None)
+            if not username:
+                return None, 0
+            return username, self._discard_locked(username, sid)
+
+    def _discard_locked(self, username, sid):
+        sids = self._sids_by_user.get(username)
+        if sids is None:
+            return 0
+        sids.discard(sid)
+        if not sids:
+            del self._sids_by_user[username]
+        return len(sids)
+
+    def sessions(self, username):
+        """Número de conexiones abiertas del administrador"""
+        with self._lock:
+            return len(self._sids_by_user.get(username, ()))
+
+    def snapshot(self):
+        """{usuario: número de conexiones}"""
+        with self._lock:
+            return {username: len(sids) for username, sids in self._sids_by_user.items()}
+
+    def close(self):
+        pass
+
+
+class RedisPresence:
+    """
+    Registro de administradores conectados compartido entre workers mediante Redis.
+
+    Un conjunto de SIDs por administrador, un hash SID -> usuario, un hash SID -> worker y un
+    conjunto con los administradores en línea. Alta y baja se hacen con scripts para que
+    sean atómicas.
+
+    Si un worker muere (OOM, despliegue) sus SIDs nunca reciben el disconnect. Cada worker
+    renueva una llave con vencimiento (latido) y al contar sesiones se descartan los SIDs de
+    workers cuya llave ya venció: un administrador con solo consolas muertas cuenta como
+    desconectado y sus notificaciones van a la bandeja.
+    """
+
+    _ADD = """
+        local previous = redis.call('HGET', KEYS[1], ARGV[2])
+        if previous and previous ~= ARGV[1] then
+            redis.call('SREM', KEYS[3] .. previous, ARGV[2])
+            if redis.call('SCARD', KEYS[3] .. previous) == 0 then
+                redis.call('SREM', KEYS[2], previous)
+            end
+        end
+        redis.call('HSET', KEYS[1], ARGV[2], ARGV[1])
+        redis.call('HSET', KEYS[4], ARGV[2], ARGV[3])
+        redis.call('SADD', KEYS[3] .. ARGV[1], ARGV[2])
+        redis.call('SADD', KEYS[2], ARGV[1])
+        return redis.call('SCARD', KEYS[3] .. ARGV[1])
+    """
+
+    _REMOVE_SID = """
+        local username = redis.call('HGET', KEYS[1], ARGV[1])
+        redis.call('HDEL', KEYS[4], ARGV[1])
+        if not username then return {false, 0} end
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        redis.call('SREM', KEYS[3] .. username, ARGV[1])
+        local remaining = redis.call('SCARD', KEYS[3] .. username)
+        if remaining == 0 then
+            redis.call('SREM', KEYS[2], username)
+        end
+        return {username, remaining}
+    """
+
+    # Conexiones vivas del administrador; de paso borra las de workers sin latido
+    _SESSIONS = """
+        local user_key = KEYS[3] .. ARGV[1]
+        local alive = 0
+        for _, sid in ipairs(redis.call('SMEMBERS', user_key)) do
+            local worker = redis.call('HGET', KEYS[4], sid)
+            if worker and redis.call('EXISTS', KEYS[5] .. worker) == 1 then
+                alive = alive + 1
+            else
+                redis.call('SREM', user_key, sid)
+                redis.call('HDEL', KEYS[1], sid)
+                redis.call('HDEL', KEYS[4], sid)
+            end
+        end
+        if alive == 0 then
+            redis.call('SREM', KEYS[2], ARGV[1])
+        end
+        return alive
+    """
+
+    def __init__(self, url, prefix='soporte_ti:presence', heartbeat=10.0):
+        if redis is None:
+            raise RuntimeError("El registro de presencia en Redis requiere el paquete 'redis'")
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._sids_key = f"{prefix}:sids"
+        self._online_key = f"{prefix}:online"
+        self._user_prefix = f"{prefix}:user:"
+        self._workers_key = f"{prefix}:sid_worker"
+        self._worker_prefix = f"{prefix}:worker:"
+        self._keys = [self._sids_key, self._online_key, self._user_prefix,
+                      self._workers_key, self._worker_prefix]
+        self._add = self._client.register_script(self._ADD)
+        self._remove_sid = self._client.register_script(self._REMOVE_SID)
+        self._sessions = self._client.register_script(self._SESSIONS)
+        # Identificador de este proceso; la llave vence si deja de renovarse
+        self.worker_id = uuid.uuid4().hex
+        self.heartbeat = heartbeat
+        self._worker_key = self._worker_prefix + self.worker_id
+        self._stopped = threading.Event()
+        self._beat()
+        threading.Thread(target=self._heartbeat_loop, name='presence-heartbeat', daemon=True).start()
+
+    def add(self, username, sid):
+        return int(self._add(keys=self._keys, args=[username, sid, self.worker_id]))
+
+    def remove_sid(self, sid):
+        username, remaining = self._remove_sid(keys=self._keys, args=[sid])
+        return (username or None), int(remaining)
+
+    def sessions(self, username):
+        return int(self._sessions(keys=self._keys, args=[username]))
+
+    def snapshot(self):
+        usernames = sorted(self._client.smembers(self._online_key))
+        pipe = self._client.pipeline()
+        for username in usernames:
+            self._sessions(keys=self._keys, args=[username], client=pipe)
+        return {username: int(count) for username, count in zip(usernames, pipe.execute()) if count}
+
+    def close(self):
+        """Al apagar el worker: sus SIDs dejan de contar de inmediato"""
+        self._stopped.set()
+        try:
+            self._client.delete(self._worker_key)
+        except Exception as e:
+            logging.error(f"No se pudo retirar el worker {self.worker_id} del registro de presencia: {e}")
+
+    def _beat(self):
+        self._client.set(self._worker_key, 1, ex=max(int(self.heartbeat * 3), 1))
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(self.heartbeat):
+            try:
+                self._beat()
+            except Exception as e:
+                logging.error(f"No se pudo renovar el latido de presencia: {e}")
+
+
+def create_presence(url=None):
+    """Registro según la URL: redis://... compartido entre procesos; vacío, en memoria."""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisPresence(url)
+    return MemoryPresence()
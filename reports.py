@@ -0,0 +1,108 @@
+import datetime
+
+from schema import ROLLUP_BACKFILL_SQL
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# Máscaras de GROUPING(rep_est, rep_tip, rep_asig, periodo) para cada conjunto de agrupación
+_GROUPING_KEYS = {
+    0b0111: 'by_status',
+    0b1011: 'by_type',
+    0b1101: 'by_assignee',
+    0b1110: 'by_period',
+    0b1111: 'total',
+}
+
+
+def build_rollup_filters(args):
+    """Filtros de reportes sobre el resumen diario: date_from, date_to, type, status, assignee."""
+    conditions, params = [], []
+    for name, condition in (('date_from', "rep_dia >= %s"), ('date_to', "rep_dia <= %s")):
+        value = args.get(name)
+        if value:
+            try:
+                params.append(datetime.date.fromisoformat(value[:10]))
+            except ValueError:
+                raise ValueError(f"Fecha inválida en '{name}': {value}")
+            conditions.append(condition)
+    for name, column in (('type', 'rep_tip'), ('status', 'rep_est'), ('assignee', 'rep_asig')):
+        value = args.get(name)
+        if value == 'none' and name == 'assignee':
+            conditions.append("rep_asig = ''")
+        elif value:
+            values = [v.strip() for v in value.split(',') if v.strip()]
+            conditions.append(f"{column} = ANY(%s)")
+            params.append(values)
+    return conditions, params
+
+
+def _bucket(tickets, calif_suma, calif_n):
+    return {
+        "tickets": int(tickets),
+        "rated": int(calif_n),
+        "avg_rating": round(calif_suma / calif_n, 2) if calif_n else None,
+    }
+
+
+def summary(cur, args):
+    """
+    Totales por estado, tipo, técnico y período más el promedio de calificación,
+    en una sola consulta sobre el resumen diario (su tamaño no depende del historial de tickets).
+    """
+    granularity = args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"'granularity' debe ser uno de: {', '.join(GRANULARITIES)}")
+    conditions, params = build_rollup_filters(args)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cur.execute(f"""
+        SELECT rep_est, rep_tip, rep_asig, periodo,
+               GROUPING(rep_est, rep_tip, rep_asig, periodo) AS agrupacion,
+               SUM(rep_tickets), SUM(rep_calif_suma), SUM(rep_calif_n)
+        FROM (
+            SELECT r.*, date_trunc(%s, rep_dia)::date AS periodo
+            FROM soporte_ti.streporte_diario r
+            {where}
+        ) filtrado
+        GROUP BY GROUPING SETS ((rep_est), (rep_tip), (rep_asig), (periodo), ())
+    """, [granularity] + params)
+
+    result = {
+        "granularity": granularity,
+        "total": _bucket(0, 0, 0),
+        "by_status": {},
+        "by_type": {},
+        "by_assignee": {},
+        "by_period": [],
+    }
+    for est, tip, asig, periodo, grouping, tickets, calif_suma, calif_n in cur.fetchall():
+        key = _GROUPING_KEYS[grouping]
+        bucket = _bucket(tickets or 0, calif_suma or 0, calif_n or 0)
+        if bucket["tickets"] == 0 and key != 'total':
+            continue
+        if key == 'total':
+            result['total'] = bucket
+        elif key == 'by_status':
+            result['by_status'][est] = bucket
+        elif key == 'by_type':
+            result['by_type'][tip] = bucket
+        elif key == 'by_assignee':
+            # '' representa los tickets sin técnico asignado
+            result['by_assignee'][asig or None] = bucket
+        else:
+            result['by_period'].append(dict(period=periodo.isoformat(), **bucket))
+    result['by_period'].sort(key=lambda item: item['period'])
+    result['by_assignee'] = [dict(assignee=k, **v) for k, v in
+                             sorted(result['by_assignee'].items(), key=lambda kv: -kv[1]['tickets'])]
+    return result
+
+
+def rebuild(conn):
+    """Reconstruir el resumen completo desde stticket (bloquea escrituras de tickets mientras dura)."""
+    with conn.cursor() as cur:
+        cur.execute("LOCK TABLE soporte_ti.stticket IN SHARE MODE")
+        cur.execute("DELETE FROM soporte_ti.streporte_diario")
+        cur.execute(ROLLUP_BACKFILL_SQL)
+        rows = cur.rowcount
+    conn.commit()
+    return rows
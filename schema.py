@@ -0,0 +1,299 @@
+import logging
+import time
+
+# Recalcula el resumen diario de reportes desde stticket
+ROLLUP_BACKFILL_SQL = """
+    INSERT INTO soporte_ti.streporte_diario
+        (rep_dia, rep_tip, rep_est, rep_asig, rep_tickets, rep_calif_suma, rep_calif_n)
+    SELECT COALESCE(ticket_fec_ticket, now())::date,
+           COALESCE(TRIM(ticket_tip_ticket), ''),
+           COALESCE(TRIM(ticket_est_ticket), ''),
+           COALESCE(ticket_asignado_a, ''),
+           COUNT(*),
+           COALESCE(SUM(ticket_calificacion), 0),
+           COUNT(ticket_calificacion)
+    FROM soporte_ti.stticket
+    GROUP BY 1, 2, 3, 4
+"""
+
+# DDL idempotente que la aplicación necesita además de las tablas originales.
+# Se aplica al arrancar; cada sentencia es independiente para que un fallo
+# (por ejemplo, falta de permisos) no impida aplicar las demás.
+SCHEMA_STATEMENTS = [
+    # Paginación por cursor del listado de administración
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stticket_fec_cod
+    ON soporte_ti.stticket (ticket_fec_ticket DESC, ticket_cod_ticket DESC)
+    """,
+    # Sincronización incremental: cada alta o cambio de un ticket recibe un número de versión
+    # creciente y cada borrado deja una lápida con su versión. Las transacciones pueden
+    # confirmarse en otro orden que sus versiones, así que además se guarda el id de la
+    # transacción que escribió (xid8): los cambios se piden por transacción, no por versión.
+    """
+    CREATE SEQUENCE IF NOT EXISTS soporte_ti.stticket_version_seq;
+    ALTER TABLE soporte_ti.stticket ADD COLUMN IF NOT EXISTS ticket_ver_ticket BIGINT;
+    ALTER TABLE soporte_ti.stticket ADD COLUMN IF NOT EXISTS ticket_xid_ticket XID8;
+    CREATE TABLE IF NOT EXISTS soporte_ti.stticket_borrados (
+        borrado_id_ticket VARCHAR(50) NOT NULL,
+        borrado_ver_ticket BIGINT NOT NULL,
+        borrado_fec_ticket TIMESTAMP NOT NULL DEFAULT now()
+    );
+    ALTER TABLE soporte_ti.stticket_borrados ADD COLUMN IF NOT EXISTS borrado_xid_ticket XID8;
+    CREATE INDEX IF NOT EXISTS idx_stticket_borrados_ver ON soporte_ti.stticket_borrados (borrado_ver_ticket);
+    CREATE INDEX IF NOT EXISTS idx_stticket_borrados_xid ON soporte_ti.stticket_borrados (borrado_xid_ticket);
+    """,
+    """
+    CREATE OR REPLACE FUNCTION soporte_ti.stticket_touch_version() RETURNS trigger AS $$
+    BEGIN
+        NEW.ticket_ver_ticket := nextval('soporte_ti.stticket_version_seq');
+        NEW.ticket_xid_ticket := pg_current_xact_id();
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION soporte_ti.stticket_log_delete() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO soporte_ti.stticket_borrados (borrado_id_ticket, borrado_ver_ticket, borrado_xid_ticket)
+        VALUES (OLD.ticket_id_ticket, nextval('soporte_ti.stticket_version_seq'), pg_current_xact_id());
+        RETURN OLD;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_stticket_version ON soporte_ti.stticket;
+    CREATE TRIGGER trg_stticket_version BEFORE INSERT OR UPDATE ON soporte_ti.stticket
+        FOR EACH ROW EXECUTE FUNCTION soporte_ti.stticket_touch_version();
+
+    DROP TRIGGER IF EXISTS trg_stticket_delete ON soporte_ti.stticket;
+    CREATE TRIGGER trg_stticket_delete AFTER DELETE ON soporte_ti.stticket
+        FOR EACH ROW EXECUTE FUNCTION soporte_ti.stticket_log_delete();
+    """,
+    # Los adjuntos se buscan por ticket; agregar o quitar uno cuenta como cambio del ticket
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_starchivos_ticket
+    ON soporte_ti.starchivos (archivo_cod_ticket)
+    """,
+    """
+    CREATE OR REPLACE FUNCTION soporte_ti.starchivos_touch_ticket() RETURNS trigger AS $$
+    DECLARE
+        cod INTEGER;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            cod := OLD.archivo_cod_ticket;
+        ELSE
+            cod := NEW.archivo_cod_ticket;
+        END IF;
+        -- El trigger de versión de stticket asigna el número nuevo
+        UPDATE soporte_ti.stticket SET ticket_ver_ticket = NULL WHERE ticket_cod_ticket = cod;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_starchivos_touch_ticket ON soporte_ti.starchivos;
+    CREATE TRIGGER trg_starchivos_touch_ticket AFTER INSERT OR DELETE ON soporte_ti.starchivos
+        FOR EACH ROW EXECUTE FUNCTION soporte_ti.starchivos_touch_ticket();
+    """,
+    # Resumen de reportes: un contador por (día, tipo, estado, técnico) que el trigger
+    # mueve de celda en cada alta, cambio de estado, asignación o calificación.
+    # Todo en una transacción: el CREATE TRIGGER bloquea escrituras hasta que termine el relleno.
+    """
+    CREATE TABLE IF NOT EXISTS soporte_ti.streporte_diario (
+        rep_dia DATE NOT NULL,
+        rep_tip VARCHAR(50) NOT NULL,
+        rep_est VARCHAR(10) NOT NULL,
+        rep_asig VARCHAR(100) NOT NULL,
+        rep_tickets INTEGER NOT NULL DEFAULT 0,
+        rep_calif_suma INTEGER NOT NULL DEFAULT 0,
+        rep_calif_n INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (rep_dia, rep_tip, rep_est, rep_asig)
+    );
+
+    CREATE OR REPLACE FUNCTION soporte_ti.streporte_aplicar(
+        dia DATE, tip TEXT, est TEXT, asig TEXT, calif INTEGER, signo INTEGER) RETURNS void AS $$
+        INSERT INTO soporte_ti.streporte_diario AS r
+            (rep_dia, rep_tip, rep_est, rep_asig, rep_tickets, rep_calif_suma, rep_calif_n)
+        VALUES (dia, COALESCE(TRIM(tip), ''), COALESCE(TRIM(est), ''), COALESCE(asig, ''),
+                signo, signo * COALESCE(calif, 0), CASE WHEN calif IS NULL THEN 0 ELSE signo END)
+        ON CONFLICT (rep_dia, rep_tip, rep_est, rep_asig) DO UPDATE SET
+            rep_tickets = r.rep_tickets + EXCLUDED.rep_tickets,
+            rep_calif_suma = r.rep_calif_suma + EXCLUDED.rep_calif_suma,
+            rep_calif_n = r.rep_calif_n + EXCLUDED.rep_calif_n;
+    $$ LANGUAGE sql;
+
+    CREATE OR REPLACE FUNCTION soporte_ti.stticket_rollup() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND
+           ROW(OLD.ticket_fec_ticket, OLD.ticket_tip_ticket, OLD.ticket_est_ticket,
+               OLD.ticket_asignado_a, OLD.ticket_calificacion)
+           IS NOT DISTINCT FROM
+           ROW(NEW.ticket_fec_ticket, NEW.ticket_tip_ticket, NEW.ticket_est_ticket,
+               NEW.ticket_asignado_a, NEW.ticket_calificacion) THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM soporte_ti.streporte_aplicar(COALESCE(OLD.ticket_fec_ticket, now())::date,
+                OLD.ticket_tip_ticket, OLD.ticket_est_ticket, OLD.ticket_asignado_a,
+                OLD.ticket_calificacion, -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM soporte_ti.streporte_aplicar(COALESCE(NEW.ticket_fec_ticket, now())::date,
+                NEW.ticket_tip_ticket, NEW.ticket_est_ticket, NEW.ticket_asignado_a,
+                NEW.ticket_calificacion, 1);
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_stticket_rollup ON soporte_ti.stticket;
+    CREATE TRIGGER trg_stticket_rollup AFTER INSERT OR UPDATE OR DELETE ON soporte_ti.stticket
+        FOR EACH ROW EXECUTE FUNCTION soporte_ti.stticket_rollup();
+
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM soporte_ti.streporte_diario) THEN
+            EXECUTE $sql$""" + ROLLUP_BACKFILL_SQL + """$sql$;
+        END IF;
+    END $$;
+    """,
+    # Registro de interacciones por lotes: (session_id, log_seq) identifica cada evento del cliente
+    # para que los reintentos no dupliquen filas. Los registros sin secuencia no participan.
+    """
+    ALTER TABLE soporte_ti.stlogchat ADD COLUMN IF NOT EXISTS log_seq INTEGER
+    """,
+    """
+    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_stlogchat_session_seq
+    ON soporte_ti.stlogchat (session_id, log_seq) WHERE log_seq IS NOT NULL
+    """,
+    # Identificadores de ticket legibles y sin colisiones: TKT-AAAAMMDD-NNNNNN con un número de secuencia
+    """
+    CREATE SEQUENCE IF NOT EXISTS soporte_ti.stticket_numero_seq;
+    CREATE OR REPLACE FUNCTION soporte_ti.stticket_nuevo_id(prefijo TEXT) RETURNS TEXT AS $$
+        -- lpad recorta el texto si es más largo que el ancho: pasado el millón se rellena al largo real
+        SELECT prefijo || '-' || to_char(now(), 'YYYYMMDD') || '-' || lpad(n, GREATEST(6, length(n)), '0')
+        FROM (SELECT nextval('soporte_ti.stticket_numero_seq')::text AS n) s
+    $$ LANGUAGE sql;
+    """,
+    # El índice por id era no único; se reemplaza (también si quedó inválido por un intento fallido)
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'soporte_ti' AND c.relname = 'idx_stticket_id'
+              AND NOT (i.indisunique AND i.indisvalid)
+        ) THEN
+            DROP INDEX soporte_ti.idx_stticket_id;
+        END IF;
+    END $$
+    """,
+    """
+    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_stticket_id
+    ON soporte_ti.stticket (ticket_id_ticket)
+    """,
+    # SHA-256 del contenido de cada adjunto, calculado al recibirlo
+    """
+    ALTER TABLE soporte_ti.starchivos ADD COLUMN IF NOT EXISTS archivo_hash_archivo CHAR(64)
+    """,
+    # Almacén de adjuntos por contenido: un blob por hash y cuántas filas de starchivos lo usan.
+    # Solo cuentan las filas cuya ruta está en el almacén (blobs/...); las antiguas por ticket no.
+    """
+    CREATE TABLE IF NOT EXISTS soporte_ti.stadjunto_blob (
+        blob_hash CHAR(64) PRIMARY KEY,
+        blob_refs INTEGER NOT NULL DEFAULT 0,
+        blob_fec TIMESTAMP NOT NULL DEFAULT now()
+    );
+
+    CREATE OR REPLACE FUNCTION soporte_ti.starchivos_blob_refs() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.archivo_rut_archivo LIKE 'blobs/%' THEN
+            UPDATE soporte_ti.stadjunto_blob SET blob_refs = blob_refs - 1
+            WHERE blob_hash = OLD.archivo_hash_archivo;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.archivo_rut_archivo LIKE 'blobs/%' THEN
+            INSERT INTO soporte_ti.stadjunto_blob AS b (blob_hash, blob_refs)
+            VALUES (NEW.archivo_hash_archivo, 1)
+            ON CONFLICT (blob_hash) DO UPDATE SET blob_refs = b.blob_refs + 1;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_starchivos_blob_refs ON soporte_ti.starchivos;
+    CREATE TRIGGER trg_starchivos_blob_refs
+        AFTER INSERT OR DELETE OR UPDATE OF archivo_rut_archivo ON soporte_ti.starchivos
+        FOR EACH ROW EXECUTE FUNCTION soporte_ti.starchivos_blob_refs();
+    """,
+    # Bandeja de notificaciones para administradores desconectados
+    """
+    CREATE TABLE IF NOT EXISTS soporte_ti.stnotificacion_pendiente (
+        notif_id BIGSERIAL PRIMARY KEY,
+        notif_admin VARCHAR(100) NOT NULL,
+        notif_payload JSONB NOT NULL,
+        notif_fec TIMESTAMP NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_stnotificacion_admin
+    ON soporte_ti.stnotificacion_pendiente (notif_admin, notif_id);
+    """,
+    # Incidente al que pertenece cada ticket: tickets abiertos casi idénticos comparten el id
+    # del primero del grupo (lo calcula la aplicación al crear el ticket)
+    """
+    ALTER TABLE soporte_ti.stticket ADD COLUMN IF NOT EXISTS ticket_incidente VARCHAR(50)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stticket_incidente
+    ON soporte_ti.stticket (ticket_incidente) WHERE ticket_incidente IS NOT NULL
+    """,
+    # Versionar los tickets anteriores a la columna (solo afecta filas la primera vez)
+    """
+    UPDATE soporte_ti.stticket SET ticket_ver_ticket = nextval('soporte_ti.stticket_version_seq')
+    WHERE ticket_ver_ticket IS NULL
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stticket_ver
+    ON soporte_ti.stticket (ticket_ver_ticket)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stticket_xid
+    ON soporte_ti.stticket (ticket_xid_ticket)
+    """,
+]
+
+
+# Llave del candado de sesión que serializa apply_schema entre workers (cualquier bigint fijo)
+SCHEMA_LOCK_KEY = 7_346_212_001
+SCHEMA_LOCK_POLL = 0.5
+
+
+def apply_schema(connect):
+    """
+    Ejecutar SCHEMA_STATEMENTS con una conexión nueva en autocommit (CONCURRENTLY lo requiere).
+
+    Cada worker de gunicorn lo llama al arrancar; el candado consultivo hace que se apliquen
+    de uno en uno. En paralelo, un worker podía borrar el índice único que otro estaba
+    creando y los CREATE OR REPLACE simultáneos fallaban con "tuple concurrently updated".
+    Los que esperan encuentran el esquema ya aplicado y cada sentencia es idempotente.
+    """
+    try:
+        conn = connect()
+    except Exception as e:
+        logging.error(f"No se pudo aplicar el esquema: {e}")
+        return
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            # pg_try_advisory_lock en un bucle y no pg_advisory_lock: mientras espera, éste
+            # mantiene abierta una consulta con snapshot y el CREATE INDEX CONCURRENTLY del
+            # worker que tiene el candado se quedaría esperando a que termine.
+            while True:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+                if cur.fetchone()[0]:
+                    break
+                time.sleep(SCHEMA_LOCK_POLL)
+            try:
+                for statement in SCHEMA_STATEMENTS:
+                    try:
+                        cur.execute(statement)
+                    except Exception as e:
+                        logging.error(f"Error aplicando esquema: {e}\n{statement.strip()}")
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+    except Exception as e:
+        logging.error(f"No se pudo aplicar el esquema: {e}")
+    finally:
+        conn.close()
@@ -20,8 +20,14 @@ document.addEventListener('DOMContentLoaded', async () => {
         }
     };
     const loggedInUser = JSON.parse(sessionStorage.getItem('user'));
+    const sessionToken = sessionStorage.getItem('token');
     const sessionId = `${loggedInUser.username}-${Date.now()}`;
 
+    // El servidor toma el usuario del token de sesión, no del cuerpo de la petición
+    function authHeaders(headers = {}) {
+        return sessionToken ? { ...headers, 'Authorization': `Bearer ${sessionToken}` } : headers;
+    }
+
     // --- ELEMENTOS DEL DOM ---
     const chatMessages = document.getElementById('chatMessages');
     const userInput = document.getElementById('userInput');
@@ -33,23 +39,77 @@ document.addEventListener('DOMContentLoaded', async () => {
     setupFileUpload();
 
     // --- FUNCIÓN DE LOGGING ---
-    async function logInteraction(logData) {
+    // Las interacciones se acumulan y se envían por lotes. Cada una lleva un número de
+    // secuencia, así el servidor ignora las repetidas si un lote se reenvía.
+    const LOG_FLUSH_DELAY = 3000;
+    const LOG_FLUSH_SIZE = 20;
+    let logSeq = 0;
+    let pendingLogs = [];
+    let logFlushTimer = null;
+    let logFlushInFlight = false;
+
+    function logBatchPayload(events) {
+        return JSON.stringify({
+            sessionId: sessionId,
+            username: loggedInUser.username,
+            // sendBeacon no envía cabeceras: el token también va en el cuerpo
+            token: sessionToken,
+            events: events
+        });
+    }
+
+    async function flushInteractionLogs() {
+        clearTimeout(logFlushTimer);
+        logFlushTimer = null;
+        if (logFlushInFlight || pendingLogs.length === 0) return;
+        const batch = pendingLogs.slice();
+        logFlushInFlight = true;
         try {
-            await fetch(`${API_BASE_URL}/log/interaction`, {
+            const response = await fetch(`${API_BASE_URL}/log/interactions`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    sessionId: sessionId,
-                    username: loggedInUser.username,
-                    actionType: logData.actionType,
-                    actionValue: logData.actionValue,
-                    botResponse: logData.botResponse || ''
-                })
+                headers: authHeaders({ 'Content-Type': 'application/json' }),
+                body: logBatchPayload(batch),
+                keepalive: true
             });
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const sent = new Set(batch.map(event => event.seq));
+            pendingLogs = pendingLogs.filter(event => !sent.has(event.seq));
         } catch (error) {
-            console.error('Error al registrar la interacción:', error);
+            console.error('Error al registrar las interacciones:', error);
+        } finally {
+            logFlushInFlight = false;
+            if (pendingLogs.length > 0 && !logFlushTimer) {
+                logFlushTimer = setTimeout(flushInteractionLogs, LOG_FLUSH_DELAY);
+            }
+        }
+    }
+
+    function logInteraction(logData) {
+        pendingLogs.push({
+            seq: ++logSeq,
+            actionType: logData.actionType,
+            actionValue: logData.actionValue,
+            botResponse: logData.botResponse || ''
+        });
+        if (pendingLogs.length >= LOG_FLUSH_SIZE) {
+            flushInteractionLogs();
+        } else if (!logFlushTimer) {
+            logFlushTimer = setTimeout(flushInteractionLogs, LOG_FLUSH_DELAY);
+        }
+    }
+
+    // Al salir de la página se envía lo pendiente con sendBeacon (texto plano, sin preflight)
+    function beaconInteractionLogs() {
+        if (pendingLogs.length === 0) return;
+        if (navigator.sendBeacon(`${API_BASE_URL}/log/interactions`, logBatchPayload(pendingLogs))) {
+            pendingLogs = [];
         }
     }
+    window.addEventListener('pagehide', beaconInteractionLogs);
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') beaconInteractionLogs();
+    });
+
      // --- VERIFICACIÓN DE ROL Y BOTÓN ADMIN ---
     function checkAdminRoleAndSetup() {
         if (loggedInUser && loggedInUser.rol === 'admin') {
@@ -476,6 +536,12 @@ document.addEventListener('DOMContentLoaded', async () => {
                     if (type === 'main_menu') displayMainMenu();
                     else handlePolicySelection(params[0]);
                     break;
+                case 'REVIEWING_SUGGESTIONS':
+                    handleSuggestionSelection(type, params);
+                    break;
+                case 'SELECTING_KB_RESULT':
+                    handleKnowledgeBaseResult(type, params);
+                    break;
             }
         }, 800);
     }
@@ -579,7 +645,7 @@ document.addEventListener('DOMContentLoaded', async () => {
             try {
                 await fetch(`${API_BASE_URL}/tickets/log-solved`, {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
+                    headers: authHeaders({ 'Content-Type': 'application/json' }),
                     body: JSON.stringify({ context: state.context, user: loggedInUser })
                 });
             } catch (error) { 
@@ -656,14 +722,130 @@ document.addEventListener('DOMContentLoaded', async () => {
             const previewContainer = document.getElementById('filePreview');
             if (previewContainer) previewContainer.remove();
             
-            //  Llamar correctamente a la función de preferencia
-            await askAdminPreference();
+            //  Antes de elegir técnico, ofrecer casos parecidos que podrían resolverlo
+            await offerSuggestionsBeforeTicket(text);
                 
             } else {
-                addMessage({ text: "No he entendido. Por favor, usa los botones." });
+                await searchKnowledgeBase(text);
             }
         }, 1000);
     }
+
+    // Antes de crear el ticket: casos de la base de conocimiento parecidos a la descripción
+    // (directamente o a través de tickets ya resueltos con el mismo asunto)
+    async function offerSuggestionsBeforeTicket(description) {
+        let suggestions = [];
+        try {
+            const response = await fetch(`${API_BASE_URL}/tickets/suggestions`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ problemDescription: description })
+            });
+            if (response.ok) suggestions = (await response.json()).suggestions;
+        } catch (error) {
+            console.error("Error al buscar sugerencias:", error);
+        }
+
+        // Los casos que el usuario ya siguió sin éxito no se vuelven a ofrecer
+        state.context.casesTried = state.context.casesTried || [];
+        const currentCase = `${state.context.categoryKey}:${state.context.subcategoryKey}`;
+        const seen = new Set([...state.context.casesTried, currentCase]);
+        const options = [];
+        let similarTickets = 0;
+        for (const suggestion of suggestions) {
+            let option = suggestion;
+            if (suggestion.type === 'ticket') {
+                similarTickets++;
+                option = findCaseBySubcategory(suggestion.title);
+            }
+            if (!option || option.type !== 'caso') continue;
+            const key = `${option.category}:${option.subcategory}`;
+            if (seen.has(key)) continue;
+            seen.add(key);
+            options.push(option);
+        }
+
+        if (options.length === 0) {
+            await askAdminPreference();
+            return;
+        }
+
+        state.current = 'REVIEWING_SUGGESTIONS';
+        state.context.suggestions = options;
+        let text = "💡 <strong>Antes de crear el ticket</strong>, esto podría resolver tu problema:";
+        if (similarTickets > 0) {
+            text += `<br><br>Encontré ${similarTickets} ticket(s) parecido(s) que ya se resolvieron.`;
+        }
+        const buttons = options.map((option, index) => ({
+            text: `🛠️ ${option.title}`,
+            action: `suggestion:${index}`
+        }));
+        buttons.push({ text: "📝 Crear el ticket de todos modos", action: "create_ticket" });
+        addMessage({ text, buttons });
+    }
+
+    function findCaseBySubcategory(subcategoryKey) {
+        for (const [categoryKey, category] of Object.entries(KNOWLEDGE_BASE.casos_soporte)) {
+            const solution = category.categorias[subcategoryKey];
+            if (solution) {
+                return { type: 'caso', category: categoryKey, subcategory: subcategoryKey, title: solution.titulo };
+            }
+        }
+        return null;
+    }
+
+    function handleSuggestionSelection(type, params) {
+        const suggestion = type === 'suggestion' ? state.context.suggestions[parseInt(params[0], 10)] : null;
+        if (!suggestion) {
+            askAdminPreference();
+            return;
+        }
+        state.context.casesTried.push(`${state.context.categoryKey}:${state.context.subcategoryKey}`);
+        state.context.categoryKey = suggestion.category;
+        handleSubcategorySelection('subcategory', [suggestion.subcategory]);
+    }
+
+    // Texto libre fuera de la descripción del ticket: buscar en la base de conocimiento
+    async function searchKnowledgeBase(text) {
+        let results = [];
+        try {
+            const response = await fetch(`${API_BASE_URL}/kb/search?q=${encodeURIComponent(text)}&limit=5`);
+            if (response.ok) results = (await response.json()).results;
+        } catch (error) {
+            console.error("Error al buscar en la base de conocimiento:", error);
+        }
+
+        if (results.length === 0) {
+            addMessage({ text: "No he entendido. Por favor, usa los botones." });
+            return;
+        }
+
+        state.current = 'SELECTING_KB_RESULT';
+        state.context.kbResults = results;
+        const buttons = results.map((result, index) => ({
+            text: result.type === 'caso' ? `🛠️ ${result.title}` : `📋 ${result.title}`,
+            action: `kb_result:${index}`
+        }));
+        buttons.push({ text: "🔙 Volver al Menú", action: "main_menu" });
+        addMessage({ text: "Esto es lo que encontré. ¿Cuál se parece a lo que necesitas?", buttons });
+    }
+
+    function handleKnowledgeBaseResult(type, params) {
+        const result = type === 'kb_result' ? state.context.kbResults[parseInt(params[0], 10)] : null;
+        if (!result) {
+            displayMainMenu();
+            return;
+        }
+        if (result.type === 'caso') {
+            state.context.categoryKey = result.category;
+            handleSubcategorySelection('subcategory', [result.subcategory]);
+        } else if (KNOWLEDGE_BASE.politicas[result.policy]) {
+            handlePolicySelection(result.policy);
+        } else {
+            addMessage({ text: `<strong>${result.title}</strong><br><br>${result.content.replace(/\n/g, '<br>')}` });
+            setTimeout(displayMainMenu, 2000);
+        }
+    }
     
     //  NUEVA FUNCIÓN: Crear ticket con archivos adjuntos 
     async function createTicketWithAttachments(preferredAdmin = null) {
@@ -683,7 +865,7 @@ document.addEventListener('DOMContentLoaded', async () => {
             
             const ticketResponse = await fetch(`${API_BASE_URL}/tickets`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify(ticketData)
             });
             
@@ -0,0 +1,127 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo): solo el bloqueo dentro del proceso
+    fcntl = None
+
+INDEX_FILENAME = 'index.json'
+LOCK_FILENAME = 'index.lock'
+
+
+class SoundRegistry:
+    """
+    Índice usuario -> archivo de sonido de notificación, en memoria y persistido en index.json.
+
+    Los archivos se nombran por contenido (<usuario>_<hash>.<ext>), así su URL nunca cambia de
+    contenido y puede cachearse indefinidamente. El índice se reescribe de forma atómica
+    (temporal + rename) y se recarga si otro proceso lo modificó. Recargar, modificar y
+    guardar se hace con un flock sobre index.lock, así los workers no pisan sus cambios.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._index_path = os.path.join(folder, INDEX_FILENAME)
+        self._lock_path = os.path.join(folder, LOCK_FILENAME)
+        self._lock = threading.Lock()
+        self._sounds = {}
+        self._index_mtime = None
+        os.makedirs(folder, exist_ok=True)
+        with self._lock, self._file_lock():
+            self._load_locked()
+
+    def get(self, username):
+        """Nombre del archivo de sonido del usuario o None"""
+        with self._lock:
+            self._reload_if_changed_locked()
+            return self._sounds.get(username)
+
+    def set(self, username, stream, extension):
+        """Guardar el sonido de un usuario (reemplaza el anterior). Devuelve el nombre del archivo."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.part')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            filename = f"{username}_{digest.hexdigest()[:20]}.{extension}"
+            os.replace(tmp_path, os.path.join(self.folder, filename))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock, self._file_lock():
+            self._reload_if_changed_locked()
+            previous = self._sounds.get(username)
+            self._sounds[username] = filename
+            self._save_locked()
+        if previous and previous != filename:
+            self._remove_file(previous)
+        return filename
+
+    def delete(self, username):
+        """Quitar el sonido del usuario; devuelve el nombre del archivo borrado o None"""
+        with self._lock, self._file_lock():
+            self._reload_if_changed_locked()
+            filename = self._sounds.pop(username, None)
+            if filename:
+                self._save_locked()
+        if filename:
+            self._remove_file(filename)
+        return filename
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Bloqueo exclusivo entre procesos mientras se lee, modifica y guarda el índice"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _remove_file(self, filename):
+        try:
+            os.remove(os.path.join(self.folder, filename))
+        except FileNotFoundError:
+            pass
+
+    def _load_locked(self):
+        try:
+            with open(self._index_path, encoding='utf-8') as f:
+                self._sounds = json.load(f)
+            self._index_mtime = os.stat(self._index_path).st_mtime_ns
+        except FileNotFoundError:
+            # Primera vez: construir el índice con los archivos <usuario>_<id>.<ext> existentes
+            self._sounds = {}
+            for filename in sorted(os.listdir(self.folder)):
+                if '_' in filename and not filename.endswith(('.part', '.json', '.lock')):
+                    self._sounds.setdefault(filename.rsplit('_', 1)[0], filename)
+            self._save_locked()
+        except ValueError as e:
+            logging.error(f"Índice de sonidos dañado ({e}); se conserva el que está en memoria")
+
+    def _reload_if_changed_locked(self):
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._index_mtime:
+            self._load_locked()
+
+    def _save_locked(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.part')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._sounds, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self._index_path)
+        self._index_mtime = os.stat(self._index_path).st_mtime_ns
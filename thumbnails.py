@@ -0,0 +1,135 @@
+import concurrent.futures
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # sin Pillow no hay miniaturas; los clientes usan el archivo original
+    Image = None
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+PDF_EXTENSIONS = {'pdf'}
+THUMBNAIL_SUFFIX = '.thumb.jpg'
+
+
+def thumbnail_path(source):
+    """La miniatura se guarda junto al archivo (o blob) original"""
+    return source + THUMBNAIL_SUFFIX
+
+
+class ThumbnailGenerator:
+    """
+    Miniaturas JPEG de imágenes y de la primera página de PDFs.
+
+    submit() las genera en segundo plano con un pool de hilos (al subir un adjunto);
+    ensure() devuelve la ruta de la miniatura o, si falta, la programa y espera como mucho
+    timeout segundos. Una misma miniatura no se genera dos veces a la vez. Los PDFs
+    necesitan pdftoppm (poppler-utils); las imágenes, Pillow.
+
+    run(func, *args) ejecuta la generación: con eventlet los hilos del pool son verdes y el
+    trabajo de Pillow bloquearía el hub, así que la aplicación pasa run_blocking (tpool).
+    """
+
+    def __init__(self, size=(320, 320), max_workers=2, quality=80, run=None):
+        self.size = size
+        self.quality = quality
+        self._run = run or (lambda func, *args: func(*args))
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='thumbnails')
+        # RLock: si el future ya terminó, add_done_callback llama a _forget dentro del bloqueo
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._pdftoppm = shutil.which('pdftoppm')
+
+    def supports(self, extension):
+        extension = (extension or '').lower()
+        if Image is None:
+            return False
+        return extension in IMAGE_EXTENSIONS or (extension in PDF_EXTENSIONS and self._pdftoppm is not None)
+
+    def submit(self, source, extension):
+        """Programar la miniatura sin esperar; devuelve el future o None si no aplica"""
+        if not self.supports(extension) or os.path.exists(thumbnail_path(source)):
+            return None
+        with self._lock:
+            future = self._pending.get(source)
+            if future is None:
+                future = self._executor.submit(self._run, self._generate, source, extension.lower())
+                self._pending[source] = future
+                future.add_done_callback(lambda _: self._forget(source))
+            return future
+
+    def ensure(self, source, extension, timeout=0):
+        """
+        (ruta, pendiente): la ruta si la miniatura existe o se generó dentro de timeout;
+        (None, True) si se sigue generando; (None, False) si no se puede generar.
+        """
+        target = thumbnail_path(source)
+        if os.path.exists(target):
+            return target, False
+        future = self.submit(source, extension)
+        if future is None:
+            return None, False
+        try:
+            return future.result(timeout), False
+        except concurrent.futures.TimeoutError:
+            return None, True
+        except Exception as e:
+            logging.error(f"No se pudo generar la miniatura de {source}: {e}")
+            return None, False
+
+    @staticmethod
+    def discard(source):
+        """Borrar la miniatura de un archivo eliminado"""
+        try:
+            os.remove(thumbnail_path(source))
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, source):
+        with self._lock:
+            self._pending.pop(source, None)
+
+    def _generate(self, source, extension):
+        target = thumbnail_path(source)
+        if extension in PDF_EXTENSIONS:
+            original = self._render_pdf_page(source)
+        else:
+            original = Image.open(source)
+        with original:
+            original.seek(0)  # primer cuadro de los GIF animados
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail(self.size, Image.LANCZOS)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+        # Escribir a un temporal y renombrar: quien lea nunca ve una miniatura a medias
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'JPEG', quality=self.quality, optimize=True)
+            os.replace(tmp_path, target)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return target
+
+    def _render_pdf_page(self, source):
+        with tempfile.TemporaryDirectory() as workdir:
+            prefix = os.path.join(workdir, 'pagina')
+            subprocess.run(
+                [self._pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-png',
+                 '-scale-to', str(max(self.size)), source, prefix],
+                check=True, capture_output=True, timeout=30,
+            )
+            image = Image.open(prefix + '.png')
+            image.load()
+            return image
@@ -196,7 +196,10 @@ class NotificationSystem {
         try {
             const response = await fetch('/api/delete-notification-sound', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${sessionStorage.getItem('token')}`
+                },
                 body: JSON.stringify({ username: this.currentAdmin })
             });
 
@@ -319,6 +322,7 @@ class NotificationSystem {
 
             const response = await fetch('/api/upload-notification-sound', {
                 method: 'POST',
+                headers: { 'Authorization': `Bearer ${sessionStorage.getItem('token')}` },
                 body: formData
             });
 
@@ -403,10 +407,13 @@ class NotificationSystem {
 
     async checkForNewTickets() {
         try {
-            const response = await fetch('http://172.20.8.70:5000/api/admin/tickets');
-            const tickets = await response.json();
+            // Solo los pendientes de este admin: el servidor filtra y pagina
+            const params = new URLSearchParams({ assignee: this.currentAdmin, status: 'PE', limit: 200 });
+            const response = await fetch(`http://172.20.8.70:5000/api/admin/tickets?${params}`);
+            const page = await response.json();
 
             if (!response.ok) throw new Error('Error al obtener tickets');
+            const tickets = page.tickets;
 
             const newTickets = tickets.filter(ticket => 
                 ticket.ticket_asignado_a === this.currentAdmin && 
@@ -692,6 +699,25 @@ class NotificationSystem {
     }
 }
 
+// --- MINIATURAS ---
+// Mientras la miniatura se genera el servidor responde 503 (Retry-After: 2): se vuelve a pedir
+// unas cuantas veces y, si sigue sin estar, se muestra el archivo original (data-view).
+const THUMBNAIL_RETRY_DELAY = 2000;
+const THUMBNAIL_MAX_RETRIES = 3;
+
+function retryThumbnail(img) {
+    const attempt = Number(img.dataset.thumbRetries || 0);
+    if (attempt >= THUMBNAIL_MAX_RETRIES) {
+        img.onerror = null;
+        img.src = img.dataset.view;
+        return;
+    }
+    img.dataset.thumbRetries = attempt + 1;
+    const url = new URL(img.src);
+    url.searchParams.set('retry', attempt + 1);
+    setTimeout(() => { img.src = url.toString(); }, THUMBNAIL_RETRY_DELAY);
+}
+
 // --- SISTEMA DE MIS TICKETS ---
 document.addEventListener('DOMContentLoaded', () => {
     const API_BASE_URL = 'http://172.20.8.70:5000';
@@ -705,7 +731,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- CONEXIÓN WEBSOCKET ---
-    const socket = io('http://172.20.8.70:5000');
+    // Solo WebSocket: con varios workers el sondeo largo necesitaría sesiones fijas en el balanceador
+    const socket = io('http://172.20.8.70:5000', { transports: ['websocket'] });
     
     // Cuando se conecta el WebSocket
     socket.on('connect', () => {
@@ -713,8 +740,68 @@ document.addEventListener('DOMContentLoaded', () => {
         
         // Registrar al admin como "en línea"
         socket.emit('admin_online', { 
-            username: user.username 
+            username: user.username,
+            token: sessionStorage.getItem('token')
         });
+
+        // Tras una reconexión, pedir los eventos de tickets que se perdieron
+        if (ticketEventStream !== null) {
+            socket.emit('resume_ticket_events', {
+                username: user.username,
+                token: sessionStorage.getItem('token'),
+                stream: ticketEventStream,
+                seq: lastTicketEventSeq
+            });
+        }
+    });
+
+    // --- EVENTOS DE TICKETS EN TIEMPO REAL ---
+    // admin_online une a la sala de administradores: los cambios de mis tickets se aplican sin esperar al sondeo
+    let ticketEventStream = null;
+    let lastTicketEventSeq = 0;
+
+    function applyTicketEvent(event) {
+        if (event.stream !== ticketEventStream) {
+            ticketEventStream = event.stream;
+        } else if (event.seq <= lastTicketEventSeq) {
+            return false;
+        }
+        lastTicketEventSeq = event.seq;
+
+        const ticket = myTickets.find(t => t.ticket_id_ticket === event.ticket_id);
+        if ('ticket_asignado_a' in event.changes && (ticket ? event.changes.ticket_asignado_a !== user.username
+                                                         : event.changes.ticket_asignado_a === user.username)) {
+            // Un ticket que entra o sale de mi lista: se recarga con sus adjuntos
+            fetchMyTickets();
+            return false;
+        }
+        if (!ticket) return false;
+        if (event.type === 'attachment_added') {
+            ticket.files = [...(ticket.files || []), event.changes.file];
+        } else {
+            Object.assign(ticket, event.changes);
+        }
+        return true;
+    }
+
+    function rerenderMyTickets() {
+        const activeFilter = document.querySelector('.filter-btn.active');
+        renderTickets(activeFilter ? activeFilter.dataset.filter : 'all');
+        updateStats();
+    }
+
+    socket.on('ticket_event', (event) => {
+        if (applyTicketEvent(event)) rerenderMyTickets();
+    });
+
+    socket.on('ticket_events_replay', (replay) => {
+        if (replay.reset) {
+            ticketEventStream = replay.stream;
+            lastTicketEventSeq = replay.seq;
+            fetchMyTickets();
+            return;
+        }
+        if (replay.events.map(applyTicketEvent).some(Boolean)) rerenderMyTickets();
     });
 
     // Escuchar notificaciones de nuevos tickets
@@ -739,6 +826,31 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Notificaciones que llegaron mientras no había ninguna consola abierta (un solo lote)
+    let lastInboxId = 0;
+    socket.on('notification_inbox', (batch) => {
+        if (batch.last_id > lastInboxId) {
+            lastInboxId = batch.last_id;
+            if (window.notificationSystem) {
+                const single = batch.count === 1 ? batch.notifications[0] : null;
+                window.notificationSystem.addNotification({
+                    type: 'new_ticket',
+                    title: single ? single.title : `🎫 ${batch.count} tickets asignados`,
+                    message: single ? single.message : `Se te asignaron ${batch.count} tickets mientras estabas desconectado`,
+                    ticketId: single ? single.ticket_id : null,
+                    timestamp: new Date().toISOString(),
+                    read: false
+                });
+            }
+            fetchMyTickets();
+        }
+        socket.emit('ack_notifications', {
+            username: user.username,
+            token: sessionStorage.getItem('token'),
+            last_id: batch.last_id
+        });
+    });
+
     // Manejar desconexión
     socket.on('disconnect', () => {
         console.log('❌ Desconectado del servidor WebSocket');
@@ -833,44 +945,64 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Tickets asignados a mí por páginas (cursor): al abrir se pide solo la primera, con sus adjuntos;
+    // las anteriores se piden al llegar al final de la tabla
+    const MY_TICKETS_PAGE_SIZE = 25;
+    let myTicketsCursor = null;
+    let loadingOlderMyTickets = false;
+
+    async function fetchMyTicketsPage(cursor) {
+        const params = new URLSearchParams({
+            assignee: user.username, include_attachments: 'files', limit: MY_TICKETS_PAGE_SIZE
+        });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`${API_BASE_URL}/api/admin/tickets?${params}`);
+        const page = await response.json();
+
+        if (!response.ok) {
+            throw new Error(page.error || 'No se pudieron cargar los tickets.');
+        }
+        myTicketsCursor = page.next_cursor;
+        return page.tickets;
+    }
+
     // Fetch tickets assigned to me
     async function fetchMyTickets() {
         try {
             showLoadingState();
 
-            const response = await fetch(`${API_BASE_URL}/api/admin/tickets`);
-            const allTickets = await response.json();
+            myTickets = await fetchMyTicketsPage(null);
 
-            if (!response.ok) {
-                throw new Error(allTickets.error || 'No se pudieron cargar los tickets.');
-            }
-
-            // Filtrar tickets asignados al usuario actual
-            myTickets = allTickets.filter(ticket => 
-                ticket.ticket_asignado_a === user.username
-            );
-
-            // Obtener archivos para cada ticket
-            for (let ticket of myTickets) {
-                try {
-                    const filesResponse = await fetch(`${API_BASE_URL}/api/tickets/${ticket.ticket_id_ticket}/files`);
-                    if (filesResponse.ok) {
-                        ticket.files = await filesResponse.json();
-                    } else {
-                        ticket.files = [];
-                    }
-                } catch (error) {
-                    ticket.files = [];
-                }
-            }
-
-            renderTickets('all');
+            renderTickets(document.querySelector('.filter-btn.active')?.dataset.filter || 'all');
             updateStats();
         } catch (error) {
             showErrorState(error.message);
         }
     }
 
+    async function loadOlderMyTickets() {
+        if (loadingOlderMyTickets || myTicketsCursor === null) return;
+        loadingOlderMyTickets = true;
+        try {
+            const older = await fetchMyTicketsPage(myTicketsCursor);
+            const known = new Set(myTickets.map(ticket => ticket.ticket_id_ticket));
+            myTickets = myTickets.concat(older.filter(ticket => !known.has(ticket.ticket_id_ticket)));
+            renderTickets(document.querySelector('.filter-btn.active')?.dataset.filter || 'all');
+            updateStats();
+        } catch (error) {
+            console.error('Error al cargar tickets anteriores:', error);
+        } finally {
+            loadingOlderMyTickets = false;
+        }
+    }
+
+    // La fila "Cargar tickets anteriores" pide la siguiente página al hacerse visible
+    const olderTicketsObserver = 'IntersectionObserver' in window
+        ? new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadOlderMyTickets();
+        }, { rootMargin: '200px' })
+        : null;
+
     function showLoadingState() {
         if (ticketList) {
             ticketList.innerHTML = `
@@ -897,6 +1029,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     function renderTickets(filter = 'all') {
         if (!ticketList) return;
+        if (olderTicketsObserver) olderTicketsObserver.disconnect();
 
         let filteredTickets = myTickets;
         if (filter !== 'all') {
@@ -934,7 +1067,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     filesHTML += `
                         <div class="file-preview-item" data-file-id="${file.archivo_cod_archivo}">
                             ${isImage ? 
-                                `<img src="${API_BASE_URL}/api/files/${file.archivo_cod_archivo}/view" alt="${file.archivo_nom_archivo}">` :
+                                `<img src="${API_BASE_URL}/api/files/${file.archivo_cod_archivo}/thumbnail" alt="${file.archivo_nom_archivo}" loading="lazy" data-view="${API_BASE_URL}/api/files/${file.archivo_cod_archivo}/view" onerror="retryThumbnail(this);">` :
                                 `<div class="file-icon">
                                     <i class="fas fa-file"></i>
                                 </div>`
@@ -965,6 +1098,19 @@ document.addEventListener('DOMContentLoaded', () => {
         
         ticketList.innerHTML = ticketsHTML;
                 
+        if (myTicketsCursor !== null) {
+            ticketList.insertAdjacentHTML('beforeend', `
+                <tr id="loadOlderTickets" class="load-more-row">
+                    <td colspan="6" style="text-align: center; padding: 16px; cursor: pointer;">
+                        <i class="fas fa-chevron-down"></i> Cargar tickets anteriores
+                    </td>
+                </tr>
+            `);
+            const loadOlderRow = document.getElementById('loadOlderTickets');
+            loadOlderRow.addEventListener('click', loadOlderMyTickets);
+            if (olderTicketsObserver) olderTicketsObserver.observe(loadOlderRow);
+        }
+
         // Add event listeners to ticket rows
         document.querySelectorAll('.ticket-row').forEach(row => {
             row.addEventListener('click', (e) => {
@@ -1052,7 +1198,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 <div class="file-item">
                     <div class="file-preview" data-file-id="${file.archivo_cod_archivo}">
                         ${isImage ? 
-                            `<img src="${API_BASE_URL}/api/files/${file.archivo_cod_archivo}/view" alt="${file.archivo_nom_archivo}">` :
+                            `<img src="${API_BASE_URL}/api/files/${file.archivo_cod_archivo}/thumbnail" alt="${file.archivo_nom_archivo}" loading="lazy" data-view="${API_BASE_URL}/api/files/${file.archivo_cod_archivo}/view" onerror="retryThumbnail(this);">` :
                             `<i class="fas fa-file" style="font-size: 40px; color: var(--primary);"></i>`
                         }
                     </div>
@@ -1119,15 +1265,14 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Los totales salen del resumen diario de reportes (no dependen de cuántas páginas se cargaron);
+    // varios cambios seguidos piden un solo resumen
+    let statsTimer = null;
+
     function updateStats() {
-        if (assignedTickets) assignedTickets.textContent = myTickets.length;
-        
-        const pending = myTickets.filter(ticket => ticket.ticket_est_ticket.trim() === 'PE').length;
-        const finished = myTickets.filter(ticket => ticket.ticket_est_ticket.trim() === 'FN').length;
-        
-        if (pendingTickets) pendingTickets.textContent = pending;
-        if (finishedTickets) finishedTickets.textContent = finished;
-        
+        clearTimeout(statsTimer);
+        statsTimer = setTimeout(refreshStats, 1000);
+
         // Calculate total files
         if (totalFiles) {
             const totalFilesCount = myTickets.reduce((total, ticket) => {
@@ -1137,6 +1282,20 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    async function refreshStats() {
+        try {
+            const params = new URLSearchParams({ granularity: 'month', assignee: user.username });
+            const response = await fetch(`${API_BASE_URL}/api/reports/summary?${params}`);
+            const summary = await response.json();
+            if (!response.ok) throw new Error(summary.error || 'No se pudieron cargar los totales.');
+            if (assignedTickets) assignedTickets.textContent = summary.total.tickets;
+            if (pendingTickets) pendingTickets.textContent = summary.by_status.PE ? summary.by_status.PE.tickets : 0;
+            if (finishedTickets) finishedTickets.textContent = summary.by_status.FN ? summary.by_status.FN.tickets : 0;
+        } catch (error) {
+            console.error('Error al cargar los totales de tickets:', error);
+        }
+    }
+
     // Initialize
     fetchMyTickets();
 });
\ No newline at end of file
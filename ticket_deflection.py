@@ -0,0 +1,171 @@
+import collections
+import math
+import threading
+import zlib
+
+import numpy as np
+
+from kb_search import analyze
+
+
+class DeflectionIndex:
+    """
+    Sugerencias antes de crear un ticket: compara la descripción del problema con los casos
+    de la base de conocimiento y con tickets ya resueltos.
+
+    Cada texto se convierte en un vector TF-IDF con "hashing trick" (las raíces de analyze()
+    van a `dimensions` columnas con signo, sin vocabulario que mantener). Los tickets viven en
+    una matriz fija de `capacity` filas guardada por columnas: la consulta solo tiene unas
+    pocas columnas distintas de cero, así que el puntaje es M[:, columnas] @ q y no recorre
+    la matriz entera.
+
+    Agregar o quitar un ticket toca solo su fila y las frecuencias de documento; las filas ya
+    guardadas conservan el IDF con el que se calcularon (no hay reconstrucción). Al llenarse,
+    el ticket más antiguo deja su fila al nuevo. La parte de la base de conocimiento se
+    recalcula (son pocas filas) cuando su índice se recarga.
+    """
+
+    def __init__(self, knowledge_base=None, dimensions=2048, capacity=5000):
+        self.knowledge_base = knowledge_base
+        self.dimensions = dimensions
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((capacity, dimensions), dtype=np.float32, order='F')
+        self._results = [None] * capacity
+        self._buckets = [None] * capacity       # columnas que la fila sumó a las frecuencias
+        self._rows = collections.OrderedDict()  # ticket_id -> fila, del más antiguo al más nuevo
+        self._free = list(range(capacity - 1, -1, -1))
+        self._df = np.zeros(dimensions, dtype=np.float64)
+        self._documents = 0
+        self._kb_version = None
+        self._kb_matrix = np.zeros((0, dimensions), dtype=np.float32, order='F')
+        self._kb_results = []
+        self._kb_buckets = []
+
+    def add(self, ticket_id, text, result):
+        """Agregar (o reemplazar) un ticket resuelto"""
+        self.add_many([(ticket_id, text, result)])
+
+    def add_many(self, items):
+        """
+        Agregar varios tickets [(ticket_id, texto, resultado)], del más antiguo al más nuevo.
+        Las frecuencias se actualizan con todo el lote antes de calcular los vectores.
+        """
+        items = list(items)[-self.capacity:]
+        with self._lock:
+            prepared = []
+            for ticket_id, text, result in items:
+                if ticket_id in self._rows:
+                    self._remove_locked(ticket_id)
+                terms = self._terms(text)
+                if terms is None:
+                    continue
+                self._count_locked(terms[0], 1)
+                prepared.append((ticket_id, terms, result))
+            for ticket_id, (buckets, values), result in prepared:
+                if ticket_id in self._rows:  # repetido dentro del mismo lote
+                    self._remove_locked(ticket_id)
+                if not self._free:
+                    self._remove_locked(next(iter(self._rows)))
+                row = self._free.pop()
+                self._matrix[row, :] = 0
+                self._matrix[row, buckets] = self._weigh_locked(buckets, values)
+                self._results[row] = dict(result, ticket_id=ticket_id)
+                self._buckets[row] = buckets
+                self._rows[ticket_id] = row
+
+    def remove(self, ticket_id):
+        """Quitar un ticket (por ejemplo, si se reabre)"""
+        with self._lock:
+            if ticket_id in self._rows:
+                self._remove_locked(ticket_id)
+
+    def search(self, text, limit=3, min_score=0.2):
+        """Casos y tickets más parecidos al texto: [{..., "score"}] con score = similitud coseno"""
+        self._sync_knowledge_base()
+        terms = self._terms(text)
+        if terms is None:
+            return []
+        buckets, values = terms
+        with self._lock:
+            query = self._weigh_locked(buckets, values)
+            ticket_scores = self._matrix[:, buckets] @ query
+            kb_scores = self._kb_matrix[:, buckets] @ query
+            results = self._kb_results + self._results
+            scores = np.concatenate([kb_scores, ticket_scores])
+            count = min(limit, len(scores))
+            if count <= 0:
+                return []
+            top = np.argpartition(-scores, count - 1)[:count]
+            top = top[np.argsort(-scores[top])]
+            return [dict(results[i], score=round(float(scores[i]), 4))
+                    for i in top if scores[i] >= min_score and results[i] is not None]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tickets": len(self._rows),
+                "capacity": self.capacity,
+                "knowledge_base": len(self._kb_results),
+                "dimensions": self.dimensions,
+            }
+
+    def _terms(self, text):
+        """Columnas y pesos TF (1 + log tf, con signo) del texto, o None si no hay términos"""
+        counts = collections.Counter(analyze(text))
+        if not counts:
+            return None
+        columns = collections.defaultdict(float)
+        for term, tf in counts.items():
+            h = zlib.crc32(term.encode('utf-8'))
+            # El bit alto decide el signo: las colisiones tienden a anularse en vez de sumarse
+            sign = 1.0 if h & 0x80000000 else -1.0
+            columns[h % self.dimensions] += sign * (1.0 + math.log(tf))
+        buckets = np.fromiter(columns.keys(), dtype=np.intp, count=len(columns))
+        values = np.fromiter(columns.values(), dtype=np.float64, count=len(columns))
+        return buckets, values
+
+    def _weigh_locked(self, buckets, values):
+        idf = np.log((1.0 + self._documents) / (1.0 + self._df[buckets])) + 1.0
+        vector = values * idf
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.astype(np.float32)
+
+    def _count_locked(self, buckets, delta):
+        self._df[buckets] += delta
+        self._documents += delta
+
+    def _remove_locked(self, ticket_id):
+        row = self._rows.pop(ticket_id)
+        self._count_locked(self._buckets[row], -1)
+        self._matrix[row, :] = 0
+        self._results[row] = None
+        self._buckets[row] = None
+        self._free.append(row)
+
+    def _sync_knowledge_base(self):
+        if self.knowledge_base is None:
+            return
+        version, documents = self.knowledge_base.documents()
+        if version == self._kb_version:
+            return
+        with self._lock:
+            if version == self._kb_version:
+                return
+            for buckets in self._kb_buckets:
+                self._count_locked(buckets, -1)
+            prepared = []
+            for _, text, result in documents:
+                terms = self._terms(text)
+                if terms is not None:
+                    self._count_locked(terms[0], 1)
+                    prepared.append((terms, result))
+            matrix = np.zeros((len(prepared), self.dimensions), dtype=np.float32, order='F')
+            for row, ((buckets, values), _) in enumerate(prepared):
+                matrix[row, buckets] = self._weigh_locked(buckets, values)
+            self._kb_matrix = matrix
+            self._kb_results = [result for _, result in prepared]
+            self._kb_buckets = [buckets for (buckets, _), _ in prepared]
+            self._kb_version = version
@@ -0,0 +1,159 @@
+import collections
+import datetime
+import json
+import threading
+import uuid
+
+try:
+    import redis
+except ImportError:  # solo hace falta con una URL redis://...
+    redis = None
+
+ADMINS_ROOM = 'admins'
+
+# Tipos de evento que reciben los clientes en 'ticket_event'
+CREATED = 'created'
+STATUS_CHANGED = 'status_changed'
+ASSIGNED = 'assigned'
+REASSIGNED = 'reassigned'
+RATED = 'rated'
+ATTACHMENT_ADDED = 'attachment_added'
+
+
+def user_room(username):
+    return f"user:{username}"
+
+
+class TicketEventStream:
+    """
+    Flujo de eventos de tickets sobre Socket.IO (un solo proceso).
+
+    Cada evento lleva un número de secuencia creciente y el identificador del flujo
+    (cambia al reiniciar el servidor). Los últimos eventos se guardan en memoria para
+    que un cliente que se desconectó pueda pedir los que se perdió con replay().
+    Con varios workers se usa RedisTicketEventStream.
+    """
+
+    def __init__(self, socketio, buffer_size=1000):
+        self._socketio = socketio
+        self._lock = threading.Lock()
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._seq = 0
+        self.stream_id = uuid.uuid4().hex
+
+    def publish(self, event_type, ticket_id, changes, requester=None):
+        """Emitir un evento a la sala de administradores y a la del usuario que abrió el ticket."""
+        with self._lock:
+            self._seq += 1
+            event = {
+                'seq': self._seq,
+                'stream': self.stream_id,
+                'type': event_type,
+                'ticket_id': ticket_id,
+                'changes': changes,
+                'requester': requester,
+                'timestamp': datetime.datetime.now().isoformat(),
+            }
+            self._buffer.append(event)
+        self._socketio.emit('ticket_event', event, to=ADMINS_ROOM)
+        if requester:
+            self._socketio.emit('ticket_event', event, to=user_room(requester))
+        return event
+
+    def replay(self, stream_id, since_seq, requester=None):
+        """
+        Eventos posteriores a since_seq. Si el flujo cambió o ya no están en memoria,
+        devuelve reset=True y el cliente debe recargar la lista completa.
+        requester limita la respuesta a los eventos de los tickets de ese usuario.
+        """
+        with self._lock:
+            current = self._seq
+            oldest = self._buffer[0]['seq'] if self._buffer else current + 1
+            if stream_id != self.stream_id or since_seq > current or since_seq + 1 < oldest:
+                return {'stream': self.stream_id, 'seq': current, 'reset': True, 'events': []}
+            events = [e for e in self._buffer if e['seq'] > since_seq]
+        if requester:
+            events = [e for e in events if e['requester'] == requester]
+        return {'stream': self.stream_id, 'seq': current, 'reset': False, 'events': events}
+
+
+class RedisTicketEventStream:
+    """
+    El mismo flujo compartido entre workers: la secuencia, el identificador del flujo y los
+    últimos eventos viven en Redis, así un cliente que se reconecta a otro worker puede
+    seguir desde su número de secuencia.
+
+    La secuencia se asigna y el evento se guarda en un solo script (atómico): quien pida
+    replay() nunca ve un número sin su evento. Si las llaves se pierden (Redis reiniciado
+    sin persistencia), el script crea un flujo nuevo y los clientes recargan.
+    """
+
+    # KEYS: secuencia, eventos (zset por secuencia), identificador del flujo
+    # ARGV: evento en JSON, identificador para un flujo nuevo, eventos a conservar
+    # Cada miembro del zset es "seq:json" para que dos eventos iguales no se pisen.
+    _PUBLISH = """
+        local stream = redis.call('GET', KEYS[3])
+        if not stream then
+            stream = ARGV[2]
+            redis.call('SET', KEYS[3], stream)
+            redis.call('DEL', KEYS[1], KEYS[2])
+        end
+        local seq = redis.call('INCR', KEYS[1])
+        redis.call('ZADD', KEYS[2], seq, seq .. ':' .. ARGV[1])
+        redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[3]) + 1))
+        return {stream, seq}
+    """
+
+    def __init__(self, socketio, url, buffer_size=1000, prefix='soporte_ti:ticket_events'):
+        if redis is None:
+            raise RuntimeError("El flujo de eventos en Redis requiere el paquete 'redis'")
+        self._socketio = socketio
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.buffer_size = buffer_size
+        self._keys = [f"{prefix}:seq", f"{prefix}:events", f"{prefix}:stream"]
+        self._publish = self._client.register_script(self._PUBLISH)
+
+    def publish(self, event_type, ticket_id, changes, requester=None):
+        """Emitir un evento a la sala de administradores y a la del usuario que abrió el ticket."""
+        event = {
+            'type': event_type,
+            'ticket_id': ticket_id,
+            'changes': changes,
+            'requester': requester,
+            'timestamp': datetime.datetime.now().isoformat(),
+        }
+        payload = json.dumps(event, default=str)
+        stream, seq = self._publish(keys=self._keys, args=[payload, uuid.uuid4().hex, self.buffer_size])
+        event = {'seq': int(seq), 'stream': stream, **json.loads(payload)}
+        self._socketio.emit('ticket_event', event, to=ADMINS_ROOM)
+        if requester:
+            self._socketio.emit('ticket_event', event, to=user_room(requester))
+        return event
+
+    def replay(self, stream_id, since_seq, requester=None):
+        """Igual que TicketEventStream.replay(), leyendo de Redis en una transacción"""
+        seq_key, events_key, stream_key = self._keys
+        pipe = self._client.pipeline(transaction=True)
+        pipe.get(stream_key)
+        pipe.get(seq_key)
+        pipe.zrange(events_key, 0, 0, withscores=True)
+        pipe.zrangebyscore(events_key, f"({int(since_seq)}", '+inf', withscores=True)
+        stream, current, oldest, events = pipe.execute()
+        current = int(current or 0)
+        oldest = int(oldest[0][1]) if oldest else current + 1
+        if stream is None or stream_id != stream or since_seq > current or since_seq + 1 < oldest:
+            return {'stream': stream, 'seq': current, 'reset': True, 'events': []}
+        events = [
+            {'seq': int(score), 'stream': stream, **json.loads(member.partition(':')[2])}
+            for member, score in events
+        ]
+        if requester:
+            events = [e for e in events if e['requester'] == requester]
+        return {'stream': stream, 'seq': current, 'reset': False, 'events': events}
+
+
+def create_ticket_stream(socketio, url=None, buffer_size=1000):
+    """Flujo según la URL: redis://... compartido entre workers; vacío, en memoria."""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisTicketEventStream(socketio, url, buffer_size=buffer_size)
+    return TicketEventStream(socketio, buffer_size=buffer_size)
@@ -0,0 +1,166 @@
+import base64
+import datetime
+import json
+import zlib
+
+# Columnas que devuelve el listado de administración
+TICKET_LIST_COLUMNS = [
+    'ticket_cod_ticket', 'ticket_id_ticket', 'ticket_asu_ticket', 'ticket_est_ticket',
+    'ticket_des_ticket', 'ticket_fec_ticket', 'ticket_tusua_ticket', 'ticket_asignado_a',
+    'ticket_tip_ticket', 'ticket_calificacion', 'ticket_ver_ticket', 'ticket_incidente',
+]
+
+# Columnas de la exportación: (columna, encabezado del CSV)
+TICKET_EXPORT_COLUMNS = [
+    ('ticket_id_ticket', 'Ticket ID'),
+    ('ticket_asu_ticket', 'Asunto'),
+    ('ticket_tusua_ticket', 'Usuario'),
+    ('ticket_asignado_a', 'Técnico'),
+    ('ticket_tip_ticket', 'Tipo'),
+    ('ticket_est_ticket', 'Estado'),
+    ('ticket_fec_ticket', 'Fecha'),
+    ('ticket_calificacion', 'Calificación'),
+    ('ticket_des_ticket', 'Descripción'),
+]
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Si un cliente quedó tan atrás que hay más cambios que esto, se le pide recargar todo
+MAX_DELTA_ROWS = 1000
+
+
+def _parse_date_bound(value, name, end=False):
+    """Acepta 'YYYY-MM-DD' o ISO completo. Para fechas sin hora, el límite final incluye todo el día."""
+    try:
+        if len(value) == 10:
+            day = datetime.date.fromisoformat(value)
+            moment = datetime.datetime.combine(day, datetime.time.min)
+            return moment + datetime.timedelta(days=1) if end else moment
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Fecha inválida en '{name}': {value}")
+
+
+def build_ticket_filters(args):
+    """
+    Traducir los filtros del query string a condiciones SQL parametrizadas.
+
+    Filtros: status (lista separada por comas), assignee, requester, type, date_from, date_to.
+    assignee=none filtra los tickets sin asignar. Devuelve (lista de condiciones, lista de parámetros).
+    """
+    conditions, params = [], []
+
+    status = args.get('status')
+    if status:
+        statuses = [s.strip() for s in status.split(',') if s.strip()]
+        conditions.append("TRIM(ticket_est_ticket) = ANY(%s)")
+        params.append(statuses)
+
+    assignee = args.get('assignee')
+    if assignee == 'none':
+        conditions.append("ticket_asignado_a IS NULL")
+    elif assignee:
+        conditions.append("ticket_asignado_a = %s")
+        params.append(assignee)
+
+    requester = args.get('requester')
+    if requester:
+        conditions.append("ticket_tusua_ticket = %s")
+        params.append(requester)
+
+    ticket_type = args.get('type')
+    if ticket_type:
+        conditions.append("ticket_tip_ticket = %s")
+        params.append(ticket_type)
+
+    date_from = args.get('date_from')
+    if date_from:
+        conditions.append("ticket_fec_ticket >= %s")
+        params.append(_parse_date_bound(date_from, 'date_from'))
+
+    date_to = args.get('date_to')
+    if date_to:
+        conditions.append("ticket_fec_ticket < %s" if len(date_to) == 10 else "ticket_fec_ticket <= %s")
+        params.append(_parse_date_bound(date_to, 'date_to', end=True))
+
+    return conditions, params
+
+
+def parse_page_size(value):
+    """Tamaño de página pedido, acotado a MAX_PAGE_SIZE."""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValueError(f"'limit' debe ser un número entero: {value}")
+    if size < 1:
+        raise ValueError("'limit' debe ser mayor que cero")
+    return min(size, MAX_PAGE_SIZE)
+
+
+def encode_cursor(ticket_fec, ticket_cod):
+    """Cursor opaco con la posición (fecha, código) del último ticket entregado."""
+    raw = json.dumps([ticket_fec.isoformat(), ticket_cod]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        fec, cod = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.datetime.fromisoformat(fec), int(cod)
+    except Exception:
+        raise ValueError("Cursor de paginación inválido")
+
+
+def keyset_condition(cursor):
+    """Condición para continuar después del cursor con orden (fecha DESC, código DESC)."""
+    fec, cod = decode_cursor(cursor)
+    return "(ticket_fec_ticket, ticket_cod_ticket) < (%s, %s)", [fec, cod]
+
+
+def parse_since(value):
+    """Marca de agua 'since' (id de transacción) enviada por el cliente."""
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'since' debe ser un número entero: {value}")
+    if since < 0:
+        raise ValueError("'since' no puede ser negativo")
+    return since
+
+
+def sync_state(cur):
+    """
+    (estado, marca de agua) de la tabla de tickets.
+
+    El estado (para el ETag) es la versión más alta entre tickets y borrados más el xmin y
+    las transacciones en curso de la instantánea. La versión sola no basta: se toma con
+    nextval() antes del commit, así que una transacción con versión menor puede confirmarse
+    después que otra con versión mayor sin que el máximo cambie; mientras tanto esa
+    transacción figura en curso, y al terminar la lista cambia (y con ella el ETag).
+    La marca de agua es el xmin de la instantánea: toda transacción con id menor ya terminó y
+    sus cambios se ven ahora, así que en la próxima consulta basta pedir lo escrito por
+    transacciones con id >= marca. Lo que quedaba en curso (aunque tenga una versión menor
+    que otras ya confirmadas) llega entonces; algunas filas pueden repetirse y el cliente las
+    reemplaza por id. Debe calcularse antes de leer los tickets.
+    """
+    cur.execute("""
+        WITH s AS (SELECT pg_current_snapshot() AS snap)
+        SELECT GREATEST(
+            (SELECT COALESCE(MAX(ticket_ver_ticket), 0) FROM soporte_ti.stticket),
+            (SELECT COALESCE(MAX(borrado_ver_ticket), 0) FROM soporte_ti.stticket_borrados)
+        ), pg_snapshot_xmin(s.snap)::text::bigint,
+        (SELECT string_agg(x::text, ',' ORDER BY x::text::bigint) FROM pg_snapshot_xip(s.snap) AS x)
+        FROM s
+    """)
+    version, watermark, in_progress = cur.fetchone()
+    state = f"{version}-{watermark}-{zlib.crc32((in_progress or '').encode()):08x}"
+    return state, watermark
+
+
+def snapshot_xmin(cur):
+    """xmin de la instantánea actual: las transacciones con id menor ya terminaron (ver sync_state)."""
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+    return cur.fetchone()[0]
@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import threading
+
+OPEN_EXCLUDED_STATUS = 'FN'  # Un ticket cuenta como carga mientras no esté finalizado
+
+
+def is_open_status(status):
+    return (status or '').strip() != OPEN_EXCLUDED_STATUS
+
+
+class WorkloadIndex:
+    """
+    Índice en memoria de tickets abiertos por administrador para la asignación automática.
+
+    Mantiene un min-heap de (tickets abiertos, última asignación, admin) con borrado perezoso:
+    cada cambio empuja una entrada nueva y las viejas se descartan al llegar a la cima.
+    pick() elige y reserva en la misma sección crítica, así dos tickets simultáneos
+    no caen en el mismo admin y las ráfagas se reparten en turno rotativo entre empatados.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}      # admin -> tickets abiertos
+        self._last = {}        # admin -> secuencia de su última asignación (desempate)
+        self._eligible = frozenset()
+        self._heap = []
+        self._seq = itertools.count(1)
+        self.seeded = False
+
+    def load(self, counts):
+        """Reemplazar los contadores con los de la base de datos (arranque y reconciliación)."""
+        with self._lock:
+            self._counts = {admin: n for admin, n in counts.items() if admin}
+            self.seeded = True
+            self._rebuild_locked()
+
+    def pick(self, admins):
+        """Elegir el admin con menos tickets abiertos entre `admins` y sumarle uno. None si no hay admins."""
+        with self._lock:
+            eligible = frozenset(a for a in admins if a)
+            if not eligible:
+                return None
+            if eligible != self._eligible:
+                self._eligible = eligible
+                self._rebuild_locked()
+            while self._heap:
+                count, last, admin = self._heap[0]
+                if self._is_current_locked(count, last, admin):
+                    break
+                heapq.heappop(self._heap)
+            else:
+                self._rebuild_locked()
+            admin = self._heap[0][2]
+            self._change_locked(admin, 1, assigned=True)
+            return admin
+
+    def increment(self, admin, n=1):
+        if admin:
+            with self._lock:
+                self._change_locked(admin, n)
+
+    def decrement(self, admin, n=1):
+        if admin:
+            with self._lock:
+                self._change_locked(admin, -n)
+
+    def on_assigned(self, old_admin, new_admin, status):
+        """Un ticket cambió de responsable."""
+        if old_admin == new_admin or not is_open_status(status):
+            return
+        with self._lock:
+            if old_admin:
+                self._change_locked(old_admin, -1)
+            if new_admin:
+                self._change_locked(new_admin, 1)
+
+    def on_status_changed(self, admin, old_status, new_status):
+        """Un ticket cambió de estado: solo importa si entra o sale de 'finalizado'."""
+        was_open, is_open = is_open_status(old_status), is_open_status(new_status)
+        if admin and was_open != is_open:
+            with self._lock:
+                self._change_locked(admin, 1 if is_open else -1)
+
+    def count(self, admin):
+        with self._lock:
+            return self._counts.get(admin, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    # --- Internos (llamar con el candado tomado) ---
+
+    def _change_locked(self, admin, delta, assigned=False):
+        self._counts[admin] = max(0, self._counts.get(admin, 0) + delta)
+        if assigned:
+            self._last[admin] = next(self._seq)
+        if admin in self._eligible:
+            heapq.heappush(self._heap, (self._counts[admin], self._last.get(admin, 0), admin))
+            if len(self._heap) > 4 * len(self._eligible) + 16:
+                self._rebuild_locked()
+
+    def _is_current_locked(self, count, last, admin):
+        return (admin in self._eligible
+                and self._counts.get(admin, 0) == count
+                and self._last.get(admin, 0) == last)
+
+    def _rebuild_locked(self):
+        self._heap = [(self._counts.get(a, 0), self._last.get(a, 0), a) for a in self._eligible]
+        heapq.heapify(self._heap)